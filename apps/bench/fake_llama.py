@@ -0,0 +1,256 @@
+"""
+Simulated llama.cpp server for offline benchmarks.
+
+Speaks enough of the OpenAI-compatible API used by apps/llm:
+
+- `GET /v1/models`
+- `POST /v1/chat/completions` (plain and SSE streaming), including packed
+  `[n]` segment prompts, `cache_prompt` / `id_slot` and llama-server's
+  `timings` block;
+- `GET /stats` and `POST /stats/reset`: call counters for the benchmark.
+
+Latency model (per request): prompt evaluation costs `prompt_ms` per
+uncached prompt token, generation costs `token_ms` per output token, and
+at most `parallel` requests are processed at once (like `--parallel`).
+Tokens are approximated as 4 characters.
+
+Single translations can be followed by `chatter` tokens of explanation, as
+small models tend to do; `stop` sequences and `max_tokens` end the reply
+like in llama-server (`finish_reason` "stop" or "length").
+
+    python fake_llama.py --port 7001 --token-ms 20 --prompt-ms 0.5 --parallel 2 --chatter 20
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_TARGET_RE = re.compile(r"Target language:\s*(\S+)")
+_SEGMENT_RE = re.compile(r"^\[(\d+)\]\s?(.*)$")
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class _FakeLlama:
+    def __init__(self, *, token_ms: float, prompt_ms: float, parallel: int, chatter: int = 0):
+        self.token_ms = token_ms
+        self.chatter = max(0, chatter)
+        self.prompt_ms = prompt_ms
+        self.parallel = max(1, parallel)
+        self._slots = threading.Semaphore(self.parallel)
+        self._lock = threading.Lock()
+        self._slot_prefix: dict[int, str] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stats = {
+                "requests": 0,
+                "stream_requests": 0,
+                "translation_requests": 0,
+                "segments": 0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "completion_tokens": 0,
+                "max_concurrency": 0,
+            }
+            self._active = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    # Deterministic "translation": the target language code as a prefix.
+    def _reply(self, messages: list[dict]) -> tuple[str, int]:
+        system = messages[0]["content"] if messages and messages[0].get("role") == "system" else ""
+        user = messages[-1]["content"] if messages else ""
+        if "<<TEXT_TO_TRANSLATE>>" not in user:
+            return " ".join(["ok"] * 24), 0
+        m = _TARGET_RE.search(system)
+        tgt = m.group(1) if m else "xx"
+        body = user.split("<<TEXT_TO_TRANSLATE>>", 1)[1].split("<<END_TEXT>>", 1)[0].strip("\n")
+        lines = body.split("\n")
+        segments = [_SEGMENT_RE.match(line) for line in lines]
+        if "segments" in system and all(segments):
+            out = [f"[{s.group(1)}] {tgt}:{s.group(2)}" for s in segments if s]
+            return "\n".join(out), len(out)
+        reply = f"{tgt}:{body}"
+        if self.chatter:
+            reply += "\n\nThis means " + " ".join(["roughly"] * self.chatter)
+        return reply, 1
+
+    # Applies `stop` and `max_tokens` like llama-server.
+    @staticmethod
+    def _limit(reply: str, payload: dict) -> tuple[str, str]:
+        cut = [reply.find(s) for s in payload.get("stop") or [] if s and s in reply]
+        if cut:
+            reply = reply[: min(cut)]
+        max_tokens = payload.get("max_tokens")
+        if isinstance(max_tokens, int) and _tokens(reply) > max_tokens:
+            return reply[: max_tokens * 4], "length"
+        return reply, "stop"
+
+    # Returns the reply, a llama-server style `timings` block and the
+    # finish reason.
+    def complete(self, payload: dict) -> tuple[str, dict, str]:
+        messages = payload.get("messages") or []
+        reply, segments = self._reply(messages)
+        reply, finish_reason = self._limit(reply, payload)
+        system = messages[0]["content"] if messages and messages[0].get("role") == "system" else ""
+        prompt_total = sum(_tokens(m.get("content") or "") for m in messages)
+
+        slot = payload.get("id_slot")
+        cached = 0
+        with self._lock:
+            if isinstance(slot, int) and slot >= 0:
+                if payload.get("cache_prompt") and self._slot_prefix.get(slot) == system and system:
+                    cached = _tokens(system)
+                self._slot_prefix[slot] = system
+            self.stats["requests"] += 1
+            self.stats["stream_requests"] += 1 if payload.get("stream") else 0
+            self.stats["translation_requests"] += 1 if segments else 0
+            self.stats["segments"] += segments
+            self.stats["prompt_tokens"] += prompt_total - cached
+            self.stats["cached_tokens"] += cached
+            self.stats["completion_tokens"] += _tokens(reply)
+
+        prompt_n = prompt_total - cached
+        timings = {
+            "prompt_n": prompt_n,
+            "prompt_ms": prompt_n * self.prompt_ms,
+            "cache_n": cached,
+            "predicted_n": _tokens(reply),
+            "predicted_ms": _tokens(reply) * self.token_ms,
+        }
+        return reply, timings, finish_reason
+
+    def acquire(self) -> None:
+        self._slots.acquire()
+        with self._lock:
+            self._active += 1
+            self.stats["max_concurrency"] = max(self.stats["max_concurrency"], self._active)
+
+    def release(self) -> None:
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+
+def _make_handler(fake: _FakeLlama):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, obj: dict, status: int = 200) -> None:
+            body = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/v1/models":
+                self._json({"object": "list", "data": [{"id": "fake-llama"}]})
+            elif self.path == "/stats":
+                self._json(fake.snapshot())
+            else:
+                self._json({"error": "not found"}, 404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if self.path == "/stats/reset":
+                fake.reset()
+                self._json({"ok": True})
+                return
+            if self.path != "/v1/chat/completions":
+                self._json({"error": "not found"}, 404)
+                return
+
+            fake.acquire()
+            try:
+                reply, timings, finish_reason = fake.complete(payload)
+                time.sleep(timings["prompt_ms"] / 1000.0)
+                if payload.get("stream"):
+                    self._stream(reply, timings, finish_reason)
+                else:
+                    time.sleep(timings["predicted_ms"] / 1000.0)
+                    self._json({
+                        "object": "chat.completion",
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": finish_reason}],
+                        "usage": {"prompt_tokens": timings["prompt_n"] + timings["cache_n"], "completion_tokens": timings["predicted_n"]},
+                        "timings": timings,
+                    })
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                fake.release()
+
+        # One SSE chunk per ~4-character token; a closed connection stops
+        # generation, like llama-server.
+        def _stream(self, reply: str, timings: dict, finish_reason: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            for i in range(0, len(reply), 4):
+                chunk = {"choices": [{"index": 0, "delta": {"content": reply[i : i + 4]}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+                time.sleep(fake.token_ms / 1000.0)
+            final = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}], "timings": timings}
+            self.wfile.write(f"data: {json.dumps(final)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+# Starts the server in a daemon thread and returns it.
+def serve(
+    port: int,
+    *,
+    token_ms: float,
+    prompt_ms: float,
+    parallel: int,
+    chatter: int = 0,
+) -> tuple[ThreadingHTTPServer, _FakeLlama]:
+    fake = _FakeLlama(token_ms=token_ms, prompt_ms=prompt_ms, parallel=parallel, chatter=chatter)
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), _make_handler(fake))
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="fake-llama", daemon=True).start()
+    return httpd, fake
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Simulated llama.cpp server")
+    ap.add_argument("--port", type=int, default=7001)
+    ap.add_argument("--token-ms", type=float, default=20.0, help="generation cost per output token")
+    ap.add_argument("--prompt-ms", type=float, default=0.5, help="evaluation cost per uncached prompt token")
+    ap.add_argument("--parallel", type=int, default=1, help="concurrent slots")
+    ap.add_argument("--chatter", type=int, default=0, help="explanation tokens after single translations")
+    args = ap.parse_args()
+    httpd, _ = serve(
+        args.port,
+        token_ms=args.token_ms,
+        prompt_ms=args.prompt_ms,
+        parallel=args.parallel,
+        chatter=args.chatter,
+    )
+    print(f"fake llama-server on http://127.0.0.1:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
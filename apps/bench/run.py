@@ -0,0 +1,405 @@
+"""
+Offline benchmark runner for the translation services.
+
+By default it starts the simulated llama.cpp server (fake_llama.py) and the
+LLM service (apps/llm, via uvicorn) pointed at it, replays a set of
+workloads and writes a JSON report:
+
+    python run.py --out report.json
+    python run.py --workloads page_load,repeated --clients 8 --out after.json --compare report.json
+
+Use `--llm-url` to benchmark an already running service instead, and
+`--mt-url` to add the MT workload against a running apps/mt service.
+
+Workloads:
+
+- page_load: several auto-translator clients loading the same page; each
+  sends one /translate_batch_stream at a time, critical first (batches of
+  10 / 8 / 4 like installAutoTranslator.ts);
+- repeated:  /translate over a Zipf-distributed vocabulary (cache reuse);
+- mixed:     concurrent /translate calls with mixed priorities;
+- chat:      /chat_stream sessions (time to first token, total time);
+- mt:        /translate and /translate_batch against the MT service.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from fake_llama import serve
+
+BASE = Path(__file__).parent.resolve()
+LLM_DIR = BASE.parent / "llm"
+
+PRIORITIES = ("critical", "normal", "background")
+BATCH_SIZES = {"critical": 10, "normal": 8, "background": 4}
+
+_WORDS = (
+    "account settings profile save cancel open close delete edit search filter results "
+    "order invoice payment shipping address language theme notifications privacy help "
+    "dashboard report export import upload download share message inbox archive project "
+    "team member role permission billing plan upgrade review summary details history"
+).split()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _summary(values_ms: list[float]) -> dict:
+    return {
+        "count": len(values_ms),
+        "mean": round(sum(values_ms) / len(values_ms), 2) if values_ms else None,
+        "p50": _round(_percentile(values_ms, 0.50)),
+        "p95": _round(_percentile(values_ms, 0.95)),
+        "p99": _round(_percentile(values_ms, 0.99)),
+    }
+
+
+def _round(v: float | None) -> float | None:
+    return None if v is None else round(v, 2)
+
+
+# UI-like strings: short labels for headings, sentences for body text.
+# `nonce` keeps runs against a long-lived service from hitting its cache.
+def _make_string(rng: random.Random, priority: str, nonce: str) -> str:
+    if priority == "critical":
+        n = rng.randint(1, 3)
+    elif priority == "normal":
+        n = rng.randint(3, 12)
+    else:
+        n = rng.randint(10, 40)
+    words = [rng.choice(_WORDS) for _ in range(n)]
+    text = " ".join(words).capitalize()
+    if n > 6:
+        text += "."
+    return f"{text} {nonce}"
+
+
+class _Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = {}
+        self.items = 0
+        self.errors = 0
+
+    def add(self, kind: str, ms: float) -> None:
+        self.latencies.setdefault(kind, []).append(ms)
+        self.items += 1
+
+    def report(self, duration: float) -> dict:
+        return {
+            "duration_s": round(duration, 3),
+            "items": self.items,
+            "errors": self.errors,
+            "throughput_items_per_s": round(self.items / duration, 2) if duration > 0 else None,
+            "latency_ms": {k: _summary(v) for k, v in sorted(self.latencies.items())},
+        }
+
+
+async def _page_load(client: httpx.AsyncClient, args, rng: random.Random, nonce: str) -> _Recorder:
+    page = [(p, _make_string(rng, p, nonce)) for p in rng.choices(PRIORITIES, weights=(1, 4, 5), k=args.page_strings)]
+    rec = _Recorder()
+
+    async def one_client(cid: int) -> None:
+        queues = {p: [t for q, t in page if q == p] for p in PRIORITIES}
+        # Different clients discover the page's strings in a different order.
+        local = random.Random(cid)
+        for q in queues.values():
+            local.shuffle(q)
+        while any(queues.values()):
+            prio = next(p for p in PRIORITIES if queues[p])
+            batch, queues[prio] = queues[prio][: BATCH_SIZES[prio]], queues[prio][BATCH_SIZES[prio] :]
+            items = [{"text": t, "src_lang": args.src, "tgt_lang": args.tgt, "priority": prio} for t in batch]
+            start = time.perf_counter()
+            try:
+                async with client.stream("POST", "/translate_batch_stream", json={"items": items}) as r:
+                    r.raise_for_status()
+                    async for line in r.aiter_lines():
+                        if not line.strip():
+                            continue
+                        obj = json.loads(line)
+                        if obj.get("error") or obj.get("translation") is None:
+                            rec.errors += 1
+                            continue
+                        rec.add(prio, (time.perf_counter() - start) * 1000)
+            except httpx.HTTPError:
+                rec.errors += len(items)
+
+    await asyncio.gather(*(one_client(i) for i in range(args.clients)))
+    return rec
+
+
+async def _translate_many(client: httpx.AsyncClient, requests: list[dict], concurrency: int, path: str = "/translate") -> _Recorder:
+    rec = _Recorder()
+    sem = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(body: dict) -> None:
+        async with sem:
+            start = time.perf_counter()
+            try:
+                r = await client.post(path, json=body)
+                r.raise_for_status()
+            except httpx.HTTPError:
+                rec.errors += 1
+                return
+            rec.add(body.get("priority", "normal"), (time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one(b) for b in requests))
+    return rec
+
+
+async def _repeated(client: httpx.AsyncClient, args, rng: random.Random, nonce: str) -> _Recorder:
+    vocab = [_make_string(rng, "normal", nonce) for _ in range(args.vocab)]
+    # Zipf-like popularity: a few strings dominate, like shared UI labels.
+    weights = [1.0 / (i + 1) for i in range(len(vocab))]
+    picks = rng.choices(vocab, weights=weights, k=args.requests)
+    body = [{"text": t, "src_lang": args.src, "tgt_lang": args.tgt, "priority": "normal"} for t in picks]
+    return await _translate_many(client, body, args.concurrency)
+
+
+async def _mixed(client: httpx.AsyncClient, args, rng: random.Random, nonce: str) -> _Recorder:
+    body = []
+    for prio in rng.choices(PRIORITIES, weights=(2, 5, 3), k=args.requests):
+        body.append({"text": _make_string(rng, prio, nonce), "src_lang": args.src, "tgt_lang": args.tgt, "priority": prio})
+    return await _translate_many(client, body, args.concurrency)
+
+
+async def _chat(client: httpx.AsyncClient, args, rng: random.Random, nonce: str) -> _Recorder:
+    rec = _Recorder()
+    sem = asyncio.Semaphore(max(1, args.concurrency))
+
+    async def one(i: int) -> None:
+        messages = [{"role": "user", "content": f"Question {i} {nonce}: {_make_string(rng, 'normal', nonce)}"}]
+        async with sem:
+            start = time.perf_counter()
+            first = None
+            try:
+                async with client.stream("POST", "/chat_stream", json={"messages": messages}) as r:
+                    r.raise_for_status()
+                    async for line in r.aiter_lines():
+                        if line.startswith("data:") and first is None:
+                            first = time.perf_counter()
+            except httpx.HTTPError:
+                rec.errors += 1
+                return
+            end = time.perf_counter()
+            rec.add("first_token", ((first or end) - start) * 1000)
+            rec.latencies.setdefault("total", []).append((end - start) * 1000)
+
+    await asyncio.gather(*(one(i) for i in range(args.chat_streams)))
+    return rec
+
+
+async def _mt(client: httpx.AsyncClient, args, rng: random.Random, nonce: str) -> _Recorder:
+    texts = [_make_string(rng, p, nonce) for p in rng.choices(PRIORITIES, weights=(1, 4, 5), k=args.requests)]
+    single = [{"text": t, "src_lang": args.mt_src, "tgt_lang": args.mt_tgt} for t in texts]
+    rec = await _translate_many(client, single, args.concurrency)
+    rec.latencies["single"] = rec.latencies.pop("normal", [])
+
+    # Fresh texts, 16 per /translate_batch call (one latency per call), so
+    # the MT sentence cache does not answer them.
+    more = [
+        {"text": _make_string(rng, p, nonce), "src_lang": args.mt_src, "tgt_lang": args.mt_tgt}
+        for p in rng.choices(PRIORITIES, weights=(1, 4, 5), k=args.requests)
+    ]
+    batches = [{"items": more[i : i + 16]} for i in range(0, len(more), 16)]
+    batch_rec = await _translate_many(client, batches, args.concurrency, path="/translate_batch")
+    rec.latencies["batch16"] = batch_rec.latencies.get("normal", [])
+    rec.items += sum(len(b["items"]) for b in batches) - 16 * batch_rec.errors
+    rec.errors += batch_rec.errors
+    return rec
+
+
+WORKLOADS = {
+    "page_load": _page_load,
+    "repeated": _repeated,
+    "mixed": _mixed,
+    "chat": _chat,
+}
+
+
+async def _backend_stats(fake_url: str | None) -> dict | None:
+    if not fake_url:
+        return None
+    async with httpx.AsyncClient(base_url=fake_url, timeout=5) as c:
+        return (await c.get("/stats")).json()
+
+
+def _backend_delta(before: dict | None, after: dict | None, items: int) -> dict | None:
+    if before is None or after is None:
+        return None
+    delta = {k: after[k] - before.get(k, 0) for k in after if k != "max_concurrency"}
+    delta["max_concurrency"] = after.get("max_concurrency")
+    # Items answered without reaching the model: cache hits, single-flight
+    # sharing and skipped strings.
+    delta["cache_hit_ratio"] = round(max(0.0, 1 - delta["segments"] / items), 4) if items else None
+    return delta
+
+
+async def _run(args, fake_url: str | None) -> dict:
+    rng = random.Random(args.seed)
+    nonce = args.nonce or f"r{random.randrange(16**6):06x}"
+    results: dict[str, dict] = {}
+    timeout = httpx.Timeout(args.timeout)
+    limits = httpx.Limits(max_connections=256, max_keepalive_connections=64)
+
+    async with httpx.AsyncClient(base_url=args.llm_url, timeout=timeout, limits=limits) as client:
+        for name in args.workloads:
+            if name == "mt":
+                continue
+            before = await _backend_stats(fake_url)
+            start = time.perf_counter()
+            rec = await WORKLOADS[name](client, args, rng, nonce)
+            report = rec.report(time.perf_counter() - start)
+            if name != "chat":
+                report["backend"] = _backend_delta(before, await _backend_stats(fake_url), rec.items)
+            results[name] = report
+            print(f"{name}: {report['items']} items in {report['duration_s']}s", file=sys.stderr)
+
+    if "mt" in args.workloads and args.mt_url:
+        async with httpx.AsyncClient(base_url=args.mt_url, timeout=timeout, limits=limits) as client:
+            start = time.perf_counter()
+            rec = await _mt(client, args, rng, nonce)
+            results["mt"] = rec.report(time.perf_counter() - start)
+
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BASE, text=True).strip()
+    except Exception:
+        return None
+
+
+def _wait_until_up(url: str, seconds: float) -> None:
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"service at {url} did not come up")
+
+
+# Starts apps/llm with uvicorn, talking to the fake backend only.
+def _start_llm_service(port: int, fake_url: str, parallel: int, extra_env: list[str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "LLAMA_BACKENDS": f"bench={fake_url}@{parallel}",
+        "TRANSLATION_CACHE_DB": "",
+        "LLM_ROUTER_MODE": env.get("LLM_ROUTER_MODE", "llm"),
+    })
+    for kv in extra_env:
+        k, _, v = kv.partition("=")
+        env[k] = v
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=LLM_DIR, env=env)
+
+
+# Prints the relative change of the headline numbers against a baseline.
+def _compare(report: dict, baseline_path: str) -> None:
+    base = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    print(f"compare {base.get('commit')} -> {report.get('commit')}", file=sys.stderr)
+    for name, cur in report["workloads"].items():
+        old = base.get("workloads", {}).get(name)
+        if not old:
+            continue
+        rows = [("throughput_items_per_s", old.get("throughput_items_per_s"), cur.get("throughput_items_per_s"))]
+        for kind, s in cur.get("latency_ms", {}).items():
+            o = old.get("latency_ms", {}).get(kind, {})
+            rows.append((f"{kind}.p95_ms", o.get("p95"), s.get("p95")))
+        for label, a, b in rows:
+            change = f"{(b - a) / a:+.1%}" if a and b is not None else "n/a"
+            print(f"  {name:10s} {label:28s} {a} -> {b} ({change})", file=sys.stderr)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the translation services against a simulated llama.cpp")
+    ap.add_argument("--workloads", default="page_load,repeated,mixed,chat,mt")
+    ap.add_argument("--llm-url", help="benchmark a running LLM service instead of starting one")
+    ap.add_argument("--mt-url", help="running MT service for the mt workload (skipped if unset)")
+    ap.add_argument("--src", default="en")
+    ap.add_argument("--tgt", default="it")
+    ap.add_argument("--mt-src", default="en")
+    ap.add_argument("--mt-tgt", default="it")
+    ap.add_argument("--clients", type=int, default=4, help="page_load: concurrent auto-translator clients")
+    ap.add_argument("--page-strings", type=int, default=60, help="page_load: strings per page")
+    ap.add_argument("--requests", type=int, default=200, help="repeated/mixed/mt: requests")
+    ap.add_argument("--vocab", type=int, default=40, help="repeated: distinct strings")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--chat-streams", type=int, default=8)
+    ap.add_argument("--token-ms", type=float, default=20.0)
+    ap.add_argument("--prompt-ms", type=float, default=0.5)
+    ap.add_argument("--parallel", type=int, default=1, help="fake llama-server slots")
+    ap.add_argument("--chatter", type=int, default=0, help="fake llama-server explanation tokens per translation")
+    ap.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the started service")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--nonce", default="", help="suffix that makes strings unique per run")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--out", help="write the JSON report here (default: stdout)")
+    ap.add_argument("--compare", help="baseline report to compare against")
+    args = ap.parse_args()
+    args.workloads = [w.strip() for w in args.workloads.split(",") if w.strip()]
+    unknown = [w for w in args.workloads if w not in WORKLOADS and w != "mt"]
+    if unknown:
+        ap.error(f"unknown workloads: {', '.join(unknown)}")
+
+    fake_url = None
+    service = None
+    if not args.llm_url:
+        fake_port, llm_port = _free_port(), _free_port()
+        serve(fake_port, token_ms=args.token_ms, prompt_ms=args.prompt_ms, parallel=args.parallel, chatter=args.chatter)
+        fake_url = f"http://127.0.0.1:{fake_port}"
+        service = _start_llm_service(llm_port, fake_url, args.parallel, args.env)
+        args.llm_url = f"http://127.0.0.1:{llm_port}"
+    try:
+        _wait_until_up(args.llm_url, 30)
+        workloads = asyncio.run(_run(args, fake_url))
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait(timeout=10)
+
+    report = {
+        "version": 1,
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "config": {
+            k: v for k, v in vars(args).items()
+            if k not in ("out", "compare")
+        } | {"simulated_backend": fake_url is not None},
+        "workloads": workloads,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        _compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+On-demand sampling profiler (`GET /admin/profile`).
+
+Samples the Python stacks of every thread of the running service
+(`sys._current_frames()`) at a fixed interval for a bounded time and
+returns them in the "collapsed stacks" format read by flamegraph.pl,
+speedscope and inferno:
+
+    thread;outer (file.py:12);inner (file.py:40) 17
+
+Nothing is installed or patched: the profiler is a thread that exists only
+while a profile runs, so it can be used in production without a restart.
+Threads idling in a wait (queue workers, the event loop selector) are left
+out unless `idle=True`. Only one profile runs at a time.
+
+Like tracing.py, the module is shared by apps/llm and apps/mt (apps/common).
+
+Configuration:
+
+    PROFILER=1                 # 0 disables /admin/profile
+    PROFILE_MAX_SECONDS=60
+    ADMIN_TOKEN=               # required: /admin/* checks X-Admin-Token
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Leaf frames from these modules mean the thread is waiting, not working.
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "socket.py", "ssl.py")
+
+_RUNNING = threading.Lock()
+
+
+# Raised when a profile is requested while another one is running.
+class ProfilerBusy(RuntimeError):
+    pass
+
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _idle(frame) -> bool:
+    return os.path.basename(frame.f_code.co_filename) in _IDLE_FILES
+
+
+# Samples all threads every `interval` seconds for `seconds` and returns the
+# collapsed stacks, most frequent first.
+def sample_stacks(seconds: float, *, interval: float = 0.005, idle: bool = False) -> str:
+    if not _RUNNING.acquire(blocking=False):
+        raise ProfilerBusy("a profile is already running")
+    try:
+        me = threading.get_ident()
+        names: dict[int, str] = {}
+        counts: Counter[str] = Counter()
+        end = time.monotonic() + max(0.0, seconds)
+        while time.monotonic() < end:
+            frames = sys._current_frames()
+            if any(ident not in names for ident in frames):
+                names = {t.ident: t.name for t in threading.enumerate() if t.ident is not None}
+            for ident, frame in frames.items():
+                if ident == me or (not idle and _idle(frame)):
+                    continue
+                stack = []
+                f = frame
+                while f is not None:
+                    stack.append(_label(f.f_code))
+                    f = f.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                counts[";".join(reversed(stack))] += 1
+            del frames
+            time.sleep(interval)
+        return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+    finally:
+        _RUNNING.release()
+
+
+def profiler_enabled() -> bool:
+    return os.environ.get("PROFILER", "1").strip() not in ("", "0", "false")
+
+
+def profile_max_seconds() -> float:
+    return float(os.environ.get("PROFILE_MAX_SECONDS", "60") or 60)
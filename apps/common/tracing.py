@@ -0,0 +1,239 @@
+"""
+Per-request tracing with local exporters.
+
+Every HTTP request gets a trace: a request id (the `X-Request-Id` header if
+the caller sent one, else a new one; echoed in the response and passed on
+to the MT service) and a list of timed spans for the stages it went
+through. The current trace lives in a context variable, so code on the
+request path records spans with
+
+    with span("cache", key=...) as attrs:
+        attrs["result"] = "hit"
+
+and does nothing when there is no trace. Work handed to other threads
+(the translation queue, MT batches) carries the trace object along and
+records into it explicitly.
+
+When a request finishes, its trace is:
+
+- written to `TRACE_FILE` (JSON lines) for a random `TRACE_SAMPLE_RATE`
+  fraction of requests;
+- if it took longer than `TRACE_SLOW_MS`, logged as a one-line summary,
+  kept in a ring buffer (`GET /admin/traces/slow`) and written to
+  `TRACE_FILE` with `"slow": true`, for a `TRACE_SLOW_SAMPLE_RATE`
+  fraction of slow requests.
+
+File writes happen on a background thread. Health and metrics endpoints
+are not traced.
+
+The module is shared by apps/llm and apps/mt: each service's main.py puts
+apps/common on sys.path before importing its siblings.
+
+Configuration:
+
+    TRACING=1
+    TRACE_FILE=/var/log/translation/traces.jsonl   # default: no file
+    TRACE_SAMPLE_RATE=0
+    TRACE_SLOW_MS=5000              # the MT service defaults to 1000
+    TRACE_SLOW_SAMPLE_RATE=1
+    TRACE_SLOW_KEEP=100
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+_MAX_SPANS = 512
+_UNTRACED_PREFIXES = ("/health", "/metrics", "/ready", "/admin")
+
+
+class _Trace:
+    __slots__ = ("request_id", "name", "wall_start", "start", "spans", "dropped", "lock")
+
+    def __init__(self, name: str, request_id: str):
+        self.request_id = request_id
+        self.name = name
+        self.wall_start = time.time()
+        self.start = time.monotonic()
+        self.spans: list[tuple[str, float, float, dict]] = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    # Records a span from monotonic `start` lasting `duration` seconds.
+    def add(self, name: str, start: float, duration: float, attrs: dict | None = None) -> None:
+        with self.lock:
+            if len(self.spans) >= _MAX_SPANS:
+                self.dropped += 1
+                return
+            self.spans.append((name, start - self.start, duration, attrs or {}))
+
+    def to_dict(self, duration: float, **extra: Any) -> dict:
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s[1])
+            dropped = self.dropped
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "ts": self.wall_start,
+            "duration_ms": round(duration * 1000, 2),
+            **extra,
+            "spans": [
+                {"name": n, "start_ms": round(s * 1000, 2), "duration_ms": round(d * 1000, 2), **a}
+                for n, s, d, a in spans
+            ],
+            "dropped_spans": dropped,
+        }
+
+
+_CURRENT: ContextVar[Optional[_Trace]] = ContextVar("trace", default=None)
+
+
+def current_trace() -> Optional[_Trace]:
+    return _CURRENT.get()
+
+
+# Request id of the current trace, for propagation to other services.
+def current_request_id() -> Optional[str]:
+    trace = _CURRENT.get()
+    return trace.request_id if trace is not None else None
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+# Makes `trace` current for the block (e.g. in a queue worker).
+@contextmanager
+def activate(trace: Optional[_Trace]) -> Iterator[None]:
+    token = _CURRENT.set(trace)
+    try:
+        yield
+    finally:
+        _CURRENT.reset(token)
+
+
+# Times the block as a span of the current trace. The yielded dict can be
+# filled with attributes while the block runs.
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[dict]:
+    trace = _CURRENT.get()
+    if trace is None:
+        yield attrs
+        return
+    start = time.monotonic()
+    try:
+        yield attrs
+    finally:
+        trace.add(name, start, time.monotonic() - start, attrs)
+
+
+# Records an already measured span (monotonic start, seconds).
+def add_span(name: str, start: float, duration: float, *, trace: Optional[_Trace] = None, **attrs: Any) -> None:
+    trace = trace if trace is not None else _CURRENT.get()
+    if trace is not None:
+        trace.add(name, start, duration, attrs)
+
+
+class _Tracer:
+    def __init__(
+        self,
+        *,
+        path: str = "",
+        sample_rate: float = 0.0,
+        slow_ms: float = 5000.0,
+        slow_sample_rate: float = 1.0,
+        slow_keep: int = 100,
+    ):
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate)))
+        self.slow_seconds = max(0.0, float(slow_ms)) / 1000.0
+        self.slow_sample_rate = min(1.0, max(0.0, float(slow_sample_rate)))
+        self._slow: deque[dict] = deque(maxlen=max(1, int(slow_keep)))
+        self._lock = threading.Lock()
+        self._finished = 0
+        self._slow_count = 0
+        self._exported = 0
+        self._path = path
+        self._writes: queue.SimpleQueue[str] = queue.SimpleQueue()
+        if path:
+            threading.Thread(target=self._writer_loop, name="trace-export", daemon=True).start()
+
+    def traced(self, path: str) -> bool:
+        return not path.startswith(_UNTRACED_PREFIXES)
+
+    def start(self, name: str, request_id: str | None = None) -> _Trace:
+        return _Trace(name, request_id or new_request_id())
+
+    def finish(self, trace: _Trace, **extra: Any) -> None:
+        duration = time.monotonic() - trace.start
+        slow = duration >= self.slow_seconds and random.random() < self.slow_sample_rate
+        sampled = slow or random.random() < self.sample_rate
+        with self._lock:
+            self._finished += 1
+            self._slow_count += duration >= self.slow_seconds
+        if not sampled:
+            return
+        record = trace.to_dict(duration, slow=slow, **extra)
+        if slow:
+            with self._lock:
+                self._slow.append(record)
+            print(f"SLOW {trace.name} [{trace.request_id}] {record['duration_ms']:.0f} ms: {_breakdown(record)}")
+        if self._path:
+            self._writes.put(json.dumps(record, ensure_ascii=False))
+
+    def _writer_loop(self) -> None:
+        while True:
+            lines = [self._writes.get()]
+            while True:
+                try:
+                    lines.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self._path, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+                with self._lock:
+                    self._exported += len(lines)
+            except OSError as e:
+                print(f"WARNING: trace export to {self._path} failed: {e}")
+
+    def slow_traces(self) -> list[dict]:
+        with self._lock:
+            return list(self._slow)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "finished": self._finished,
+                "slow": self._slow_count,
+                "exported": self._exported,
+                "slow_ms": self.slow_seconds * 1000,
+                "sample_rate": self.sample_rate,
+            }
+
+
+# Total time per span name, largest first, e.g. "queue_wait 2310ms, llama 980ms".
+def _breakdown(record: dict) -> str:
+    totals: dict[str, float] = {}
+    for s in record["spans"]:
+        totals[s["name"]] = totals.get(s["name"], 0.0) + s["duration_ms"]
+    return ", ".join(f"{n} {ms:.0f}ms" for n, ms in sorted(totals.items(), key=lambda kv: -kv[1])) or "no spans"
+
+
+# None when TRACING is disabled.
+def tracer_from_env(*, slow_ms: float = 5000.0) -> Optional[_Tracer]:
+    if os.environ.get("TRACING", "1").strip() in ("", "0", "false"):
+        return None
+    return _Tracer(
+        path=os.environ.get("TRACE_FILE", "").strip(),
+        sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", "0") or 0),
+        slow_ms=float(os.environ.get("TRACE_SLOW_MS", "") or slow_ms),
+        slow_sample_rate=float(os.environ.get("TRACE_SLOW_SAMPLE_RATE", "1") or 0),
+        slow_keep=int(os.environ.get("TRACE_SLOW_KEEP", "100") or 1),
+    )
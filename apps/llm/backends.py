@@ -0,0 +1,359 @@
+"""
+Pool of OpenAI-compatible llama.cpp backends.
+
+A single llama-server only scales as far as its `--parallel` slots. This
+module lets the translation service spread work over several servers (on
+one box or across nodes):
+
+- every backend has its own connection pool and concurrency limit;
+- work is leased to the least-loaded healthy backend (in-flight / limit);
+- a backend that fails `GET /v1/models` (or refuses connections) is taken
+  out of rotation and re-admitted once a later health check succeeds;
+- a language pair can be pinned to a preferred backend, e.g. a server that
+  runs a model tuned for that pair;
+- requests sharing a prompt prefix (the per-pair system prompt) are sent to
+  the llama-server slot that already holds it (`id_slot` + `cache_prompt`),
+  so its KV cache is reused instead of re-evaluating the prefix.
+
+Configuration (see `pool_from_env`):
+
+    LLAMA_BACKENDS="gpu0=http://127.0.0.1:7001@2,http://10.0.0.5:7001@1"
+    LLAMA_PAIR_PINS="en->it=gpu0,*->de=http://10.0.0.5:7001"
+"""
+import os
+import threading
+import time
+
+import httpx
+
+from llama_client import _LlamaClient, client_from_env
+
+
+_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+
+# Raised when no healthy backend can take the request.
+class NoBackendAvailable(RuntimeError):
+    pass
+
+
+# Tracks which prompt prefix each llama-server slot holds in its KV cache.
+# A request is sent to the idle slot already holding its prefix; otherwise
+# to an empty slot, or to the least recently used idle one. The number of
+# slots must match llama-server's `--parallel`.
+class _SlotAffinity:
+    def __init__(self, slots: int):
+        self._lock = threading.Lock()
+        self._prefix: list[str | None] = [None] * slots
+        self._busy = [False] * slots
+        self._last_used = [0.0] * slots
+        self.hits = 0
+        self.misses = 0
+
+    # Returns `(slot, warm)`, or `(None, False)` when every slot is busy
+    # (the server then picks one itself).
+    def acquire(self, prefix: str) -> tuple[int | None, bool]:
+        with self._lock:
+            idle = [i for i, busy in enumerate(self._busy) if not busy]
+            if not idle:
+                self.misses += 1
+                return None, False
+            warm = [i for i in idle if self._prefix[i] == prefix]
+            if warm:
+                slot = warm[0]
+                self.hits += 1
+            else:
+                slot = min(idle, key=lambda i: (self._prefix[i] is not None, self._last_used[i]))
+                self._prefix[slot] = prefix
+                self.misses += 1
+            self._busy[slot] = True
+            self._last_used[slot] = time.monotonic()
+            return slot, bool(warm)
+
+    def release(self, slot: int | None) -> None:
+        if slot is None:
+            return
+        with self._lock:
+            self._busy[slot] = False
+
+    # Forgets all prefixes, e.g. after the server was restarted.
+    def reset(self) -> None:
+        with self._lock:
+            self._prefix = [None] * len(self._prefix)
+
+
+# Prompt-processing counters from llama-server's `timings` (per backend).
+class _PromptStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.prompt_ms = 0.0
+        self.saved_ms = 0.0
+
+    # `prompt_n` counts evaluated tokens only; `cache_n` (newer servers)
+    # counts tokens reused from the slot's KV cache. The time saved is
+    # estimated at this request's own per-token prompt cost.
+    def record(self, timings: dict) -> None:
+        prompt_n = int(timings.get("prompt_n") or 0)
+        cache_n = int(timings.get("cache_n") or 0)
+        prompt_ms = float(timings.get("prompt_ms") or 0.0)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_n
+            self.cached_tokens += cache_n
+            self.prompt_ms += prompt_ms
+            if prompt_n and cache_n:
+                self.saved_ms += cache_n * prompt_ms / prompt_n
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.prompt_tokens + self.cached_tokens
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cached_ratio": (self.cached_tokens / total) if total else 0.0,
+                "prompt_ms": round(self.prompt_ms, 1),
+                "estimated_saved_ms": round(self.saved_ms, 1),
+            }
+
+
+# One llama-server endpoint with its own client and concurrency limit.
+class _Backend:
+    def __init__(self, name: str, client: _LlamaClient, *, limit: int):
+        self.name = name
+        self.client = client
+        self.limit = max(1, int(limit))
+        self.in_flight = 0
+        self.healthy = True
+        self.last_error: str | None = None
+        self.last_check = 0.0
+        self.models: list[str] = []
+        self.slots = _SlotAffinity(self.limit)
+        self.prompt_stats = _PromptStats()
+
+    @property
+    def url(self) -> str:
+        return self.client.base_url
+
+    def load(self) -> float:
+        return self.in_flight / self.limit
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+            "models": self.models,
+            "error": self.last_error,
+            "slot_hits": self.slots.hits,
+            "slot_misses": self.slots.misses,
+            "prompt": self.prompt_stats.snapshot(),
+        }
+
+
+# Least-loaded, health-aware selection over a fixed set of backends.
+class _BackendPool:
+    def __init__(
+        self,
+        backends: list[_Backend],
+        *,
+        pins: dict[tuple[str, str], str] | None = None,
+        health_interval: float = 5.0,
+        health_timeout: float = 1.5,
+    ):
+        if not backends:
+            raise ValueError("at least one llama backend is required")
+        self.backends = backends
+        self._by_name = {b.name: b for b in backends}
+        self._by_name.update({b.url: b for b in backends})
+        self._pins = dict(pins or {})
+        self._health_interval = float(health_interval)
+        self._health_timeout = float(health_timeout)
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._checker: threading.Thread | None = None
+
+    def capacity(self) -> int:
+        return sum(b.limit for b in self.backends)
+
+    def _pinned(self, pair: tuple[str, str] | None) -> _Backend | None:
+        if pair is None:
+            return None
+        src, tgt = (_primary_subtag(lang) for lang in pair)
+        for key in ((src, tgt), ("*", tgt), (src, "*")):
+            name = self._pins.get(key)
+            if name is not None:
+                return self._by_name.get(name)
+        return None
+
+    # Picks a backend for `pair`. Returns None when every healthy candidate
+    # is at its limit; raises NoBackendAvailable when none is healthy.
+    def _choose_locked(self, pair: tuple[str, str] | None, *, respect_limits: bool) -> _Backend | None:
+        pinned = self._pinned(pair)
+        if pinned is not None and pinned.healthy:
+            # A busy pin is waited for; an unhealthy one falls back below.
+            if not respect_limits or pinned.in_flight < pinned.limit:
+                return pinned
+            return None
+
+        healthy = [b for b in self.backends if b.healthy]
+        if not healthy:
+            raise NoBackendAvailable("no healthy llama backend")
+        if respect_limits:
+            healthy = [b for b in healthy if b.in_flight < b.limit]
+        if not healthy:
+            return None
+        return min(healthy, key=lambda b: (b.load(), b.in_flight))
+
+    # Leases a backend for one request. With `wait=True` the call blocks
+    # until a backend has a free slot (or `timeout` expires); with
+    # `wait=False` the least-loaded backend is returned even if it is full.
+    # Every lease must be returned with `release`.
+    def acquire(
+        self,
+        pair: tuple[str, str] | None = None,
+        *,
+        wait: bool = True,
+        timeout: float | None = None,
+    ) -> _Backend:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                backend = self._choose_locked(pair, respect_limits=wait)
+                if backend is not None:
+                    backend.in_flight += 1
+                    return backend
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise NoBackendAvailable("timed out waiting for a llama backend")
+                self._cond.wait(remaining if remaining is not None else 1.0)
+
+    # Returns a lease. Connection failures take the backend out of rotation
+    # until the next successful health check (slow responses do not).
+    def release(self, backend: _Backend, error: BaseException | None = None) -> None:
+        with self._cond:
+            backend.in_flight = max(0, backend.in_flight - 1)
+            if isinstance(error, _CONNECT_ERRORS):
+                backend.healthy = False
+                backend.last_error = f"{type(error).__name__}: {error}"
+            self._cond.notify_all()
+
+    def set_health(self, backend: _Backend, ok: bool, *, error: str | None = None, models: list[str] | None = None) -> None:
+        with self._cond:
+            if ok and not backend.healthy:
+                backend.slots.reset()
+            backend.healthy = ok
+            backend.last_error = None if ok else error
+            backend.last_check = time.time()
+            if models is not None:
+                backend.models = models
+            self._cond.notify_all()
+
+    def _record_models(self, backend: _Backend, data: dict) -> None:
+        models = [m.get("id") for m in data.get("data", []) if isinstance(m, dict)]
+        self.set_health(backend, True, models=models)
+
+    # Health probe (`GET /v1/models`); updates the backend's rotation state.
+    def check(self, backend: _Backend) -> bool:
+        try:
+            data = backend.client.get_models(timeout=self._health_timeout)
+        except Exception as e:
+            self.set_health(backend, False, error=str(e))
+            return False
+        self._record_models(backend, data)
+        return True
+
+    async def acheck(self, backend: _Backend) -> bool:
+        try:
+            data = await backend.client.aget_models(timeout=self._health_timeout)
+        except Exception as e:
+            self.set_health(backend, False, error=str(e))
+            return False
+        self._record_models(backend, data)
+        return True
+
+    def status(self) -> list[dict]:
+        with self._cond:
+            return [b.status() for b in self.backends]
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(self._health_interval):
+            for backend in self.backends:
+                self.check(backend)
+
+    # Starts periodic health checks in a daemon thread; this is what
+    # re-admits a backend after it was taken out of rotation.
+    def start(self) -> None:
+        if self._checker is not None or self._health_interval <= 0:
+            return
+        self._checker = threading.Thread(target=self._health_loop, name="llama-health", daemon=True)
+        self._checker.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        for b in self.backends:
+            b.client.close()
+
+    async def aclose(self) -> None:
+        self._stop.set()
+        for b in self.backends:
+            await b.client.aclose()
+
+
+# Parses `name=url@limit` entries (name and limit optional).
+def _parse_backends(spec: str) -> list[tuple[str, str, int]]:
+    out: list[tuple[str, str, int]] = []
+    for raw in spec.split(","):
+        entry = raw.strip()
+        if not entry:
+            continue
+        name = None
+        if "=" in entry:
+            name, entry = (p.strip() for p in entry.split("=", 1))
+        limit = 1
+        if "@" in entry:
+            entry, lim = entry.rsplit("@", 1)
+            limit = int(lim)
+        url = entry.rstrip("/")
+        out.append((name or url, url, limit))
+    return out
+
+
+# Pins apply per primary language subtag ("en-US" is pinned as "en").
+def _primary_subtag(lang: str) -> str:
+    return lang.strip().lower().split("-")[0]
+
+
+# Parses `src->tgt=backend` entries; `*` matches any language. Malformed
+# entries are reported and skipped.
+def _parse_pins(spec: str) -> dict[tuple[str, str], str]:
+    pins: dict[tuple[str, str], str] = {}
+    for raw in spec.split(","):
+        entry = raw.strip()
+        if not entry:
+            continue
+        pair, _, name = (p.strip() for p in entry.partition("="))
+        src, arrow, tgt = (p.strip() for p in pair.partition("->"))
+        if not (arrow and src and tgt and name):
+            print(f"WARNING: ignoring backend pin {entry!r} (expected src->tgt=backend)")
+            continue
+        pins[(_primary_subtag(src), _primary_subtag(tgt))] = name.rstrip("/")
+    return pins
+
+
+def pool_from_env(default_url: str) -> _BackendPool:
+    spec = os.environ.get("LLAMA_BACKENDS", "").strip() or default_url
+    backends = [
+        _Backend(name, client_from_env(url), limit=limit)
+        for name, url, limit in _parse_backends(spec)
+    ]
+    return _BackendPool(
+        backends,
+        pins=_parse_pins(os.environ.get("LLAMA_PAIR_PINS", "")),
+        health_interval=float(os.environ.get("LLAMA_HEALTH_INTERVAL_SECONDS", "5") or "0"),
+    )
@@ -0,0 +1,264 @@
+"""
+Optional on-disk tier for the translation cache.
+
+The in-memory LRU (`memory_cache.py`) is lost on every restart. This module keeps
+a copy of finished translations in a SQLite database (WAL mode) so a freshly
+started backend can serve already-known UI strings without calling llama.cpp.
+
+Design notes:
+- writes are queued and flushed in batches by a background thread
+  (write-behind), so LLM worker threads never wait on disk I/O;
+- reads are point lookups on the primary key and only happen on an
+  in-memory miss;
+- expired rows are compacted periodically by the writer thread;
+- hit/miss counters are persisted so lifetime hit rates can be reported
+  at startup.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+CacheKey = tuple[str, str, str]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS translations (
+    src TEXT NOT NULL,
+    tgt TEXT NOT NULL,
+    text TEXT NOT NULL,
+    value TEXT NOT NULL,
+    ts REAL NOT NULL,
+    PRIMARY KEY (src, tgt, text)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS translations_ts ON translations (ts);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+# SQLite-backed persistent cache tier with write-behind batching.
+# Keys are the same `(src, tgt, normalized_text)` tuples used in memory.
+class _DiskCacheTier:
+    def __init__(
+        self,
+        path: str,
+        *,
+        ttl_seconds: float,
+        flush_interval: float = 0.5,
+        batch_size: int = 256,
+        compact_interval: float = 10 * 60,
+    ):
+        self._path = path
+        self._ttl_seconds = max(1.0, float(ttl_seconds))
+        self._flush_interval = max(0.05, float(flush_interval))
+        self._batch_size = max(1, int(batch_size))
+        self._compact_interval = max(1.0, float(compact_interval))
+
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+
+        # Reads happen on request threads; a single shared connection guarded
+        # by a lock is enough for point lookups. The writer thread owns its
+        # own connection so WAL lets both proceed concurrently.
+        self._read_lock = threading.Lock()
+        self._read_conn = self._connect()
+        self._read_conn.executescript(_SCHEMA)
+
+        self._pending: queue.SimpleQueue[tuple[CacheKey, str, float] | None] = queue.SimpleQueue()
+        self._stats_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._compacted = 0
+        self._lifetime = self._load_lifetime_stats()
+
+        self._stop = threading.Event()
+        self._flushed = threading.Condition()
+        self._enqueued = 0
+        self._written = 0
+        self._writer = threading.Thread(target=self._writer_loop, name="cache-disk-writer", daemon=True)
+        self._writer.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # NORMAL is crash-safe in WAL mode (only the last commits may be lost
+        # on power failure, never corrupting the database).
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _load_lifetime_stats(self) -> dict[str, int]:
+        with self._read_lock:
+            rows = self._read_conn.execute("SELECT name, value FROM stats").fetchall()
+        return {name: int(value) for name, value in rows}
+
+    # Returns `(timestamp, value)` so the memory tier can keep the original
+    # insertion time (and therefore the original TTL) on promotion.
+    def get(self, key: CacheKey) -> tuple[float, str] | None:
+        src, tgt, text = key
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT value, ts FROM translations WHERE src = ? AND tgt = ? AND text = ?",
+                (src, tgt, text),
+            ).fetchone()
+        hit = row is not None and (time.time() - row[1]) <= self._ttl_seconds
+        with self._stats_lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        return (float(row[1]), row[0]) if hit else None
+
+    # Never blocks on disk: the entry is handed to the writer thread.
+    # `ts` keeps the original insertion time of imported entries.
+    def put(self, key: CacheKey, value: str, *, ts: float | None = None) -> None:
+        with self._flushed:
+            self._enqueued += 1
+        self._pending.put((key, value, time.time() if ts is None else ts))
+
+    # Iterates live rows as `(key, value, timestamp)`, on a connection of its
+    # own so a long export does not hold up point lookups.
+    def entries(self):
+        cutoff = time.time() - self._ttl_seconds
+        conn = self._connect()
+        try:
+            for src, tgt, text, value, ts in conn.execute(
+                "SELECT src, tgt, text, value, ts FROM translations WHERE ts >= ?", (cutoff,)
+            ):
+                yield (src, tgt, text), value, float(ts)
+        finally:
+            conn.close()
+
+    def count(self) -> int:
+        cutoff = time.time() - self._ttl_seconds
+        with self._read_lock:
+            row = self._read_conn.execute(
+                "SELECT COUNT(*) FROM translations WHERE ts >= ?", (cutoff,)
+            ).fetchone()
+        return int(row[0])
+
+    def stats(self) -> dict[str, float]:
+        with self._stats_lock:
+            hits, misses = self._hits, self._misses
+            writes, compacted = self._writes, self._compacted
+        lifetime_hits = self._lifetime.get("hits", 0) + hits
+        lifetime_misses = self._lifetime.get("misses", 0) + misses
+        lookups = lifetime_hits + lifetime_misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "writes": writes,
+            "compacted": compacted,
+            "lifetime_hits": lifetime_hits,
+            "lifetime_misses": lifetime_misses,
+            "lifetime_hit_rate": (lifetime_hits / lookups) if lookups else 0.0,
+        }
+
+    # Blocks until everything queued so far has been written (or timeout).
+    def flush(self, timeout: float | None = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._flushed:
+            target = self._enqueued
+            while self._written < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._pending.put(None)
+        self._writer.join(timeout=5)
+        with self._read_lock:
+            self._read_conn.close()
+
+    def compact(self, conn: sqlite3.Connection) -> int:
+        cutoff = time.time() - self._ttl_seconds
+        cur = conn.execute("DELETE FROM translations WHERE ts < ?", (cutoff,))
+        removed = max(0, cur.rowcount)
+        if removed:
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        with self._stats_lock:
+            self._compacted += removed
+        return removed
+
+    def _persist_stats(self, conn: sqlite3.Connection) -> None:
+        s = self.stats()
+        conn.executemany(
+            "INSERT OR REPLACE INTO stats (name, value) VALUES (?, ?)",
+            [("hits", s["lifetime_hits"]), ("misses", s["lifetime_misses"])],
+        )
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: list[tuple[CacheKey, str, float]]) -> None:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT OR REPLACE INTO translations (src, tgt, text, value, ts) VALUES (?, ?, ?, ?, ?)",
+            [(src, tgt, text, value, ts) for (src, tgt, text), value, ts in batch],
+        )
+        self._persist_stats(conn)
+        conn.execute("COMMIT")
+        with self._stats_lock:
+            self._writes += len(batch)
+
+    def _writer_loop(self) -> None:
+        conn = self._connect()
+        last_compact = float("-inf")
+        try:
+            while True:
+                batch: list[tuple[CacheKey, str, float]] = []
+                stopping = False
+                try:
+                    first = self._pending.get(timeout=self._flush_interval)
+                except queue.Empty:
+                    first = None
+                    stopping = self._stop.is_set()
+                else:
+                    if first is None:
+                        stopping = True
+                    else:
+                        batch.append(first)
+
+                # Drain whatever else is already queued, up to one batch.
+                while len(batch) < self._batch_size:
+                    try:
+                        nxt = self._pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    if nxt is None:
+                        stopping = True
+                        continue
+                    batch.append(nxt)
+
+                if batch:
+                    try:
+                        self._write_batch(conn, batch)
+                    except sqlite3.Error as e:
+                        if conn.in_transaction:
+                            conn.execute("ROLLBACK")
+                        print(f"WARNING: translation cache write failed: {e}")
+                    with self._flushed:
+                        self._written += len(batch)
+                        self._flushed.notify_all()
+
+                now = time.monotonic()
+                if now - last_compact >= self._compact_interval:
+                    last_compact = now
+                    try:
+                        self.compact(conn)
+                    except sqlite3.Error as e:
+                        print(f"WARNING: translation cache compaction failed: {e}")
+
+                if stopping and self._pending.empty():
+                    break
+        finally:
+            try:
+                self._persist_stats(conn)
+            except sqlite3.Error:
+                pass
+            conn.close()
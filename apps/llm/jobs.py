@@ -0,0 +1,370 @@
+"""
+Asynchronous bulk translation jobs (`/jobs`).
+
+`/translate_batch` holds a request open until every item is done, which does
+not suit whole documents or locale files. A job instead:
+
+- is split into chunks: the lines of a document (long lines are cut at
+  sentence ends; a translation is always a single line) or the values of a
+  key -> string mapping. Empty and whitespace-only chunks are kept as they
+  are and never queued;
+- feeds its chunks to the translation queue at `background` priority, a
+  bounded number at a time, so interactive traffic keeps its place and
+  chunks still go through the cache, the translation memory and packing;
+- records every finished chunk in SQLite. On startup, unfinished jobs are
+  resumed from their last finished chunk.
+
+Chunks refused by a full queue, shed or expired are retried later without
+counting as failures; other errors are retried `max_attempts` times, after
+which the chunk keeps its source text and is counted as failed.
+
+Configuration:
+
+    LLM_JOBS_DB=/var/lib/translator/jobs.db   # unset = in memory, no resume
+    LLM_JOBS_MAX_IN_FLIGHT=32                 # chunks queued at once, all jobs
+    LLM_JOBS_CHUNK_CHARS=1200                 # max characters per document chunk
+"""
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Callable, Literal
+
+from scheduler import DeadlineExceeded, QueueFull
+
+Kind = Literal["document", "strings"]
+SubmitBatch = Callable[..., list[Future[str]]]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    src TEXT NOT NULL,
+    tgt TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    key TEXT,
+    text TEXT NOT NULL,
+    sep TEXT NOT NULL,
+    result TEXT,
+    failed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (job_id, idx)
+) WITHOUT ROWID;
+"""
+
+# Line breaks (with the whitespace around them), and sentence ends inside
+# over-long lines.
+_LINE_BREAK_RE = re.compile(r"(\s*[\r\n]\s*)")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?…])(\s+)")
+
+
+# Splits a document into `(chunk, separator)` pairs that join back to it.
+# No chunk contains a line break: translations are cut at the first one.
+def _chunk_document(text: str, max_chars: int) -> list[tuple[str, str]]:
+    parts = _LINE_BREAK_RE.split(text)
+    chunks: list[tuple[str, str]] = []
+    for i in range(0, len(parts), 2):
+        line, sep = parts[i], parts[i + 1] if i + 1 < len(parts) else ""
+        if len(line) <= max_chars:
+            chunks.append((line, sep))
+            continue
+        pieces = _SENTENCE_END_RE.split(line)
+        current, current_sep = "", ""
+        for j in range(0, len(pieces), 2):
+            sentence, space = pieces[j], pieces[j + 1] if j + 1 < len(pieces) else ""
+            if current and len(current) + len(current_sep) + len(sentence) > max_chars:
+                chunks.append((current, current_sep))
+                current, current_sep = sentence, space
+            else:
+                current, current_sep = current + current_sep + sentence, space
+        chunks.append((current, current_sep + sep))
+    return chunks
+
+
+class _JobManager:
+    def __init__(
+        self,
+        path: str,
+        submit_batch: SubmitBatch,
+        *,
+        max_in_flight: int = 32,
+        chunk_chars: int = 1200,
+        max_attempts: int = 3,
+        retry_delay: float = 2.0,
+    ):
+        self._submit_batch = submit_batch
+        self._max_in_flight = max(1, int(max_in_flight))
+        self._chunk_chars = max(80, int(chunk_chars))
+        self._max_attempts = max(1, int(max_attempts))
+        self._retry_delay = float(retry_delay)
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+        # Chunks waiting to be queued: (job_id, idx, text) plus the time
+        # before which they must not be retried.
+        self._waiting: list[tuple[float, str, int, str]] = []
+        self._attempts: dict[tuple[str, int], int] = {}
+        self._in_flight = 0
+        self._langs: dict[str, tuple[str, str]] = {}
+        self._done: queue.SimpleQueue[tuple[str, int, str, Future[str]] | None] = queue.SimpleQueue()
+        self._stop = threading.Event()
+
+        self.resumed = self._resume()
+        self._thread = threading.Thread(target=self._run, name="llm-jobs", daemon=True)
+        self._thread.start()
+
+    # Re-queues the unfinished chunks of jobs that were running at shutdown.
+    def _resume(self) -> int:
+        with self._lock:
+            jobs = self._conn.execute("SELECT id, src, tgt FROM jobs WHERE status = 'running'").fetchall()
+            for job_id, src, tgt in jobs:
+                self._langs[job_id] = (src, tgt)
+                rows = self._conn.execute(
+                    "SELECT idx, text FROM chunks WHERE job_id = ? AND result IS NULL ORDER BY idx",
+                    (job_id,),
+                ).fetchall()
+                if not rows:
+                    # Stopped between its last chunk and the status update.
+                    self._conn.execute("UPDATE jobs SET status = 'done' WHERE id = ?", (job_id,))
+                self._waiting.extend((0.0, job_id, idx, text) for idx, text in rows)
+        return len(jobs)
+
+    def create(
+        self,
+        *,
+        src_lang: str,
+        tgt_lang: str,
+        document: str | None = None,
+        strings: dict[str, str] | None = None,
+    ) -> dict:
+        if (document is None) == (strings is None):
+            raise ValueError("exactly one of document or strings is required")
+        kind: Kind = "document" if document is not None else "strings"
+        if document is not None:
+            rows = [(None, text, sep) for text, sep in _chunk_document(document, self._chunk_chars)]
+        else:
+            rows = [(key, text, "") for key, text in (strings or {}).items()]
+        # Nothing to translate: stored as done with the text as result.
+        blank = {idx for idx, (_, text, _) in enumerate(rows) if not text.strip()}
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        status = "running" if len(blank) < len(rows) else "done"
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, src, tgt, status, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, src_lang, tgt_lang, status, now, now),
+            )
+            self._conn.executemany(
+                "INSERT INTO chunks (job_id, idx, key, text, sep, result) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (job_id, idx, key, text, sep, text if idx in blank else None)
+                    for idx, (key, text, sep) in enumerate(rows)
+                ],
+            )
+            self._conn.execute("COMMIT")
+            self._langs[job_id] = (src_lang, tgt_lang)
+            self._waiting.extend(
+                (0.0, job_id, idx, text) for idx, (_, text, _) in enumerate(rows) if idx not in blank
+            )
+        return self.status(job_id)  # type: ignore[return-value]
+
+    # Progress of a job, with its result once it is done. None if unknown.
+    def status(self, job_id: str, *, with_result: bool = False) -> dict | None:
+        with self._lock:
+            job = self._conn.execute(
+                "SELECT kind, src, tgt, status, created, updated FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if job is None:
+                return None
+            total, done, failed = self._conn.execute(
+                "SELECT COUNT(*), COUNT(result), COALESCE(SUM(failed), 0) FROM chunks WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+            rows = None
+            if with_result and job[3] == "done":
+                rows = self._conn.execute(
+                    "SELECT key, result, sep FROM chunks WHERE job_id = ? ORDER BY idx", (job_id,)
+                ).fetchall()
+
+        kind, src, tgt, status, created, updated = job
+        out = {
+            "id": job_id,
+            "kind": kind,
+            "src_lang": src,
+            "tgt_lang": tgt,
+            "status": status,
+            "total": total,
+            "done": done,
+            "failed": failed,
+            "created": created,
+            "updated": updated,
+        }
+        if rows is not None:
+            if kind == "document":
+                out["result"] = "".join(result + sep for _, result, sep in rows)
+            else:
+                out["result"] = {key: result for key, result, _ in rows}
+        return out
+
+    # Stops a running job; chunks already queued still finish (and are cached).
+    def cancel(self, job_id: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated = ? WHERE id = ? AND status = 'running'",
+                (time.time(), job_id),
+            )
+            if cur.rowcount <= 0:
+                return False
+            self._waiting = [w for w in self._waiting if w[1] != job_id]
+        return True
+
+    def delete(self, job_id: str) -> bool:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            cur = self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            self._conn.execute("DELETE FROM chunks WHERE job_id = ?", (job_id,))
+            self._conn.execute("COMMIT")
+            self._waiting = [w for w in self._waiting if w[1] != job_id]
+            self._langs.pop(job_id, None)
+        return cur.rowcount > 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            return {"jobs": counts, "waiting_chunks": len(self._waiting), "in_flight_chunks": self._in_flight}
+
+    def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._done.put(None)
+        self._thread.join(timeout=5)
+        with self._lock:
+            self._conn.close()
+
+    # Queues as many due chunks as the in-flight limit allows, in one batch
+    # per job so short chunks can be packed together and the scheduler
+    # shares capacity fairly between jobs.
+    def _fill(self) -> None:
+        now = time.monotonic()
+        picked: list[tuple[str, int, str]] = []
+        with self._lock:
+            room = self._max_in_flight - self._in_flight
+            keep = []
+            for entry in self._waiting:
+                if room > 0 and entry[0] <= now:
+                    picked.append(entry[1:])
+                    room -= 1
+                else:
+                    keep.append(entry)
+            self._waiting = keep
+            self._in_flight += len(picked)
+            langs = dict(self._langs)
+
+        by_job: dict[str, list[tuple[str, int, str]]] = {}
+        for job_id, idx, text in picked:
+            by_job.setdefault(job_id, []).append((job_id, idx, text))
+        for job_id, chunks in by_job.items():
+            src, tgt = langs[job_id]
+            futures = self._submit_batch(
+                [(text, src, tgt, "background", None) for _, _, text in chunks],
+                client=f"job:{job_id}",
+            )
+            for (job_id, idx, text), fut in zip(chunks, futures):
+                fut.add_done_callback(lambda f, j=job_id, i=idx, t=text: self._done.put((j, i, t, f)))
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self._fill()
+            except Exception as e:
+                print(f"WARNING: job chunk submission failed: {e}")
+            finished: list[tuple[str, int, str, Future[str]]] = []
+            try:
+                item = self._done.get(timeout=0.25)
+                while item is not None:
+                    finished.append(item)
+                    item = self._done.get_nowait()
+            except queue.Empty:
+                pass
+            if finished:
+                self._record(finished)
+
+    # Stores finished chunks, schedules retries and completes jobs.
+    def _record(self, finished: list[tuple[str, int, str, Future[str]]]) -> None:
+        now = time.time()
+        retry_at = time.monotonic() + self._retry_delay
+        results: list[tuple[str, int, str, int]] = []
+        with self._lock:
+            self._in_flight -= len(finished)
+            for job_id, idx, text, fut in finished:
+                try:
+                    results.append((job_id, idx, fut.result(), 0))
+                    self._attempts.pop((job_id, idx), None)
+                    continue
+                except (QueueFull, DeadlineExceeded):
+                    # Overload: try again later, it is not the chunk's fault.
+                    self._waiting.append((retry_at, job_id, idx, text))
+                    continue
+                except Exception as e:
+                    attempts = self._attempts.get((job_id, idx), 0) + 1
+                    if attempts < self._max_attempts:
+                        self._attempts[(job_id, idx)] = attempts
+                        self._waiting.append((retry_at, job_id, idx, text))
+                        continue
+                    print(f"WARNING: job {job_id} chunk {idx} failed: {e}")
+                    self._attempts.pop((job_id, idx), None)
+                    results.append((job_id, idx, text, 1))
+
+            jobs = {job_id for job_id, *_ in results}
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE chunks SET result = ?, failed = ? WHERE job_id = ? AND idx = ?",
+                [(result, failed, job_id, idx) for job_id, idx, result, failed in results],
+            )
+            for job_id in jobs:
+                self._conn.execute(
+                    "UPDATE jobs SET updated = ?, status = CASE WHEN status = 'running' AND NOT EXISTS "
+                    "(SELECT 1 FROM chunks WHERE job_id = ? AND result IS NULL) THEN 'done' ELSE status END "
+                    "WHERE id = ?",
+                    (now, job_id, job_id),
+                )
+            self._conn.execute("COMMIT")
+
+
+# None when jobs are disabled (LLM_JOBS=0).
+def jobs_from_env(submit_batch: SubmitBatch) -> _JobManager | None:
+    if os.environ.get("LLM_JOBS", "1").strip() in ("", "0", "false"):
+        return None
+    path = os.environ.get("LLM_JOBS_DB", "").strip() or ":memory:"
+    try:
+        manager = _JobManager(
+            path,
+            submit_batch,
+            max_in_flight=int(os.environ.get("LLM_JOBS_MAX_IN_FLIGHT", "32") or 1),
+            chunk_chars=int(os.environ.get("LLM_JOBS_CHUNK_CHARS", "1200") or 1200),
+        )
+    except Exception as e:
+        print(f"WARNING: translation jobs disabled ({path}): {e}")
+        return None
+    if manager.resumed:
+        print(f"Translation jobs: resumed {manager.resumed} unfinished job(s) from {path}")
+    return manager
@@ -0,0 +1,206 @@
+"""
+In-process language identification for `src_lang="auto"`.
+
+Most requests leave the source language to the model, which disables the
+same-language fast path and splits cache keys between "auto" and explicit
+languages. This module guesses the language of a string in tens of
+microseconds (repeats are memoized) so "auto" can be resolved before the
+cache lookup:
+
+- scripts that identify a language on their own (Hangul, kana, Han,
+  Arabic without Persian/Urdu letters, Greek, Hebrew, Thai) are decided
+  by their characters alone; other non-Latin text stays "auto";
+- Latin-script text is scored with a naive Bayes model over character
+  trigrams (words padded with spaces). The trigram tables are built once
+  at import from the corpus in langid_corpus/: parallel UI strings and
+  everyday sentences per language, including the Latinate words ("-tion",
+  "restaurant", "menu") that English shares with its neighbours.
+
+A guess is only returned when the text has enough letters, the best
+language's (tempered) posterior is above the confidence threshold, which
+is stricter for short strings, and its average log-likelihood per trigram
+beats the runner-up by a margin. Everything else stays "auto" and is
+handled as before.
+
+Configuration:
+
+    LANGID=1                          # 0 disables detection
+    LANGID_MIN_CONFIDENCE=0.99        # posterior probability of the best language
+    LANGID_MIN_MARGIN=0.3             # nats per trigram over the second best
+    LANGID_SHORT_LETTERS=24           # below this many letters ...
+    LANGID_SHORT_MIN_CONFIDENCE=0.999 # ... this posterior is required
+    LANGID_MIN_LETTERS=12             # shorter strings stay "auto"
+"""
+import math
+import os
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# One file per language (`<code>.txt`), one UI string or sentence per line.
+_CORPUS_DIR = Path(__file__).resolve().parent / "langid_corpus"
+
+# Every character is shared by three overlapping trigrams, so treating them
+# as independent evidence makes the posteriors far too confident; scores
+# are tempered by this factor.
+_TRIGRAM_OVERLAP = 3.0
+
+_WORD_RE = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+# Character ranges of scripts that decide the language on their own.
+_KANA_RE = re.compile(r"[\u3040-\u30ff]")
+_HANGUL_RE = re.compile(r"[\uac00-\ud7af\u1100-\u11ff]")
+_HAN_RE = re.compile(r"[\u4e00-\u9fff]")
+_ARABIC_RE = re.compile(r"[\u0600-\u06ff]")
+_PERSIAN_RE = re.compile(r"[پچژگکیٹڈڑںھہے]")
+_GREEK_RE = re.compile(r"[\u0370-\u03ff]")
+_HEBREW_RE = re.compile(r"[\u0590-\u05ff]")
+_THAI_RE = re.compile(r"[\u0e00-\u0e7f]")
+_LATIN_RE = re.compile(r"[A-Za-z\u00c0-\u024f]")
+
+
+def _trigrams(text: str):
+    for word in _WORD_RE.findall(text.lower()):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            yield padded[i : i + 3]
+
+
+def _load_corpus(directory: Path) -> Dict[str, str]:
+    return {p.stem: p.read_text(encoding="utf-8") for p in sorted(directory.glob("*.txt"))}
+
+
+# Log-probability tables: trigram -> log P(trigram | language), plus the
+# log-probability of an unseen trigram for each language.
+def _build_tables(samples: Dict[str, str]) -> Tuple[Dict[str, Dict[str, float]], Dict[str, float]]:
+    counts = {lang: Counter(_trigrams(text)) for lang, text in samples.items()}
+    vocabulary = len(set().union(*counts.values()))
+    tables: Dict[str, Dict[str, float]] = {}
+    unseen: Dict[str, float] = {}
+    for lang, c in counts.items():
+        total = sum(c.values()) + 0.5 * vocabulary
+        tables[lang] = {g: math.log((n + 0.5) / total) for g, n in c.items()}
+        unseen[lang] = math.log(0.5 / total)
+    return tables, unseen
+
+
+class _LanguageIdentifier:
+    def __init__(
+        self,
+        *,
+        min_confidence: float = 0.99,
+        min_margin: float = 0.3,
+        short_letters: int = 24,
+        short_min_confidence: float = 0.999,
+        min_letters: int = 12,
+        cache_size: int = 65536,
+    ):
+        self.min_confidence = min(1.0, max(0.5, float(min_confidence)))
+        self.min_margin = max(0.0, float(min_margin))
+        self.short_letters = max(0, int(short_letters))
+        self.short_min_confidence = min(1.0, max(self.min_confidence, float(short_min_confidence)))
+        self.min_letters = max(1, int(min_letters))
+        self._tables, self._unseen = _build_tables(_load_corpus(_CORPUS_DIR))
+        self._lock = threading.Lock()
+        self.detected = 0
+        self.uncertain = 0
+        self._detect = lru_cache(maxsize=cache_size)(self._classify)
+
+    # Language code of `text`, or None when the guess is not confident.
+    def detect(self, text: str) -> Optional[str]:
+        lang = self._detect(text)
+        with self._lock:
+            if lang is None:
+                self.uncertain += 1
+            else:
+                self.detected += 1
+        return lang
+
+    def _classify(self, text: str) -> Optional[str]:
+        by_script = self._by_script(text)
+        if by_script is not None:
+            return by_script or None
+        letters = len(_LATIN_RE.findall(text))
+        if letters < self.min_letters:
+            return None
+        grams = list(_trigrams(text))
+        if not grams:
+            return None
+        logp = self._log_likelihoods(grams)
+        best, second = sorted(logp, key=logp.__getitem__, reverse=True)[:2]
+        if (logp[best] - logp[second]) / len(grams) < self.min_margin:
+            return None
+        needed = self.short_min_confidence if letters < self.short_letters else self.min_confidence
+        return best if self._posteriors(logp)[best] >= needed else None
+
+    # A language decided by the script, "" for non-Latin text that is
+    # ambiguous (e.g. Cyrillic), None for Latin-script text.
+    @staticmethod
+    def _by_script(text: str) -> Optional[str]:
+        if _LATIN_RE.search(text) and not any(ord(ch) > 0x24F for ch in text if ch.isalpha()):
+            return None
+        if _HANGUL_RE.search(text):
+            return "ko"
+        if _KANA_RE.search(text):
+            return "ja"
+        if _HAN_RE.search(text):
+            return "zh"
+        if _ARABIC_RE.search(text):
+            return "" if _PERSIAN_RE.search(text) else "ar"
+        if _GREEK_RE.search(text):
+            return "el"
+        if _HEBREW_RE.search(text):
+            return "he"
+        if _THAI_RE.search(text):
+            return "th"
+        return "" if any(ch.isalpha() for ch in text) else None
+
+    def _log_likelihoods(self, grams: List[str]) -> Dict[str, float]:
+        logp = {}
+        for lang, table in self._tables.items():
+            unseen = self._unseen[lang]
+            logp[lang] = sum(table.get(g, unseen) for g in grams)
+        return logp
+
+    # Tempered posteriors (uniform prior), see _TRIGRAM_OVERLAP.
+    @staticmethod
+    def _posteriors(logp: Dict[str, float]) -> Dict[str, float]:
+        top = max(logp.values())
+        weights = {lang: math.exp((v - top) / _TRIGRAM_OVERLAP) for lang, v in logp.items()}
+        total = sum(weights.values())
+        return {lang: w / total for lang, w in weights.items()}
+
+    # Posterior probability of each Latin-script language.
+    def scores(self, text: str) -> Dict[str, float]:
+        grams = list(_trigrams(text))
+        if not grams:
+            return {}
+        return self._posteriors(self._log_likelihoods(grams))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "detected": self.detected,
+                "uncertain": self.uncertain,
+                "min_confidence": self.min_confidence,
+                "min_margin": self.min_margin,
+                "short_letters": self.short_letters,
+                "short_min_confidence": self.short_min_confidence,
+                "min_letters": self.min_letters,
+            }
+
+
+# None when LANGID is disabled.
+def identifier_from_env() -> Optional[_LanguageIdentifier]:
+    if os.environ.get("LANGID", "1").strip() in ("", "0", "false"):
+        return None
+    return _LanguageIdentifier(
+        min_confidence=float(os.environ.get("LANGID_MIN_CONFIDENCE", "0.99") or 0.99),
+        min_margin=float(os.environ.get("LANGID_MIN_MARGIN", "0.3") or 0),
+        short_letters=int(os.environ.get("LANGID_SHORT_LETTERS", "24") or 0),
+        short_min_confidence=float(os.environ.get("LANGID_SHORT_MIN_CONFIDENCE", "0.999") or 0.999),
+        min_letters=int(os.environ.get("LANGID_MIN_LETTERS", "12") or 1),
+    )
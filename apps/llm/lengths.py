@@ -0,0 +1,125 @@
+"""
+Output-length control for translation calls.
+
+Every token generated past the end of the translation is wasted: the output
+is cut to its first line and at explanation markers by `clean_translation`
+anyway. Two mechanisms keep generations short:
+
+- stop sequences matching what the cleanup would cut (see server.py), so
+  llama-server ends the generation instead of the cleanup discarding it;
+- `max_tokens` from a per-language-pair online model of output tokens per
+  input character. The model keeps exponentially weighted averages of the
+  ratio and of its absolute deviation (like TCP's RTT estimator) and caps a
+  request at `ratio + k * deviation` times its length, plus a small slack.
+  Until a pair has `min_samples` observations the caller's generous
+  default is used.
+
+A generation that hits the cap (`finish_reason == "length"`) is retried
+with the cap doubled, up to the caller's limit. Truncated generations are
+not observed (their length is unknown) but counted per pair, so a cap that
+is too tight shows up in `/metrics` and `/health/lengths`.
+
+Configuration:
+
+    LLM_LENGTH_MODEL=1             # 0 keeps the fixed heuristic
+    LLM_LENGTH_DEVIATIONS=4        # k
+    LLM_LENGTH_MIN_SAMPLES=20
+    LLM_TRUNCATION_RETRIES=1
+"""
+import math
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+Pair = Tuple[str, str]
+
+
+@dataclass
+class _PairStats:
+    ratio: float = 0.0
+    deviation: float = 0.0
+    samples: int = 0
+    truncations: int = 0
+
+
+class _OutputLengthModel:
+    def __init__(
+        self,
+        *,
+        enabled: bool = True,
+        deviations: float = 4.0,
+        min_samples: int = 20,
+        alpha: float = 0.1,
+        slack: int = 8,
+        min_tokens: int = 16,
+        retries: int = 1,
+    ):
+        self.enabled = enabled
+        self.deviations = max(0.0, float(deviations))
+        self.min_samples = max(1, int(min_samples))
+        self.alpha = min(1.0, max(0.01, float(alpha)))
+        self.slack = max(0, int(slack))
+        self.min_tokens = max(1, int(min_tokens))
+        self.retries = max(0, int(retries))
+        self._lock = threading.Lock()
+        self._pairs: Dict[Pair, _PairStats] = {}
+
+    # Learned `max_tokens` for translating `chars` characters of `pair`, or
+    # None while the model is disabled or has too few samples.
+    def cap(self, pair: Pair, chars: int) -> Optional[int]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            s = self._pairs.get(pair)
+            if s is None or s.samples < self.min_samples:
+                return None
+            per_char = s.ratio + self.deviations * s.deviation
+        return max(self.min_tokens, math.ceil(chars * per_char) + self.slack)
+
+    # The cap for the attempt after truncation number `attempt` (from 0), or
+    # None once the retries are used up or the cap already is at `limit`.
+    def retry_cap(self, cap: int, attempt: int, limit: int) -> Optional[int]:
+        if attempt >= self.retries or cap >= limit:
+            return None
+        return min(limit, cap * 2)
+
+    # Records a finished (not truncated) generation.
+    def observe(self, pair: Pair, chars: int, output_tokens: int) -> None:
+        if chars <= 0 or output_tokens <= 0:
+            return
+        ratio = output_tokens / chars
+        with self._lock:
+            s = self._pairs.setdefault(pair, _PairStats())
+            if s.samples == 0:
+                s.ratio = ratio
+                s.deviation = ratio / 2
+            else:
+                s.deviation += self.alpha * (abs(ratio - s.ratio) - s.deviation)
+                s.ratio += self.alpha * (ratio - s.ratio)
+            s.samples += 1
+
+    def truncated(self, pair: Pair) -> None:
+        with self._lock:
+            self._pairs.setdefault(pair, _PairStats()).truncations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                f"{src}->{tgt}": {
+                    "tokens_per_char": round(s.ratio, 4),
+                    "deviation": round(s.deviation, 4),
+                    "samples": s.samples,
+                    "truncations": s.truncations,
+                }
+                for (src, tgt), s in self._pairs.items()
+            }
+
+
+def length_model_from_env() -> _OutputLengthModel:
+    return _OutputLengthModel(
+        enabled=os.environ.get("LLM_LENGTH_MODEL", "1").strip() not in ("", "0", "false"),
+        deviations=float(os.environ.get("LLM_LENGTH_DEVIATIONS", "4") or 0),
+        min_samples=int(os.environ.get("LLM_LENGTH_MIN_SAMPLES", "20") or 1),
+        retries=int(os.environ.get("LLM_TRUNCATION_RETRIES", "1") or 0),
+    )
@@ -0,0 +1,164 @@
+"""
+Pooled HTTP client for the llama.cpp server.
+
+Every call used to go through a bare `requests.post`, which opens a new TCP
+connection per translation. This module keeps one connection pool per
+process (keep-alive, bounded size) and offers both a blocking interface,
+used by the queue worker threads, and an async interface, used by the
+FastAPI handlers that stream responses.
+"""
+import json
+import os
+import threading
+from typing import AsyncIterator, Iterator
+
+import httpx
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, str(default)) or default)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, str(default)) or default)
+
+
+_SSE_DONE = object()
+
+
+# Parses one line of an OpenAI-style SSE stream. Returns the decoded event,
+# `_SSE_DONE` for the `[DONE]` sentinel, or None for anything to skip
+# (blank lines, comments, malformed JSON).
+def _parse_sse_line(raw: str) -> dict | object | None:
+    line = raw.strip()
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:") :].strip()
+    if data == "[DONE]":
+        return _SSE_DONE
+    try:
+        return json.loads(data)
+    except Exception:
+        return None
+
+
+# Shared connection pool to one OpenAI-compatible llama.cpp server.
+# Clients are created lazily; the async client is bound to the event loop
+# that first uses it (the uvicorn loop), and closed from the app lifespan.
+class _LlamaClient:
+    def __init__(
+        self,
+        base_url: str,
+        *,
+        max_connections: int = 32,
+        max_keepalive: int = 16,
+        keepalive_seconds: float = 30.0,
+        connect_timeout: float = 2.0,
+        request_timeout: float = 30.0,
+        stream_timeout: float = 60.0,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self._limits = httpx.Limits(
+            max_connections=max(1, max_connections),
+            max_keepalive_connections=max(0, max_keepalive),
+            keepalive_expiry=keepalive_seconds,
+        )
+        self._connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.stream_timeout = stream_timeout
+        self._lock = threading.Lock()
+        self._sync: httpx.Client | None = None
+        self._async: httpx.AsyncClient | None = None
+
+    def _timeout(self, seconds: float | None, default: float) -> httpx.Timeout:
+        return httpx.Timeout(seconds if seconds is not None else default, connect=self._connect_timeout)
+
+    def _sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync is None:
+                self._sync = httpx.Client(base_url=self.base_url, limits=self._limits)
+            return self._sync
+
+    def _async_client(self) -> httpx.AsyncClient:
+        with self._lock:
+            if self._async is None:
+                self._async = httpx.AsyncClient(base_url=self.base_url, limits=self._limits)
+            return self._async
+
+    # Blocking chat completion; returns the decoded JSON response.
+    def post_chat(self, payload: dict, *, timeout: float | None = None) -> dict:
+        r = self._sync_client().post(
+            "/v1/chat/completions",
+            json=payload,
+            timeout=self._timeout(timeout, self.request_timeout),
+        )
+        r.raise_for_status()
+        return r.json()
+
+    # Blocking SSE stream of chat completion chunks.
+    def stream_chat(self, payload: dict, *, timeout: float | None = None) -> Iterator[dict]:
+        with self._sync_client().stream(
+            "POST",
+            "/v1/chat/completions",
+            json={**payload, "stream": True},
+            timeout=self._timeout(timeout, self.stream_timeout),
+        ) as r:
+            r.raise_for_status()
+            for raw in r.iter_lines():
+                event = _parse_sse_line(raw)
+                if event is _SSE_DONE:
+                    return
+                if event is not None:
+                    yield event
+
+    # Async SSE stream of chat completion chunks.
+    async def astream_chat(self, payload: dict, *, timeout: float | None = None) -> AsyncIterator[dict]:
+        async with self._async_client().stream(
+            "POST",
+            "/v1/chat/completions",
+            json={**payload, "stream": True},
+            timeout=self._timeout(timeout, self.stream_timeout),
+        ) as r:
+            r.raise_for_status()
+            async for raw in r.aiter_lines():
+                event = _parse_sse_line(raw)
+                if event is _SSE_DONE:
+                    return
+                if event is not None:
+                    yield event
+
+    def get_models(self, *, timeout: float = 1.5) -> dict:
+        r = self._sync_client().get("/v1/models", timeout=self._timeout(timeout, timeout))
+        r.raise_for_status()
+        return r.json()
+
+    async def aget_models(self, *, timeout: float = 1.5) -> dict:
+        r = await self._async_client().get("/v1/models", timeout=self._timeout(timeout, timeout))
+        r.raise_for_status()
+        return r.json()
+
+    def close(self) -> None:
+        with self._lock:
+            client, self._sync = self._sync, None
+        if client is not None:
+            client.close()
+
+    async def aclose(self) -> None:
+        with self._lock:
+            client, self._async = self._async, None
+        if client is not None:
+            await client.aclose()
+        self.close()
+
+
+# Builds a client from the LLAMA_* environment variables.
+def client_from_env(base_url: str) -> _LlamaClient:
+    return _LlamaClient(
+        base_url,
+        max_connections=_env_int("LLAMA_POOL_MAX_CONNECTIONS", 32),
+        max_keepalive=_env_int("LLAMA_POOL_MAX_KEEPALIVE", 16),
+        keepalive_seconds=_env_float("LLAMA_KEEPALIVE_SECONDS", 30.0),
+        connect_timeout=_env_float("LLAMA_CONNECT_TIMEOUT_SECONDS", 2.0),
+        request_timeout=_env_float("LLAMA_TIMEOUT_SECONDS", 30.0),
+        stream_timeout=_env_float("LLAMA_STREAM_TIMEOUT_SECONDS", 60.0),
+    )
@@ -5,17 +5,88 @@ This module defines REST APIs used by the frontend to submit translation
 requests and to check the health of the LLM backend.
 """
 
+import sys
+from pathlib import Path
+
+# tracing.py and profiler.py are shared with apps/mt; main.py runs before
+# any sibling that imports them.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+
+from contextlib import asynccontextmanager
+from concurrent.futures import CancelledError, Future
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
-from typing import List
-from server import translate_with_llm, submit_translation_with_llm, stream_llama_chat
-import requests
+from typing import Dict, List, Optional, TypeVar
+from jobs import jobs_from_env
+from metrics import register_state
+from profiler import ProfilerBusy, profile_max_seconds, profiler_enabled, sample_stacks
+from tracing import activate, tracer_from_env
+from prewarm import corpus_file, export_entries, parse_entries, prewarmer_from_env, read_corpus, start_from_env
+from server import (
+    _BACKENDS,
+    _LENGTHS,
+    _ROUTER,
+    _TRANSLATION_CACHE,
+    _TRANSLATION_QUEUE,
+    DeadlineExceeded,
+    QueueFull,
+    Shed,
+    export_cache,
+    import_cache,
+    lookup_translations,
+    release_translations,
+    submit_translation_with_llm,
+    submit_translation_batch_with_llm,
+    astream_llama_chat_queued,
+)
+import asyncio
+import hmac
+import json
+import os
 import threading
 import time
 
-app = FastAPI(title="LLM-based Translation Service")
+T = TypeVar("T")
+
+# Largest number of hashes accepted by one /translate_lookup call.
+_LOOKUP_MAX_HASHES = int(os.environ.get("TRANSLATION_LOOKUP_MAX_HASHES", "2048") or 1)
+
+
+# Bulk translation jobs (LLM_JOBS_DB keeps them across restarts).
+_JOBS = jobs_from_env(submit_translation_batch_with_llm)
+if _JOBS is not None:
+    register_state(jobs=_JOBS.stats)
+
+
+# Fills the cache from string corpora at background priority, and only
+# while no interactive request is waiting.
+def _interactive_waiting() -> bool:
+    depth = _TRANSLATION_QUEUE.depth()
+    return depth["critical"] + depth["normal"] > 0
+
+
+_PREWARM = prewarmer_from_env(
+    lambda *args, **kwargs: submit_translation_with_llm(*args, client="prewarm", **kwargs),
+    busy=_interactive_waiting,
+)
+start_from_env(_PREWARM)
+
+
+# Closes the pooled llama.cpp connections and the job store, and stops
+# prewarming, on shutdown.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    if _JOBS is not None:
+        _JOBS.close()
+    _PREWARM.stop()
+    await _BACKENDS.aclose()
+
+
+app = FastAPI(title="LLM-based Translation Service", lifespan=lifespan)
 # CORS configuration to allow requests from the local frontend
 # development servers.
 app.add_middleware(
@@ -27,8 +98,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-Id"],
 )
 
+# Per-request traces (tracing.py): slow requests are logged with their span
+# breakdown, a sample is exported to TRACE_FILE.
+_TRACER = tracer_from_env(slow_ms=5000)
+if _TRACER is not None:
+    register_state(tracing=_TRACER.stats)
+
+
+# Starts a trace for each request and finishes it when the response body
+# has been sent, so streamed responses are timed to their end.
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    if _TRACER is None or not _TRACER.traced(request.url.path):
+        return await call_next(request)
+    request_id = request.headers.get("x-request-id", "").strip()[:64] or None
+    trace = _TRACER.start(f"{request.method} {request.url.path}", request_id)
+    with activate(trace):
+        response = await call_next(request)
+    response.headers["X-Request-Id"] = trace.request_id
+    body = response.body_iterator
+
+    async def traced_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            _TRACER.finish(trace, status=response.status_code)
+
+    response.body_iterator = traced_body()
+    return response
+
+
+# Admin endpoints (/admin/*, /cache/*) require X-Admin-Token to match
+# ADMIN_TOKEN, and are refused while no token is configured.
+def _check_admin(request: Request) -> None:
+    token = os.environ.get("ADMIN_TOKEN", "")
+    if not token:
+        raise HTTPException(status_code=403, detail="admin_disabled")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="forbidden")
+
 # Request models defining the expected payloads for translation APIs.
 
 class Req(BaseModel):
@@ -36,12 +148,43 @@ class Req(BaseModel):
     src_lang: str
     tgt_lang: str
     priority: str = "normal"
+    # Optional latency budget: work not started within it is dropped.
+    deadline_ms: Optional[int] = None
+
+    def deadline_s(self) -> float | None:
+        return None if self.deadline_ms is None else self.deadline_ms / 1000.0
 
 
 class BatchReq(BaseModel):
     items: List[Req]
 
 
+# Phase one of the hash-first batch protocol: content hashes (see
+# server.content_hash) of strings to translate between one language pair.
+class LookupReq(BaseModel):
+    src_lang: str
+    tgt_lang: str
+    hashes: List[str]
+
+
+# Either a whole document (split into paragraphs) or key -> string pairs,
+# e.g. a locale file.
+class JobReq(BaseModel):
+    src_lang: str
+    tgt_lang: str
+    document: Optional[str] = None
+    strings: Optional[Dict[str, str]] = None
+
+
+# Strings to translate into every language of `tgt_langs`, or the name of a
+# corpus file in TRANSLATION_PREWARM_DIR (see prewarm.py for the formats).
+class PrewarmReq(BaseModel):
+    tgt_langs: List[str]
+    src_lang: str = "auto"
+    strings: Optional[List[str]] = None
+    corpus_path: Optional[str] = None
+
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -49,45 +192,368 @@ class ChatMessage(BaseModel):
 
 class ChatReq(BaseModel):
     messages: List[ChatMessage]
+    priority: str = "normal"
+
+
+# Flow the scheduler shares capacity by: the X-Client-Id header (one id per
+# browser tab or session), else the client's address.
+def _client_id(request: Request) -> str:
+    header = request.headers.get("x-client-id", "").strip()
+    if header:
+        return header[:64]
+    return request.client.host if request.client else "anonymous"
+
+# Awaits a queue Future on the event loop instead of blocking a threadpool
+# thread. Futures can be shared between requests (single-flight), so a
+# cancelled request must not cancel the underlying work: hence the shield.
+async def _await_future(fut: Future[T]) -> T:
+    return await asyncio.shield(asyncio.wrap_future(fut))
+
+
+class _ClientGone(Exception):
+    pass
+
+
+# Resolves once the client has closed the connection. The request body has
+# already been read, so the next ASGI message is the disconnect.
+async def _disconnected(request: Request) -> None:
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+# Awaits `coro` unless the client disconnects first (_ClientGone).
+async def _unless_disconnected(request: Request, coro):
+    work = asyncio.ensure_future(coro)
+    gone = asyncio.ensure_future(_disconnected(request))
+    try:
+        await asyncio.wait({work, gone}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        work.cancel()
+        raise
+    finally:
+        gone.cancel()
+    if not work.done():
+        work.cancel()
+        raise _ClientGone()
+    return work.result()
+
+
+def _retry_after(status: int, detail: str, seconds: int) -> HTTPException:
+    return HTTPException(status_code=status, detail=detail, headers={"Retry-After": str(seconds)})
+
+
+# 429 if an item was refused at submission because its queue class is full.
+def _raise_if_rejected(futures: list[Future[str]]) -> None:
+    for f in futures:
+        if f.done() and isinstance(f.exception(), QueueFull):
+            release_translations(futures, cancel=False)
+            raise _retry_after(429, "queue_full", f.exception().retry_after)  # type: ignore[union-attr]
+
 
 # Translates a single UI string using the local LLM.
-# This endpoint blocks until the translation is available.
+# The handler waits asynchronously until the translation is available.
+# If the client disconnects while the item is still queued (and nobody else
+# waits for it), the item is cancelled.
 @app.post("/translate")
-def translate(req: Req):
-    return {
-        "translation": translate_with_llm(
-            req.text,
-            req.src_lang,
-            req.tgt_lang,
-            priority=req.priority,
-        )
-    }
+async def translate(req: Req, request: Request):
+    fut = submit_translation_with_llm(
+        req.text,
+        req.src_lang,
+        req.tgt_lang,
+        priority=req.priority,
+        deadline_s=req.deadline_s(),
+        hold=True,
+        client=_client_id(request),
+    )
+    try:
+        return {"translation": await _unless_disconnected(request, _await_future(fut))}
+    except QueueFull as e:
+        raise _retry_after(429, "queue_full", e.retry_after)
+    except Shed as e:
+        raise _retry_after(503, "shed", e.retry_after)
+    except DeadlineExceeded:
+        raise HTTPException(status_code=504, detail="deadline_exceeded")
+    except _ClientGone:
+        return Response(status_code=499)
+    except asyncio.CancelledError:
+        if not _withdrawn(fut):
+            raise
+        raise _retry_after(503, "withdrawn", 1)
+    finally:
+        release_translations([fut])
+
+# True if the queued work behind `fut` was withdrawn (release_translations).
+def _withdrawn(fut: Future[str]) -> bool:
+    return fut.done() and (fut.cancelled() or isinstance(fut.exception(), CancelledError))
+
+
+# Like _await_future, but maps a dropped (deadline-expired, shed, rejected
+# or withdrawn) item to None so the rest of a batch is still returned.
+# Cancellation of the awaiting task itself still propagates.
+async def _await_or_none(fut: Future[str]) -> str | None:
+    try:
+        return await _await_future(fut)
+    except (DeadlineExceeded, QueueFull):
+        return None
+    except asyncio.CancelledError:
+        if _withdrawn(fut):
+            return None
+        raise
+
+
+async def _gather_or_none(futures: list[Future[str]]) -> list[str | None]:
+    return list(await asyncio.gather(*(_await_or_none(f) for f in futures)))
+
 
 # Translates multiple UI strings in parallel.
 # Used by the frontend to batch requests and reduce overhead.
+# Short strings of the same language pair are packed into shared prompts.
+# Items dropped because of their deadline or shed under load come back as
+# null. If the queue refuses an item the whole batch gets 429; the accepted
+# items keep running, so a retry finds them in flight or cached.
 @app.post("/translate_batch")
-def translate_batch(req: BatchReq):
-    futures = [
-        submit_translation_with_llm(
-            it.text,
-            it.src_lang,
-            it.tgt_lang,
-            priority=it.priority,
+async def translate_batch(req: BatchReq, request: Request):
+    futures = submit_translation_batch_with_llm(
+        [(it.text, it.src_lang, it.tgt_lang, it.priority, it.deadline_s()) for it in req.items],
+        hold=True,
+        client=_client_id(request),
+    )
+    _raise_if_rejected(futures)
+    try:
+        translations = await _unless_disconnected(request, _gather_or_none(futures))
+    except _ClientGone:
+        return Response(status_code=499)
+    finally:
+        release_translations(futures)
+    return {"translations": translations}
+
+
+# Hash-first batch protocol: the client sends content hashes only and gets
+# back every translation the cache already holds plus the hashes it still
+# needs; it then posts just those texts to /translate_batch(_stream).
+# Nothing is queued here, so a page of known strings costs one small request.
+@app.post("/translate_lookup")
+def translate_lookup(req: LookupReq):
+    if len(req.hashes) > _LOOKUP_MAX_HASHES:
+        raise HTTPException(status_code=413, detail="too_many_hashes")
+    translations, missing = lookup_translations(req.src_lang, req.tgt_lang, req.hashes)
+    return {"translations": translations, "missing": missing}
+
+
+# Result of an already finished Future, with the same None/error mapping
+# as _await_or_none.
+def _done_result(fut: Future[str]) -> str | None:
+    if _withdrawn(fut):
+        return None
+    try:
+        return fut.result()
+    except DeadlineExceeded:
+        return None
+
+
+def _ndjson_line(index: int, translation: str | None = None, error: str | None = None) -> str:
+    obj: dict = {"index": index, "translation": translation}
+    if error is not None:
+        obj["error"] = error
+    return json.dumps(obj, ensure_ascii=False) + "\n"
+
+
+# Streaming variant of /translate_batch (NDJSON, one line per item).
+# Each line is `{"index": i, "translation": "..."}` and is emitted as soon as
+# that item is done: cache hits and fast-path results first, then LLM results
+# in completion order, so one slow paragraph no longer holds back labels.
+@app.post("/translate_batch_stream")
+async def translate_batch_stream(req: BatchReq, request: Request):
+    futures = submit_translation_batch_with_llm(
+        [(it.text, it.src_lang, it.tgt_lang, it.priority, it.deadline_s()) for it in req.items],
+        hold=True,
+        client=_client_id(request),
+    )
+    _raise_if_rejected(futures)
+
+    async def gen():
+        pending: dict[asyncio.Future, int] = {}
+        try:
+            for i, f in enumerate(futures):
+                if not f.done():
+                    pending[asyncio.ensure_future(_await_or_none(f))] = i
+                    continue
+                try:
+                    yield _ndjson_line(i, _done_result(f))
+                except Exception as e:
+                    yield _ndjson_line(i, error=str(e))
+
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    i = pending.pop(task)
+                    try:
+                        yield _ndjson_line(i, task.result())
+                    except Exception as e:
+                        yield _ndjson_line(i, error=str(e))
+        finally:
+            # The local waiters are cancelled; shielded queue work that other
+            # requests still wait for keeps running, the rest is withdrawn.
+            for task in pending:
+                task.cancel()
+            release_translations(futures)
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+
+def _jobs():
+    if _JOBS is None:
+        raise HTTPException(status_code=503, detail="jobs_disabled")
+    return _JOBS
+
+
+# Starts a bulk translation job and returns its id right away. Chunks are
+# translated at background priority; progress is read from /jobs/{id}.
+@app.post("/jobs", status_code=202)
+def create_job(req: JobReq):
+    try:
+        return _jobs().create(
+            src_lang=req.src_lang,
+            tgt_lang=req.tgt_lang,
+            document=req.document,
+            strings=req.strings,
         )
-        for it in req.items
-    ]
-    return {
-        "translations": [f.result() for f in futures]
-    }
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+# Job progress; includes `result` (a string or a key -> string mapping)
+# once the job is done.
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = _jobs().status(job_id, with_result=True)
+    if job is None:
+        raise HTTPException(status_code=404, detail="unknown_job")
+    return job
+
+
+# Progress as NDJSON: one status line per change, the last one with the
+# result. The stream ends when the job is no longer running.
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    jobs = _jobs()
+    if jobs.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="unknown_job")
+
+    async def gen():
+        last = None
+        while True:
+            job = await asyncio.to_thread(jobs.status, job_id, with_result=True)
+            if job is None:
+                return
+            progress = (job["status"], job["done"], job["failed"])
+            if progress != last:
+                last = progress
+                yield json.dumps(job, ensure_ascii=False) + "\n"
+            if job["status"] != "running":
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+
+# Stops a running job; finished chunks are kept.
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    jobs = _jobs()
+    if jobs.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="unknown_job")
+    jobs.cancel(job_id)
+    return jobs.status(job_id)
+
+
+@app.delete("/jobs/{job_id}")
+def delete_job(job_id: str):
+    if not _jobs().delete(job_id):
+        raise HTTPException(status_code=404, detail="unknown_job")
+    return {"deleted": job_id}
+
+
+# Live cache entries as gzip-compressed NDJSON, for /cache/import or
+# TRANSLATION_CACHE_IMPORT on another replica.
+@app.get("/cache/export")
+def cache_export(request: Request):
+    _check_admin(request)
+    return StreamingResponse(
+        export_entries(export_cache()),
+        media_type="application/gzip",
+        headers={"Content-Disposition": 'attachment; filename="translation-cache.ndjson.gz"'},
+    )
+
+
+# Loads an export (gzip or plain NDJSON body). Expired entries are skipped.
+@app.post("/cache/import")
+async def cache_import(request: Request):
+    _check_admin(request)
+    body = await request.body()
+    try:
+        loaded = await asyncio.to_thread(lambda: import_cache(parse_entries(body)))
+    except (ValueError, KeyError, OSError) as e:
+        raise HTTPException(status_code=422, detail=f"invalid_export: {e}")
+    return {"imported": loaded}
+
+
+# Starts a prewarm run; 409 while another one is in progress.
+@app.post("/cache/prewarm", status_code=202)
+def cache_prewarm(req: PrewarmReq, request: Request):
+    _check_admin(request)
+    texts = [(None, s) for s in req.strings or [] if s.strip()]
+    if req.corpus_path:
+        try:
+            texts += read_corpus(corpus_file(req.corpus_path))
+        except (ValueError, KeyError, OSError) as e:
+            raise HTTPException(status_code=422, detail=f"invalid_corpus: {e}")
+    langs = [l.strip() for l in req.tgt_langs if l.strip()]
+    if not texts or not langs:
+        raise HTTPException(status_code=422, detail="nothing_to_prewarm")
+    if not _PREWARM.start(texts, langs, src_lang=req.src_lang):
+        raise HTTPException(status_code=409, detail="prewarm_running")
+    return _PREWARM.status()
+
+
+@app.get("/cache/prewarm")
+def cache_prewarm_status(request: Request):
+    _check_admin(request)
+    return _PREWARM.status()
+
+
+# Stops the current prewarm run; queued items still complete.
+@app.delete("/cache/prewarm")
+def cache_prewarm_stop(request: Request):
+    _check_admin(request)
+    _PREWARM.stop()
+    return _PREWARM.status()
 
 
 # Streaming endpoint used for chat-style interactions with the LLM.
 # Not used by the automatic UI translation pipeline.
+# Chat streams are scheduled with translations (see astream_llama_chat_queued);
+# the response starts once the stream has a worker and its first token, so a
+# full queue is still reported as 429.
 @app.post("/chat_stream")
-def chat_stream(req: ChatReq):
-    def gen():
-        for chunk in stream_llama_chat([m.model_dump() for m in req.messages]):
-            yield f"data: {chunk}\n\n"
+async def chat_stream(req: ChatReq, request: Request):
+    chunks = astream_llama_chat_queued(
+        [m.model_dump() for m in req.messages],
+        priority=req.priority,
+        client=_client_id(request),
+    )
+    try:
+        first = await _unless_disconnected(request, anext(chunks, None))
+    except QueueFull as e:
+        raise _retry_after(429, "queue_full", e.retry_after)
+    except _ClientGone:
+        return Response(status_code=499)
+
+    async def gen():
+        if first is not None:
+            yield f"data: {first}\n\n"
+            async for chunk in chunks:
+                yield f"data: {chunk}\n\n"
         yield "data: [DONE]\n\n"
 
     return StreamingResponse(gen(), media_type="text/event-stream")
@@ -98,16 +564,74 @@ def chat_stream(req: ChatReq):
 def health():
     return {
         "status": "ok",
-        "engine": "llm-only",
+        "engine": "hybrid" if _ROUTER.enabled else "llm-only",
         "backend": "llama.cpp",
     }
 
 
-# Checks reachability of the local llama.cpp server.
+# Prometheus metrics (queue, llama.cpp calls, cache, fast paths, routing).
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+# Queued items per priority and, within each class, per client (largest
+# flows first), to see who is using the shared model.
+@app.get("/health/queue")
+def health_queue():
+    return {"depth": _TRANSLATION_QUEUE.depth(), "flows": _TRANSLATION_QUEUE.flows()}
+
+
+# In-memory cache size, hit ratio, evictions and admission rejections
+# (memory_cache.py), plus the persistent tier's counters.
+@app.get("/health/cache")
+def health_cache():
+    return _TRANSLATION_CACHE.stats()
+
+
+# Samples the stacks of every thread for `seconds` and returns them as
+# collapsed stacks (flamegraph.pl / speedscope input), see profiler.py.
+@app.get("/admin/profile")
+async def admin_profile(request: Request, seconds: float = 10.0, interval_ms: float = 5.0, idle: bool = False):
+    _check_admin(request)
+    if not profiler_enabled():
+        raise HTTPException(status_code=404, detail="profiler_disabled")
+    seconds = min(max(0.1, seconds), profile_max_seconds())
+    try:
+        stacks = await asyncio.to_thread(sample_stacks, seconds, interval=max(1.0, interval_ms) / 1000, idle=idle)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="profile_running")
+    return Response(stacks, media_type="text/plain")
+
+
+# Recent slow requests with their full span breakdown.
+@app.get("/admin/traces/slow")
+def admin_slow_traces(request: Request):
+    _check_admin(request)
+    if _TRACER is None:
+        raise HTTPException(status_code=404, detail="tracing_disabled")
+    return {"stats": _TRACER.stats(), "traces": _TRACER.slow_traces()}
+
+
+# Learned output tokens per input character and truncation counts per
+# language pair (the max_tokens model, see lengths.py).
+@app.get("/health/lengths")
+def health_lengths():
+    return _LENGTHS.stats()
+
+
+# Routing decisions between the LLM and the MT service, with the reasons
+# behind them and the latency estimates they were based on.
+@app.get("/health/router")
+def health_router():
+    return _ROUTER.stats()
+
+
+# Checks reachability of the llama.cpp backends (`GET /v1/models` each).
+# The service is "up" while at least one backend is healthy.
 # Results are cached briefly to avoid excessive polling.
 @app.get("/health/llama")
-def health_llama():
-    base = "http://127.0.0.1:7001"
+async def health_llama():
     # Cache results briefly to avoid hammering llama-server (and to reduce UI lag
     # if a frontend accidentally polls too often).
     #
@@ -123,17 +647,17 @@ def health_llama():
         if cached["value"] is not None and (time.time() - cached["ts"]) < ttl_s:
             return cached["value"]
 
-    try:
-        r = requests.get(f"{base}/v1/models", timeout=1.5)
-        r.raise_for_status()
-        j = r.json()
-        models = [m.get("id") for m in j.get("data", []) if isinstance(m, dict)]
-        value = {"status": "ok", "llama": "up", "models": models}
-        with health_llama._lock:  # type: ignore[attr-defined]
-            health_llama._cache = {"ts": time.time(), "value": value}  # type: ignore[attr-defined]
-        return value
-    except Exception as e:
-        value = {"status": "degraded", "llama": "down", "error": str(e)}
-        with health_llama._lock:  # type: ignore[attr-defined]
-            health_llama._cache = {"ts": time.time(), "value": value}  # type: ignore[attr-defined]
-        return value
+    # Probing also updates the pool, so a recovered backend is re-admitted
+    # immediately instead of at the next periodic check.
+    await asyncio.gather(*(_BACKENDS.acheck(b) for b in _BACKENDS.backends))
+    backends = _BACKENDS.status()
+    healthy = [b for b in backends if b["healthy"]]
+    if healthy:
+        models = sorted({m for b in healthy for m in b["models"] if m})
+        value = {"status": "ok", "llama": "up", "models": models, "backends": backends}
+    else:
+        errors = "; ".join(f"{b['name']}: {b['error']}" for b in backends)
+        value = {"status": "degraded", "llama": "down", "error": errors, "backends": backends}
+    with health_llama._lock:  # type: ignore[attr-defined]
+        health_llama._cache = {"ts": time.time(), "value": value}  # type: ignore[attr-defined]
+    return value
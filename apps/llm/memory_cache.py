@@ -0,0 +1,388 @@
+"""
+In-memory tier of the translation cache.
+
+Every lookup of the translation path goes through this cache, so it is
+built to stay out of the way of concurrent requests and to spend its memory
+on the strings that are actually reused:
+
+- entries are spread over shards by key hash, each with its own lock and
+  LRU order, so lookups on different shards never wait for each other;
+- eviction is driven by a byte budget (split evenly over the shards): an
+  entry is charged for its key text and translation plus a fixed overhead,
+  so a 4 KB paragraph costs what it occupies instead of counting like "OK";
+- strings the model returns unchanged (brand names, codes, "OK") are kept
+  as identity entries with their own, shorter TTL. They are not written to
+  the persistent tier or exported;
+- optionally (`admission="tinylfu"`) new entries have to earn their place:
+  a count-min sketch with 4-bit counters, halved periodically, estimates
+  how often each key was looked up, and a new entry is only admitted into
+  a full shard when it is more frequent than every entry it would evict.
+  One-off paragraphs then no longer push out hot UI labels;
+- entries are also indexed by (target language, content hash) and source
+  language for the hash-first lookup protocol (see `text_digest`).
+
+Configuration:
+
+    TRANSLATION_CACHE_MAX_BYTES=67108864        # byte budget of the memory tier
+    TRANSLATION_CACHE_MAX=0                     # optional entry limit, 0 = none
+    TRANSLATION_CACHE_SHARDS=16
+    TRANSLATION_CACHE_ADMISSION=lru             # or tinylfu
+    TRANSLATION_CACHE_IDENTITY_TTL_SECONDS=3600
+"""
+import math
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator, NamedTuple
+
+from disk_cache import CacheKey, _DiskCacheTier
+from metrics import CACHE_EVICTIONS, CACHE_EXPIRED, CACHE_LOOKUPS, CACHE_REJECTED
+
+# Dictionary slots, tuples and the hash index entry, roughly.
+_ENTRY_OVERHEAD = 320
+
+_FNV_PRIME = 0x01000193
+_FNV_BASES = (0x811C9DC5, 0x050C5D1F)
+
+
+# Two FNV-1a 32-bit hashes (different offset bases) over the UTF-16 code
+# units of already normalized text, as 16 hex digits. Must match
+# contentHash() in the web client (apps/web/src/auto-translator/contentHash.ts).
+def text_digest(normalized: str) -> str:
+    units = memoryview(normalized.encode("utf-16")[2:]).cast("H")
+    h1, h2 = _FNV_BASES
+    for c in units:
+        h1 = ((h1 ^ c) * _FNV_PRIME) & 0xFFFFFFFF
+        h2 = ((h2 ^ c) * _FNV_PRIME) & 0xFFFFFFFF
+    return f"{h1:08x}{h2:08x}"
+
+
+class _Entry(NamedTuple):
+    ts: float
+    value: str
+    digest: str
+    size: int
+    identity: bool
+
+
+_HALVE = bytes(i >> 1 for i in range(256))
+_SKETCH_SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+_MASK64 = (1 << 64) - 1
+
+
+# Count-min sketch of key popularity (TinyLFU): four rows of 4-bit
+# counters. After `10 * width` increments every counter is halved, so the
+# estimate follows recent popularity instead of all-time counts.
+class _FrequencySketch:
+    def __init__(self, width: int):
+        self._bits = max(4, math.ceil(math.log2(max(16, width))))
+        self._rows = [bytearray(1 << self._bits) for _ in _SKETCH_SEEDS]
+        self._sample = 10 << self._bits
+        self._additions = 0
+
+    def _slots(self, h: int):
+        shift = 64 - self._bits
+        for row, seed in zip(self._rows, _SKETCH_SEEDS):
+            yield row, ((h * seed) & _MASK64) >> shift
+
+    def increment(self, h: int) -> None:
+        for row, i in self._slots(h):
+            if row[i] < 15:
+                row[i] += 1
+        self._additions += 1
+        if self._additions >= self._sample:
+            self._rows = [bytearray(row.translate(_HALVE)) for row in self._rows]
+            self._additions //= 2
+
+    def estimate(self, h: int) -> int:
+        return min(row[i] for row, i in self._slots(h))
+
+
+class _Shard:
+    def __init__(self, max_bytes: int, max_entries: int, sketch_width: int | None):
+        self.lock = threading.Lock()
+        self.items: "OrderedDict[CacheKey, _Entry]" = OrderedDict()
+        self.bytes = 0
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sketch = _FrequencySketch(sketch_width) if sketch_width else None
+        self.hits = 0
+        self.identity_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.rejected = 0
+
+    def remove_locked(self, key: CacheKey) -> _Entry:
+        entry = self.items.pop(key)
+        self.bytes -= entry.size
+        return entry
+
+    def full(self, extra_bytes: int, extra_entries: int) -> bool:
+        if self.bytes + extra_bytes > self.max_bytes:
+            return True
+        return bool(self.max_entries) and len(self.items) + extra_entries > self.max_entries
+
+
+class _TranslationCache:
+    def __init__(
+        self,
+        *,
+        max_bytes: int,
+        ttl_seconds: float,
+        identity_ttl_seconds: float = 3600.0,
+        max_entries: int = 0,
+        shards: int = 16,
+        admission: str = "lru",
+        backing: _DiskCacheTier | None = None,
+    ):
+        n = max(1, int(shards))
+        self._max_bytes = max(n * _ENTRY_OVERHEAD, int(max_bytes))
+        self._max_entries = max(0, int(max_entries))
+        self._ttl_seconds = max(1.0, float(ttl_seconds))
+        self._identity_ttl_seconds = max(1.0, float(identity_ttl_seconds))
+        self._admission = admission if admission in ("lru", "tinylfu") else "lru"
+        per_shard_entries = math.ceil(self._max_entries / n) if self._max_entries else 0
+        # Sketch width: about as many counters as the shard holds entries
+        # of a typical (short UI string) size.
+        sketch_width = (self._max_bytes // n) // 512 if self._admission == "tinylfu" else None
+        self._shards = [_Shard(self._max_bytes // n, per_shard_entries, sketch_width) for _ in range(n)]
+        # (target language, content hash) -> source language -> key,
+        # sharded by hash.
+        self._index_locks = [threading.Lock() for _ in range(n)]
+        self._index: list[dict[tuple[str, str], dict[str, CacheKey]]] = [{} for _ in range(n)]
+        self._backing = backing
+
+    def _shard(self, h: int) -> _Shard:
+        return self._shards[h % len(self._shards)]
+
+    def _index_slot(self, digest: str) -> int:
+        return int(digest[:8], 16) % len(self._index)
+
+    def _ttl(self, entry: _Entry) -> float:
+        return self._identity_ttl_seconds if entry.identity else self._ttl_seconds
+
+    def _unindex(self, key: CacheKey, digest: str) -> None:
+        slot = self._index_slot(digest)
+        with self._index_locks[slot]:
+            by_src = self._index[slot].get((key[1], digest))
+            if by_src is not None and by_src.get(key[0]) == key:
+                del by_src[key[0]]
+                if not by_src:
+                    del self._index[slot][(key[1], digest)]
+
+    def get(self, key: CacheKey) -> str | None:
+        h = hash(key)
+        shard = self._shard(h)
+        now = time.time()
+        hit: _Entry | None = None
+        expired: _Entry | None = None
+        with shard.lock:
+            if shard.sketch is not None:
+                shard.sketch.increment(h)
+            entry = shard.items.get(key)
+            if entry is not None and now - entry.ts <= self._ttl(entry):
+                shard.items.move_to_end(key)
+                hit = entry
+                if entry.identity:
+                    shard.identity_hits += 1
+                else:
+                    shard.hits += 1
+            else:
+                shard.misses += 1
+                if entry is not None:
+                    expired = shard.remove_locked(key)
+                    shard.expired += 1
+        # Counters and the index are updated outside the shard lock.
+        if hit is not None:
+            CACHE_LOOKUPS.labels("identity" if hit.identity else "hit").inc()
+            return hit.value
+        CACHE_LOOKUPS.labels("miss").inc()
+        if expired is not None:
+            CACHE_EXPIRED.inc()
+            self._unindex(key, expired.digest)
+
+        if self._backing is None:
+            return None
+
+        # Disk lookup happens outside the lock so other threads are not held
+        # up by I/O; promotion keeps the original timestamp (and TTL).
+        stored = self._backing.get(key)
+        if stored is None:
+            return None
+        self._insert(key, stored[0], stored[1])
+        return stored[1]
+
+    def set(self, key: CacheKey, value: str) -> None:
+        self._insert(key, time.time(), value)
+        if self._backing is not None:
+            self._backing.put(key, value)
+
+    # Remembers that the model returned the text unchanged, so it is not
+    # sent again until the (shorter) identity TTL runs out.
+    def set_identity(self, key: CacheKey, value: str) -> None:
+        self._insert(key, time.time(), value, identity=True)
+
+    # Inserts (or replaces) an entry, evicting from the LRU end of its shard
+    # until the shard is back within budget. Returns False if the entry was
+    # not admitted.
+    def _insert(self, key: CacheKey, ts: float, value: str, *, identity: bool = False) -> bool:
+        digest = text_digest(key[2])
+        size = sys.getsizeof(key[2]) + sys.getsizeof(value) + _ENTRY_OVERHEAD
+        entry = _Entry(ts, value, digest, size, identity)
+        h = hash(key)
+        shard = self._shard(h)
+        now = time.time()
+        evicted: list[tuple[CacheKey, _Entry]] = []
+        with shard.lock:
+            replaced = shard.items.pop(key, None)
+            if replaced is not None:
+                shard.bytes -= replaced.size
+            admitted = size <= shard.max_bytes
+            victims: list[CacheKey] = []
+            if admitted and shard.full(size, 1):
+                freed = 0
+                for victim in shard.items:
+                    if not shard.full(size - freed, 1 - len(victims)):
+                        break
+                    victims.append(victim)
+                    freed += shard.items[victim].size
+                if shard.sketch is not None and replaced is None:
+                    # TinyLFU: only displace entries that are less popular
+                    # than the newcomer (expired ones always go).
+                    freq = shard.sketch.estimate(h)
+                    admitted = all(
+                        shard.sketch.estimate(hash(v)) < freq
+                        for v in victims
+                        if now - shard.items[v].ts <= self._ttl(shard.items[v])
+                    )
+            if admitted:
+                for victim in victims:
+                    evicted.append((victim, shard.remove_locked(victim)))
+                shard.evictions += len(evicted)
+                shard.items[key] = entry
+                shard.bytes += size
+            else:
+                shard.rejected += 1
+                if replaced is not None:
+                    shard.items[key] = replaced
+                    shard.bytes += replaced.size
+
+        if evicted:
+            CACHE_EVICTIONS.inc(len(evicted))
+            for victim, old in evicted:
+                self._unindex(victim, old.digest)
+        if not admitted:
+            CACHE_REJECTED.inc()
+            return False
+        slot = self._index_slot(digest)
+        with self._index_locks[slot]:
+            self._index[slot].setdefault((key[1], digest), {})[key[0]] = key
+        return True
+
+    # Stores an entry from an export, keeping its insertion time. Returns
+    # False for entries that have already expired or were not admitted.
+    def load(self, key: CacheKey, value: str, ts: float) -> bool:
+        if time.time() - ts > self._ttl_seconds:
+            return False
+        if self._backing is not None:
+            self._backing.put(key, value, ts=ts)
+        return self._insert(key, ts, value)
+
+    # Cached translation of the string with content hash `digest`, stored
+    # under this source language: the same string in two languages has two
+    # translations. For "auto", `detect` (if given) picks the source
+    # language the way an "auto" request would, from the cached text; its
+    # None means the entry stored as "auto". Only the memory tier is
+    # indexed.
+    def get_by_hash(
+        self,
+        src: str,
+        tgt: str,
+        digest: str,
+        *,
+        detect: Callable[[str], str | None] | None = None,
+    ) -> str | None:
+        slot = self._index_slot(digest)
+        with self._index_locks[slot]:
+            by_src = dict(self._index[slot].get((tgt, digest), {}))
+        if src == "auto" and detect is not None and by_src:
+            src = detect(next(iter(by_src.values()))[2]) or "auto"
+        key = by_src.get(src)
+        if key is None:
+            return None
+        h = hash(key)
+        shard = self._shard(h)
+        with shard.lock:
+            if shard.sketch is not None:
+                shard.sketch.increment(h)
+            entry = shard.items.get(key)
+            if entry is None or time.time() - entry.ts > self._ttl(entry):
+                return None
+            shard.items.move_to_end(key)
+            return entry.value
+
+    # Iterates live entries as `(key, value, timestamp)`: the memory tier
+    # first, then persistent rows that are not in memory. Identity entries
+    # are left out.
+    def entries(self) -> Iterator[tuple[CacheKey, str, float]]:
+        cutoff = time.time() - self._ttl_seconds
+        snapshot: list[tuple[CacheKey, str, float]] = []
+        for shard in self._shards:
+            with shard.lock:
+                snapshot.extend(
+                    (key, e.value, e.ts) for key, e in shard.items.items() if not e.identity and e.ts >= cutoff
+                )
+        yield from snapshot
+        if self._backing is None:
+            return
+        seen = {key for key, _, _ in snapshot}
+        for key, value, ts in self._backing.entries():
+            if key not in seen:
+                yield key, value, ts
+
+    def stats(self) -> dict:
+        totals = dict.fromkeys(
+            ("entries", "identity_entries", "bytes", "hits", "identity_hits", "misses", "evictions", "expired", "rejected"),
+            0,
+        )
+        for shard in self._shards:
+            with shard.lock:
+                totals["entries"] += len(shard.items)
+                totals["identity_entries"] += sum(1 for e in shard.items.values() if e.identity)
+                totals["bytes"] += shard.bytes
+                totals["hits"] += shard.hits
+                totals["identity_hits"] += shard.identity_hits
+                totals["misses"] += shard.misses
+                totals["evictions"] += shard.evictions
+                totals["expired"] += shard.expired
+                totals["rejected"] += shard.rejected
+        hashed = 0
+        for lock, index in zip(self._index_locks, self._index):
+            with lock:
+                hashed += sum(len(by_src) for by_src in index.values())
+        lookups = totals["hits"] + totals["identity_hits"] + totals["misses"]
+        return {
+            **totals,
+            "max_bytes": self._max_bytes,
+            "max_entries": self._max_entries or None,
+            "shards": len(self._shards),
+            "admission": self._admission,
+            "hit_ratio": round((totals["hits"] + totals["identity_hits"]) / lookups, 4) if lookups else 0.0,
+            "hashed": hashed,
+            "disk": self._backing.stats() if self._backing is not None else None,
+        }
+
+
+def memory_cache_from_env(*, ttl_seconds: float, backing: _DiskCacheTier | None) -> _TranslationCache:
+    return _TranslationCache(
+        max_bytes=int(os.environ.get("TRANSLATION_CACHE_MAX_BYTES", str(64 << 20)) or 0),
+        max_entries=int(os.environ.get("TRANSLATION_CACHE_MAX", "0") or 0),
+        shards=int(os.environ.get("TRANSLATION_CACHE_SHARDS", "16") or 1),
+        admission=os.environ.get("TRANSLATION_CACHE_ADMISSION", "lru").strip().lower(),
+        identity_ttl_seconds=float(os.environ.get("TRANSLATION_CACHE_IDENTITY_TTL_SECONDS", "3600") or 1),
+        ttl_seconds=ttl_seconds,
+        backing=backing,
+    )
@@ -0,0 +1,239 @@
+"""
+Prometheus metrics for the translation service (`GET /metrics`).
+
+Hot-path events (queue waits, llama.cpp calls, cache lookups, fast-path
+skips) are recorded with prometheus_client counters and histograms, which
+only take a lock private to each labelled child. State that already lives
+elsewhere (queue depth, disk tier counters, backend health, routing
+decisions) is read by `_StateCollector` at scrape time, so it costs nothing
+between scrapes.
+"""
+from typing import Callable
+
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0)
+_WAIT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+QUEUE_WAIT = Histogram(
+    "translation_queue_wait_seconds",
+    "Time between queueing an item and a worker starting it.",
+    ["priority"],
+    buckets=_WAIT_BUCKETS,
+)
+QUEUE_EXPIRED = Counter(
+    "translation_queue_expired_total",
+    "Items dropped because their deadline passed while queued.",
+    ["priority"],
+)
+QUEUE_REJECTED = Counter(
+    "translation_queue_rejected_total",
+    "Items refused because their class was at capacity (HTTP 429).",
+    ["priority"],
+)
+QUEUE_SHED = Counter(
+    "translation_queue_shed_total",
+    "Stale background items dropped to make room under overload.",
+)
+QUEUE_CANCELLED = Counter(
+    "translation_queue_cancelled_total",
+    "Queued items cancelled because every client waiting for them disconnected.",
+    ["priority"],
+)
+QUEUE_PREEMPTED = Counter(
+    "translation_queue_preempted_total",
+    "Running background items that yielded their worker to critical work.",
+)
+
+LLAMA_LATENCY = Histogram(
+    "llama_request_duration_seconds",
+    "Duration of chat completion calls to llama-server.",
+    ["backend", "mode"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLAMA_ERRORS = Counter(
+    "llama_request_errors_total",
+    "Failed chat completion calls to llama-server.",
+    ["backend", "error"],
+)
+LLAMA_PROMPT_TOKENS = Counter(
+    "llama_prompt_tokens_total",
+    "Prompt tokens evaluated by llama-server.",
+    ["backend"],
+)
+LLAMA_CACHED_TOKENS = Counter(
+    "llama_prompt_cached_tokens_total",
+    "Prompt tokens reused from a slot's KV cache.",
+    ["backend"],
+)
+LLAMA_COMPLETION_TOKENS = Counter(
+    "llama_completion_tokens_total",
+    "Tokens generated by llama-server.",
+    ["backend"],
+)
+LLAMA_TOKENS_PER_SECOND = Histogram(
+    "llama_generation_tokens_per_second",
+    "Generation speed per call, from llama-server timings.",
+    ["backend"],
+    buckets=(5, 10, 20, 30, 40, 60, 80, 120, 160, 240),
+)
+
+CACHE_LOOKUPS = Counter(
+    "translation_cache_lookups_total",
+    "In-memory translation cache lookups.",
+    ["result"],
+)
+CACHE_EVICTIONS = Counter(
+    "translation_cache_evictions_total",
+    "Entries evicted from the in-memory cache to respect its byte budget.",
+)
+CACHE_REJECTED = Counter(
+    "translation_cache_admission_rejected_total",
+    "New entries the in-memory cache's TinyLFU admission turned away.",
+)
+CACHE_EXPIRED = Counter(
+    "translation_cache_expired_total",
+    "Entries found in the in-memory cache after their TTL.",
+)
+HASH_LOOKUPS = Counter(
+    "translation_cache_hash_lookups_total",
+    "Content hashes looked up by /translate_lookup.",
+    ["result"],
+)
+TRUNCATIONS = Counter(
+    "translation_truncations_total",
+    "Translation generations that hit their max_tokens cap.",
+    ["mode"],
+)
+STOP_RETRIES = Counter(
+    "translation_stop_retries_total",
+    "Generations cut empty by a stop sequence and retried without stops.",
+)
+FAST_PATH = Counter(
+    "translation_fast_path_total",
+    "Requests answered without queueing, by reason.",
+    ["reason"],
+)
+
+
+# Records one llama.cpp call from its `usage` and `timings` blocks.
+def observe_llama_call(backend: str, mode: str, seconds: float, data: dict | None) -> None:
+    LLAMA_LATENCY.labels(backend, mode).observe(seconds)
+    if not data:
+        return
+    usage = data.get("usage") or {}
+    timings = data.get("timings") or {}
+    prompt = timings.get("prompt_n", usage.get("prompt_tokens"))
+    completion = timings.get("predicted_n", usage.get("completion_tokens"))
+    if prompt:
+        LLAMA_PROMPT_TOKENS.labels(backend).inc(prompt)
+    if timings.get("cache_n"):
+        LLAMA_CACHED_TOKENS.labels(backend).inc(timings["cache_n"])
+    if completion:
+        LLAMA_COMPLETION_TOKENS.labels(backend).inc(completion)
+        per_second = timings.get("predicted_per_second")
+        if not per_second and timings.get("predicted_ms"):
+            per_second = completion * 1000.0 / timings["predicted_ms"]
+        if per_second:
+            LLAMA_TOKENS_PER_SECOND.labels(backend).observe(per_second)
+
+
+# Exposes state owned by other components, read at scrape time.
+class _StateCollector:
+    def __init__(self, **sources: Callable[[], object]):
+        self._sources = sources
+
+    def _get(self, name: str):
+        source = self._sources.get(name)
+        return source() if source is not None else None
+
+    def collect(self):
+        depth = self._get("queue_depth")
+        if depth is not None:
+            g = GaugeMetricFamily("translation_queue_depth", "Queued (not running) items.", labels=["priority"])
+            for priority, n in depth.items():
+                g.add_metric([priority], n)
+            yield g
+
+        cache = self._get("cache")
+        if cache is not None:
+            yield GaugeMetricFamily("translation_cache_entries", "Entries in the in-memory cache.", value=cache["entries"])
+            yield GaugeMetricFamily("translation_cache_bytes", "Estimated size of the in-memory cache.", value=cache["bytes"])
+            disk = cache.get("disk")
+            if disk is not None:
+                c = CounterMetricFamily("translation_cache_disk_lookups", "Persistent tier lookups.", labels=["result"])
+                c.add_metric(["hit"], disk["hits"])
+                c.add_metric(["miss"], disk["misses"])
+                yield c
+                yield CounterMetricFamily("translation_cache_disk_writes", "Rows written to the persistent tier.", value=disk["writes"])
+                yield CounterMetricFamily("translation_cache_disk_compacted", "Expired rows removed from the persistent tier.", value=disk["compacted"])
+
+        memory = self._get("memory")
+        if memory is not None:
+            yield GaugeMetricFamily("translation_memory_entries", "Entries in the translation memory.", value=memory["entries"])
+            c = CounterMetricFamily("translation_memory_lookups", "Translation memory lookups.", labels=["result"])
+            c.add_metric(["exact"], memory["exact_hits"])
+            c.add_metric(["miss"], memory["misses"])
+            yield c
+            yield CounterMetricFamily(
+                "translation_memory_examples",
+                "Similar strings from the translation memory given to the LLM as examples.",
+                value=memory["examples"],
+            )
+
+        langid = self._get("langid")
+        if langid is not None:
+            c = CounterMetricFamily("translation_langid", "Language identification of src_lang=auto.", labels=["result"])
+            c.add_metric(["detected"], langid["detected"])
+            c.add_metric(["uncertain"], langid["uncertain"])
+            yield c
+
+        lengths = self._get("lengths")
+        if lengths is not None:
+            g = GaugeMetricFamily(
+                "translation_output_tokens_per_char",
+                "Learned output tokens per input character, by language pair.",
+                labels=["pair"],
+            )
+            for pair, s in lengths.items():
+                g.add_metric([pair], s["tokens_per_char"])
+            yield g
+
+        jobs = self._get("jobs")
+        if jobs is not None:
+            g = GaugeMetricFamily("translation_jobs", "Bulk translation jobs by status.", labels=["status"])
+            for status, n in jobs["jobs"].items():
+                g.add_metric([status], n)
+            yield g
+            yield GaugeMetricFamily("translation_job_chunks_waiting", "Job chunks not yet queued.", value=jobs["waiting_chunks"])
+
+        tracing = self._get("tracing")
+        if tracing is not None:
+            yield CounterMetricFamily("http_slow_requests", "Requests slower than TRACE_SLOW_MS.", value=tracing["slow"])
+
+        backends = self._get("backends")
+        if backends is not None:
+            up = GaugeMetricFamily("llama_backend_up", "Whether a llama-server backend is in rotation.", labels=["backend"])
+            busy = GaugeMetricFamily("llama_backend_in_flight", "Requests running on a backend.", labels=["backend"])
+            for b in backends:
+                up.add_metric([b["name"]], 1 if b["healthy"] else 0)
+                busy.add_metric([b["name"]], b["in_flight"])
+            yield up
+            yield busy
+
+        router = self._get("router")
+        if router is not None:
+            routes = CounterMetricFamily("translation_routes", "Routing decisions between the LLM and MT.", labels=["route"])
+            for route, n in router["routes"].items():
+                routes.add_metric([route], n)
+            yield routes
+            reasons = CounterMetricFamily("translation_route_reasons", "Reasons behind routing decisions.", labels=["reason"])
+            for reason, n in router["reasons"].items():
+                reasons.add_metric([reason], n)
+            yield reasons
+            yield CounterMetricFamily("translation_mt_failures", "MT calls that fell back to the LLM.", value=router["mt_failures"])
+
+
+def register_state(**sources: Callable[[], object]) -> None:
+    REGISTRY.register(_StateCollector(**sources))
@@ -0,0 +1,262 @@
+"""
+Cache prewarming and cache export/import.
+
+After a deploy every known UI string costs a full generation for its first
+visitor. The prewarmer takes a corpus of strings and a list of target
+languages and pushes the missing translations through the `background`
+queue at a bounded rate, so the cache (and its persistent tier) is warm
+before users ask:
+
+- the rate is a token bucket (`rate` items per second); cache and
+  translation memory hits resolve immediately and are not counted;
+- at most `max_in_flight` items are queued at once, and nothing is
+  submitted while interactive (`critical`/`normal`) work is waiting.
+
+Corpus files can be plain text (one string per line), JSON (a list of
+strings, or a locale file mapping keys to strings, nested to any depth) or
+a cache export.
+`POST /cache/prewarm` only reads them from TRANSLATION_PREWARM_DIR.
+
+Exports are gzip-compressed NDJSON, one entry per line:
+
+    {"src": "en", "tgt": "it", "text": "Save", "translation": "Salva", "ts": 1718000000.0}
+
+`ts` is the original insertion time, so imported entries keep their TTL.
+
+Configuration:
+
+    TRANSLATION_CACHE_IMPORT=/srv/warm.ndjson.gz   # loaded at startup
+    TRANSLATION_PREWARM_CORPUS=/srv/ui-strings.txt
+    TRANSLATION_PREWARM_LANGS=it,fr,de
+    TRANSLATION_PREWARM_SRC=en                     # default auto
+    TRANSLATION_PREWARM_RATE=2                     # items per second
+    TRANSLATION_PREWARM_MAX_IN_FLIGHT=4
+    TRANSLATION_PREWARM_DIR=/srv/corpora          # corpora POST /cache/prewarm may read
+"""
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import IO, Callable, Iterable, Iterator
+
+CacheEntry = tuple[tuple[str, str, str], str, float]
+Submit = Callable[..., Future[str]]
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _open_text(path: str) -> IO[str]:
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    if magic == _GZIP_MAGIC:
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+# Path of the corpus `name` inside TRANSLATION_PREWARM_DIR. Raises
+# ValueError if no directory is configured or `name` points outside it.
+def corpus_file(name: str) -> str:
+    root = os.environ.get("TRANSLATION_PREWARM_DIR", "").strip()
+    if not root:
+        raise ValueError("TRANSLATION_PREWARM_DIR is not set")
+    base = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(base, name))
+    if os.path.commonpath([base, path]) != base or not os.path.isfile(path):
+        raise ValueError(f"no corpus named {name!r}")
+    return path
+
+
+# Strings of a JSON corpus: nested objects (the usual i18n layout) and
+# lists are flattened; other values (numbers, booleans, null) are counted
+# in `skipped`.
+def _json_strings(value, skipped: list[int]) -> Iterator[str]:
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for v in value.values():
+            yield from _json_strings(v, skipped)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _json_strings(v, skipped)
+    else:
+        skipped[0] += 1
+
+
+# Reads `(src_lang or None, text)` pairs from a corpus file.
+def read_corpus(path: str) -> list[tuple[str | None, str]]:
+    with _open_text(path) as f:
+        data = f.read()
+    stripped = data.lstrip()
+    if stripped.startswith("[") or (stripped.startswith("{") and "\n{" not in stripped):
+        skipped = [0]
+        strings = [(None, s) for s in _json_strings(json.loads(data), skipped)]
+        if skipped[0]:
+            print(f"WARNING: corpus {path}: skipped {skipped[0]} non-string value(s)")
+        return strings
+    if stripped.startswith("{"):
+        out: list[tuple[str | None, str]] = []
+        for line in data.splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                out.append((entry.get("src"), entry["text"]))
+        return out
+    return [(None, line) for line in data.splitlines() if line.strip()]
+
+
+# Serializes cache entries as gzip NDJSON chunks (for streaming responses).
+def export_entries(entries: Iterable[CacheEntry], *, chunk_size: int = 1 << 16) -> Iterator[bytes]:
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+    buf: list[str] = []
+    size = 0
+    for (src, tgt, text), value, ts in entries:
+        line = json.dumps({"src": src, "tgt": tgt, "text": text, "translation": value, "ts": ts}, ensure_ascii=False)
+        buf.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield gz.compress(("\n".join(buf) + "\n").encode("utf-8"))
+            buf, size = [], 0
+    if buf:
+        yield gz.compress(("\n".join(buf) + "\n").encode("utf-8"))
+    yield gz.flush()
+
+
+# Parses an export (gzip or plain NDJSON) back into cache entries.
+def parse_entries(data: bytes) -> Iterator[CacheEntry]:
+    if data[:2] == _GZIP_MAGIC:
+        data = gzip.decompress(data)
+    for line in data.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        e = json.loads(line)
+        yield (e["src"], e["tgt"], e["text"]), e["translation"], float(e.get("ts") or time.time())
+
+
+class _Prewarmer:
+    def __init__(
+        self,
+        submit: Submit,
+        *,
+        rate: float = 2.0,
+        max_in_flight: int = 4,
+        busy: Callable[[], bool] = lambda: False,
+    ):
+        self._submit = submit
+        self._rate = max(0.01, float(rate))
+        self._max_in_flight = max(1, int(max_in_flight))
+        self._busy = busy
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._reset(0)
+
+    def _reset(self, total: int) -> None:
+        self._total = total
+        self._submitted = 0
+        self._warm = 0
+        self._translated = 0
+        self._failed = 0
+        self._in_flight = 0
+        self._started_at = time.time()
+        self._finished_at: float | None = None
+
+    # Starts prewarming `texts` into every language of `targets`. Returns
+    # False if a run is already in progress.
+    def start(self, texts: list[tuple[str | None, str]], targets: list[str], *, src_lang: str = "auto") -> bool:
+        items = [(text, src or src_lang, tgt) for src, text in texts for tgt in targets]
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._reset(len(items))
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(items,), name="cache-prewarm", daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _done(self, fut: Future[str]) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            if fut.exception() is None:
+                self._translated += 1
+            else:
+                self._failed += 1
+
+    def _run(self, items: list[tuple[str, str, str]]) -> None:
+        tokens = 1.0
+        last = time.monotonic()
+        for text, src, tgt in items:
+            # Token bucket, a free slot and a quiet queue.
+            while not self._stop.is_set():
+                now = time.monotonic()
+                tokens = min(1.0, tokens + (now - last) * self._rate)
+                last = now
+                with self._lock:
+                    slot = self._in_flight < self._max_in_flight
+                if tokens >= 1.0 and slot and not self._busy():
+                    break
+                time.sleep(min(0.25, max(0.01, (1.0 - tokens) / self._rate)))
+            if self._stop.is_set():
+                break
+
+            fut = self._submit(text, src, tgt, priority="background")
+            with self._lock:
+                self._submitted += 1
+                if fut.done():
+                    # Cache hits and skipped strings cost nothing.
+                    if fut.exception() is None:
+                        self._warm += 1
+                    else:
+                        self._failed += 1
+                    continue
+                self._in_flight += 1
+            tokens -= 1.0
+            fut.add_done_callback(self._done)
+        with self._lock:
+            self._finished_at = time.time()
+
+    def status(self) -> dict:
+        with self._lock:
+            running = self._thread is not None and self._thread.is_alive()
+            return {
+                "running": running,
+                "total": self._total,
+                "submitted": self._submitted,
+                "already_warm": self._warm,
+                "translated": self._translated,
+                "failed": self._failed,
+                "in_flight": self._in_flight,
+                "rate": self._rate,
+                "started_at": self._started_at if self._total else None,
+                "finished_at": self._finished_at,
+            }
+
+
+def prewarmer_from_env(submit: Submit, *, busy: Callable[[], bool]) -> _Prewarmer:
+    return _Prewarmer(
+        submit,
+        rate=float(os.environ.get("TRANSLATION_PREWARM_RATE", "2") or 2),
+        max_in_flight=int(os.environ.get("TRANSLATION_PREWARM_MAX_IN_FLIGHT", "4") or 1),
+        busy=busy,
+    )
+
+
+# Starts the startup prewarm configured by TRANSLATION_PREWARM_CORPUS and
+# TRANSLATION_PREWARM_LANGS, if any.
+def start_from_env(prewarmer: _Prewarmer) -> None:
+    path = os.environ.get("TRANSLATION_PREWARM_CORPUS", "").strip()
+    langs = [l.strip() for l in os.environ.get("TRANSLATION_PREWARM_LANGS", "").split(",") if l.strip()]
+    if not path or not langs:
+        return
+    try:
+        corpus = read_corpus(path)
+    except Exception as e:
+        print(f"WARNING: cache prewarm disabled ({path}): {e}")
+        return
+    src = os.environ.get("TRANSLATION_PREWARM_SRC", "auto").strip() or "auto"
+    prewarmer.start(corpus, langs, src_lang=src)
+    print(f"Cache prewarm: {len(corpus)} strings x {len(langs)} languages from {path}")
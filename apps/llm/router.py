@@ -0,0 +1,279 @@
+"""
+Routing between the LLM and the CTranslate2 MT service (apps/mt).
+
+An int8 Marian model translates a sentence for a small fraction of what the
+LLM costs, but with less control over tone and UI conventions. The router
+decides per item:
+
+- "llm":  queue it for llama.cpp (the default, and the only route in
+  `llm` mode);
+- "mt":   translate it with the MT service;
+- "both": answer with MT right away and queue an LLM translation at
+  background priority that replaces the cached MT result when it finishes.
+
+Inputs to the decision are the pairs the MT service reports in `/health`,
+the text length, the request priority, the LLM queue depth and the observed
+latencies of both routes (EWMA). When the estimated LLM wait exceeds its
+budget, work degrades to MT instead of piling up in the queue.
+
+Configuration:
+
+    LLM_ROUTER_MODE=llm            # llm | cost | mt
+    MT_ENDPOINT=http://127.0.0.1:8002
+    LLM_ROUTER_MAX_WAIT_SECONDS=2  # estimated LLM queue wait before degrading
+    LLM_ROUTER_MT_MIN_CHARS=240    # longer texts go to MT in cost mode
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Literal, TypeVar
+
+import httpx
+
+from scheduler import _PRIORITY_RANK, Priority, _PriorityWorkQueue
+from tracing import current_request_id, span
+
+T = TypeVar("T")
+
+Route = Literal["llm", "mt", "both"]
+
+
+def _base_lang(code: str) -> str:
+    return code.strip().lower().split("-")[0]
+
+
+# Exponentially weighted moving average of a route's latency.
+class _Ewma:
+    def __init__(self, alpha: float = 0.2, initial: float | None = None):
+        self._alpha = alpha
+        self.value = initial
+
+    def add(self, sample: float) -> None:
+        self.value = sample if self.value is None else self._alpha * sample + (1 - self._alpha) * self.value
+
+
+# Minimal client for the MT service (`/health` and `/translate`).
+class _MtClient:
+    def __init__(self, base_url: str, *, timeout: float = 10.0, max_connections: int = 8):
+        self.base_url = base_url.rstrip("/")
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(timeout, connect=1.0),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def pairs(self) -> set[tuple[str, str]]:
+        r = self._client.get("/health", timeout=2.0)
+        r.raise_for_status()
+        out = set()
+        for p in r.json().get("pairs", []):
+            src, _, tgt = p.partition("->")
+            if src and tgt:
+                out.add((_base_lang(src), _base_lang(tgt)))
+        return out
+
+    def translate(self, text: str, src: str, tgt: str) -> str:
+        request_id = current_request_id()
+        with span("mt", pair=f"{src}->{tgt}"):
+            r = self._client.post(
+                "/translate",
+                json={"text": text, "src_lang": src, "tgt_lang": tgt},
+                headers={"X-Request-Id": request_id} if request_id else None,
+            )
+        r.raise_for_status()
+        return r.json()["translation"]
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class _HybridRouter:
+    def __init__(
+        self,
+        *,
+        mode: str,
+        mt: _MtClient | None,
+        queue: _PriorityWorkQueue,
+        workers: int,
+        max_wait: float = 2.0,
+        mt_min_chars: int = 240,
+        mt_workers: int = 4,
+        pairs_refresh: float = 30.0,
+    ):
+        self.mode = mode if mode in ("llm", "cost", "mt") else "llm"
+        self._mt = mt
+        self._queue = queue
+        self._workers = max(1, workers)
+        self._max_wait = float(max_wait)
+        self._mt_min_chars = int(mt_min_chars)
+        self._pairs_refresh = float(pairs_refresh)
+        self._mt_pool = ThreadPoolExecutor(max_workers=max(1, mt_workers), thread_name_prefix="mt-route")
+
+        self._lock = threading.Lock()
+        self._pairs: set[tuple[str, str]] = set()
+        self._pairs_ts = float("-inf")
+        self._refreshing = False
+        self._mt_error: str | None = None
+        # Until samples arrive, assume a typical 8B call vs. a Marian call.
+        self._latency = {"llm": _Ewma(initial=1.0), "mt": _Ewma(initial=0.05)}
+        self._routes: dict[str, int] = {"llm": 0, "mt": 0, "both": 0}
+        self._reasons: dict[str, int] = {}
+        self._mt_failures = 0
+        self._refinements = 0
+        if self.enabled:
+            self._mt_pairs()
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != "llm" and self._mt is not None
+
+    # MT pairs are refreshed in the background so routing never waits on
+    # the MT service; until the first refresh every item goes to the LLM.
+    def _refresh_pairs(self) -> None:
+        try:
+            pairs, error = self._mt.pairs(), None  # type: ignore[union-attr]
+        except Exception as e:
+            pairs, error = set(), f"{type(e).__name__}: {e}"
+        with self._lock:
+            self._pairs = pairs
+            self._mt_error = error
+            self._pairs_ts = time.monotonic()
+            self._refreshing = False
+
+    def _mt_pairs(self) -> set[tuple[str, str]]:
+        with self._lock:
+            stale = time.monotonic() - self._pairs_ts >= self._pairs_refresh
+            if stale and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_pairs, name="mt-pairs", daemon=True).start()
+            return self._pairs
+
+    # Estimated time until a new item at `priority` starts on the LLM.
+    def _llm_wait(self, priority: Priority) -> float:
+        depth = self._queue.depth()
+        ahead = sum(n for p, n in depth.items() if _PRIORITY_RANK[p] <= _PRIORITY_RANK[priority])
+        return ahead / self._workers * (self._latency["llm"].value or 0.0)
+
+    def _decide(self, text: str, pair: tuple[str, str], priority: Priority) -> tuple[Route, str]:
+        if not self.enabled:
+            return "llm", "mode"
+        src, tgt = pair
+        if src == "auto" or (_base_lang(src), _base_lang(tgt)) not in self._mt_pairs():
+            return "llm", "no_mt_pair"
+        if self.mode == "mt":
+            return "mt", "mode"
+
+        if self._llm_wait(priority) > self._max_wait:
+            # Saturated: short strings still get the LLM's version later.
+            if len(text) < self._mt_min_chars and priority != "background":
+                return "both", "llm_saturated"
+            return "mt", "llm_saturated"
+        if priority == "background":
+            return "mt", "background"
+        if len(text) >= self._mt_min_chars:
+            return "mt", "long_text"
+        return "llm", "short_text"
+
+    # Picks a route and counts the decision.
+    def route(self, text: str, pair: tuple[str, str], priority: Priority) -> Route:
+        route, reason = self._decide(text, pair, priority)
+        with self._lock:
+            self._routes[route] += 1
+            self._reasons[reason] = self._reasons.get(reason, 0) + 1
+        return route
+
+    # Wraps `fn` so its duration feeds the latency estimate of `route`.
+    def timed(self, route: str, fn: Callable[[], T]) -> Callable[[], T]:
+        def run() -> T:
+            start = time.monotonic()
+            result = fn()
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._latency[route].add(elapsed)
+            return result
+
+        return run
+
+    # Translates with the MT service. If MT fails, `fallback()` is called
+    # and its Future's outcome is used instead. `on_mt` is only called with
+    # results that came from MT, not from the fallback.
+    def submit_mt(
+        self,
+        text: str,
+        src: str,
+        tgt: str,
+        fallback: Callable[[], Future[str]],
+        on_mt: Callable[[str], None] | None = None,
+    ) -> Future[str]:
+        out: Future[str] = Future()
+
+        def _chain(f: Future[str]) -> None:
+            try:
+                out.set_result(f.result())
+            except Exception as e:
+                out.set_exception(e)
+
+        def _on_mt(done: Future[str]) -> None:
+            try:
+                result = done.result()
+            except Exception as e:
+                with self._lock:
+                    self._mt_failures += 1
+                    self._mt_error = f"{type(e).__name__}: {e}"
+                fallback().add_done_callback(_chain)
+                return
+            out.set_result(result)
+            if on_mt is not None:
+                on_mt(result)
+
+        call = self.timed("mt", lambda: self._mt.translate(text, src, tgt))  # type: ignore[union-attr]
+        # The request's context (and trace) goes along to the MT thread.
+        self._mt_pool.submit(contextvars.copy_context().run, call).add_done_callback(_on_mt)
+        return out
+
+    def count_refinement(self) -> None:
+        with self._lock:
+            self._refinements += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "mt_endpoint": self._mt.base_url if self._mt is not None else None,
+                "mt_pairs": sorted(f"{s}->{t}" for s, t in self._pairs),
+                "mt_error": self._mt_error,
+                "routes": dict(self._routes),
+                "reasons": dict(self._reasons),
+                "mt_failures": self._mt_failures,
+                "refinements": self._refinements,
+                "latency_ms": {
+                    name: None if e.value is None else round(e.value * 1000, 1)
+                    for name, e in self._latency.items()
+                },
+            }
+
+    def close(self) -> None:
+        self._mt_pool.shutdown(wait=False)
+        if self._mt is not None:
+            self._mt.close()
+
+
+def router_from_env(queue: _PriorityWorkQueue, *, workers: int) -> _HybridRouter:
+    mode = os.environ.get("LLM_ROUTER_MODE", "llm").strip().lower() or "llm"
+    mt = None
+    if mode != "llm":
+        mt = _MtClient(
+            os.environ.get("MT_ENDPOINT", "http://127.0.0.1:8002"),
+            timeout=float(os.environ.get("MT_TIMEOUT_SECONDS", "10") or 10),
+        )
+    return _HybridRouter(
+        mode=mode,
+        mt=mt,
+        queue=queue,
+        workers=workers,
+        max_wait=float(os.environ.get("LLM_ROUTER_MAX_WAIT_SECONDS", "2") or 0),
+        mt_min_chars=int(os.environ.get("LLM_ROUTER_MT_MIN_CHARS", "240") or 0),
+        mt_workers=int(os.environ.get("LLM_ROUTER_MT_WORKERS", "4") or 1),
+    )
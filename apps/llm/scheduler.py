@@ -0,0 +1,494 @@
+"""
+Priority scheduler that serializes access to the LLM.
+
+Work items are kept in one heap per priority class. Within a class, items
+are ordered by weighted fair queuing over clients (a browser tab, a chat
+session, a bulk job): every item carries an estimated cost in llama.cpp
+tokens, and each client's items are stamped with virtual finish times
+advancing by `cost / weight`, so a client flooding a class only delays its
+own items while everyone else keeps their share of the model. A single
+client's items stay FIFO. On top of that the scheduler supports:
+
+- aging: the longer an item waits, the higher its effective priority, so
+  background work cannot starve behind a steady stream of critical strings;
+- deadlines: items whose deadline has passed are dropped instead of executed;
+- preemption: background items run with an abort flag. When critical work
+  arrives and every worker is busy, a running background item is aborted
+  (its llama.cpp stream is closed) and re-queued at its original position;
+- admission control: each class has a capacity. When a class is full,
+  background items that have waited longer than `shed_after` are dropped
+  first; if the class is still full and another client holds more of it,
+  that client's newest item is pushed out, otherwise the new item is
+  rejected. Both get `QueueFull`, carrying an estimate of when to retry;
+- cancellation: queued items nobody waits for any more can be withdrawn.
+"""
+import heapq
+import math
+import threading
+import time
+from concurrent.futures import CancelledError, Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Literal, TypeVar
+
+from tracing import activate, add_span, current_trace
+from metrics import QUEUE_CANCELLED, QUEUE_EXPIRED, QUEUE_PREEMPTED, QUEUE_REJECTED, QUEUE_SHED, QUEUE_WAIT
+
+T = TypeVar("T")
+
+Priority = Literal["critical", "normal", "background"]
+_PRIORITY_RANK: dict[Priority, int] = {
+    "critical": 0,
+    "normal": 1,
+    "background": 2,
+}
+_BACKGROUND_RANK = _PRIORITY_RANK["background"]
+_RANK_NAMES = {rank: p for p, rank in _PRIORITY_RANK.items()}
+
+
+# Raised inside a running item when the scheduler asks it to yield the
+# worker. The item is re-queued; callers never see this exception.
+class Preempted(Exception):
+    pass
+
+
+# Set on the Future of an item that was dropped because its deadline passed
+# before a worker could start it.
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+# Set on the Future of an item rejected because its class is at capacity.
+# `retry_after` is the estimated number of seconds until there is room.
+class QueueFull(Exception):
+    def __init__(self, priority: str, retry_after: int):
+        super().__init__(f"{priority} queue is full")
+        self.retry_after = retry_after
+
+
+# Set on the Future of a stale background item dropped under overload.
+# A kind of DeadlineExceeded: the work was not started in useful time.
+class Shed(DeadlineExceeded):
+    def __init__(self, retry_after: int):
+        super().__init__("shed under load")
+        self.retry_after = retry_after
+
+
+_local = threading.local()
+
+
+# Abort flag of the item running on the current worker thread, or None when
+# the item is not preemptible. Long-running calls poll it and raise
+# `Preempted` once it is set.
+def current_abort_event() -> threading.Event | None:
+    return getattr(_local, "abort", None)
+
+
+# Internal work item used by the priority queue.
+# Each item wraps a callable that performs a translation (or a packed group
+# of translations) and a Future used to return the result asynchronously.
+@dataclass
+class _QueuedWorkItem:
+    priority: int
+    seq: int
+    future: Future[Any]
+    fn: Callable[[], Any]
+    enqueued_at: float = field(default_factory=time.monotonic)
+    deadline: float | None = None
+    # Set when the item has been re-queued at a higher priority; the stale
+    # heap entry is then skipped by the workers.
+    superseded: bool = False
+    started: bool = False
+    preemptions: int = 0
+    abort: threading.Event = field(default_factory=threading.Event)
+    # Fair queuing: owning client, estimated tokens, and virtual start and
+    # finish times within the item's class.
+    client: str = ""
+    cost: float = 1.0
+    start_tag: float = 0.0
+    tag: float = 0.0
+    # False for work that cannot be restarted (chat streams).
+    preemptible: bool = True
+    # Trace of the request that queued the item (tracing.py), if any.
+    trace: Any = None
+
+
+# Priority-based work queue used to serialize access to the LLM.
+# Higher-priority UI strings (e.g. headings) are processed before
+# background content to improve perceived responsiveness.
+class _PriorityWorkQueue:
+    def __init__(
+        self,
+        *,
+        workers: int = 1,
+        aging_seconds: float = 30.0,
+        preempt: bool = True,
+        max_preemptions: int = 3,
+        capacity: dict[Priority, int] | None = None,
+        shed_after: float = 20.0,
+        weights: dict[str, float] | None = None,
+    ):
+        self._seq = 0
+        self._aging_seconds = float(aging_seconds)
+        self._preempt = preempt
+        self._max_preemptions = max(0, int(max_preemptions))
+        self._cond = threading.Condition()
+        self._heaps: list[list[tuple[float, int, _QueuedWorkItem]]] = [[] for _ in _PRIORITY_RANK]
+        # Items that are queued but not yet picked up, by future, and their
+        # number per class.
+        self._pending: dict[Future[Any], _QueuedWorkItem] = {}
+        self._counts = [0 for _ in _PRIORITY_RANK]
+        self._flows: list[dict[str, int]] = [{} for _ in _PRIORITY_RANK]
+        # Virtual time of each class (start tag of the last dispatched item)
+        # and the last finish tag of each client in it.
+        self._vtime = [0.0 for _ in _PRIORITY_RANK]
+        self._finish: list[dict[str, float]] = [{} for _ in _PRIORITY_RANK]
+        self._weights = {k: w for k, w in (weights or {}).items() if w > 0}
+        # Max queued items per class; 0 means unbounded.
+        self._capacity = [max(0, int((capacity or {}).get(p, 0))) for p in _PRIORITY_RANK]
+        self._shed_after = float(shed_after)
+        # Average run time of an item, for Retry-After estimates.
+        self._avg_run = 1.0
+        self._running: dict[int, _QueuedWorkItem] = {}
+        self._stop = threading.Event()
+
+        self._threads: list[threading.Thread] = []
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._worker_loop, name=f"llm-queue-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    # `deadline` is an absolute time.monotonic() value. `client` identifies
+    # the flow the item is accounted to, `cost` is its estimated size in
+    # tokens.
+    def submit(
+        self,
+        *,
+        priority: Priority,
+        fn: Callable[[], T],
+        deadline: float | None = None,
+        client: str = "",
+        cost: float = 1.0,
+        preemptible: bool = True,
+    ) -> Future[T]:
+        fut: Future[T] = Future()
+        if deadline is not None and deadline <= time.monotonic():
+            fut.set_exception(DeadlineExceeded("deadline passed before queueing"))
+            return fut
+
+        rank = _PRIORITY_RANK[priority]
+        shed: list[_QueuedWorkItem] = []
+        pushed_out: _QueuedWorkItem | None = None
+        rejected: QueueFull | None = None
+        with self._cond:
+            if self._full_locked(rank):
+                shed = self._shed_locked()
+            if self._full_locked(rank):
+                pushed_out = self._push_out_locked(rank, client)
+            if self._full_locked(rank):
+                rejected = QueueFull(priority, self._retry_after_locked(rank))
+            else:
+                self._seq += 1
+                item = _QueuedWorkItem(
+                    rank,
+                    self._seq,
+                    fut,
+                    fn,
+                    deadline=deadline,
+                    client=client,
+                    cost=max(1.0, float(cost)),
+                    preemptible=preemptible,
+                    trace=current_trace(),
+                )
+                self._stamp_locked(item)
+                self._add_pending_locked(item)
+                if item.priority == 0:
+                    self._maybe_preempt_locked()
+                self._cond.notify()
+            retry_after = self._retry_after_locked(_BACKGROUND_RANK) if shed else 0
+            if pushed_out is not None:
+                full = QueueFull(priority, self._retry_after_locked(rank))
+
+        if pushed_out is not None:
+            QUEUE_REJECTED.labels(priority).inc()
+            if pushed_out.future.set_running_or_notify_cancel():
+                pushed_out.future.set_exception(full)
+        for dropped in shed:
+            if dropped.future.set_running_or_notify_cancel():
+                dropped.future.set_exception(Shed(retry_after))
+        if shed:
+            QUEUE_SHED.inc(len(shed))
+        if rejected is not None:
+            QUEUE_REJECTED.labels(priority).inc()
+            fut.set_exception(rejected)
+        return fut
+
+    # Withdraws a still-queued item and cancels its Future. Returns False if
+    # the item is running, finished or unknown.
+    def cancel(self, fut: Future[Any]) -> bool:
+        with self._cond:
+            item = self._pending.get(fut)
+            if item is None:
+                return False
+            self._drop_pending_locked(item)
+            item.superseded = True
+        QUEUE_CANCELLED.labels(_RANK_NAMES[item.priority]).inc()
+        # An item preempted after it started is already "running".
+        if not fut.cancel():
+            fut.set_exception(CancelledError())
+        return True
+
+    def queued(self, fut: Future[Any]) -> bool:
+        with self._cond:
+            return fut in self._pending
+
+    def _add_pending_locked(self, item: _QueuedWorkItem) -> None:
+        self._pending[item.future] = item
+        self._counts[item.priority] += 1
+        flows = self._flows[item.priority]
+        flows[item.client] = flows.get(item.client, 0) + 1
+        heapq.heappush(self._heaps[item.priority], (item.tag, item.seq, item))
+
+    def _drop_pending_locked(self, item: _QueuedWorkItem) -> None:
+        if self._pending.get(item.future) is item:
+            del self._pending[item.future]
+            self._counts[item.priority] -= 1
+            flows = self._flows[item.priority]
+            flows[item.client] -= 1
+            if not flows[item.client]:
+                del flows[item.client]
+
+    # Weight of a client: its own, else that of its kind (the part before
+    # ":", e.g. "chat" or "job"), else 1.
+    def _weight(self, client: str) -> float:
+        w = self._weights.get(client)
+        if w is None:
+            w = self._weights.get(client.split(":", 1)[0], 1.0)
+        return w
+
+    # Assigns the item's fair-queuing tags in its class. A client that has
+    # been idle starts at the class's virtual time, so it cannot bank credit.
+    def _stamp_locked(self, item: _QueuedWorkItem) -> None:
+        rank = item.priority
+        finish = self._finish[rank]
+        item.start_tag = max(self._vtime[rank], finish.get(item.client, 0.0))
+        item.tag = item.start_tag + item.cost / self._weight(item.client)
+        finish[item.client] = item.tag
+        if len(finish) > 4096:
+            # Clients whose last finish tag is behind the virtual time are
+            # indistinguishable from new ones.
+            vtime = self._vtime[rank]
+            for client in [c for c, t in finish.items() if t <= vtime]:
+                del finish[client]
+
+    # Corrects a client's account once the real cost of an item is known
+    # (`tokens` is the difference to the estimate and may be negative).
+    def charge(self, priority: Priority, client: str, tokens: float) -> None:
+        rank = _PRIORITY_RANK[priority]
+        with self._cond:
+            finish = self._finish[rank]
+            vtime = self._vtime[rank]
+            finish[client] = max(vtime, finish.get(client, vtime) + tokens / self._weight(client))
+
+    # Makes room in a full class for `client` by removing the newest item of
+    # the client holding the most of it, if that is someone else holding
+    # more. The caller fails the returned item's Future.
+    def _push_out_locked(self, rank: int, client: str) -> _QueuedWorkItem | None:
+        flows = self._flows[rank]
+        if not flows:
+            return None
+        heaviest = max(flows, key=flows.__getitem__)
+        if heaviest == client or flows[heaviest] <= flows.get(client, 0) + 1:
+            return None
+        candidates = [
+            item
+            for item in self._pending.values()
+            if item.priority == rank and item.client == heaviest and not item.started
+        ]
+        if not candidates:
+            return None
+        victim = max(candidates, key=lambda it: (it.tag, it.seq))
+        self._drop_pending_locked(victim)
+        victim.superseded = True
+        return victim
+
+    def _full_locked(self, rank: int) -> bool:
+        cap = self._capacity[rank]
+        return cap > 0 and self._counts[rank] >= cap
+
+    # Removes background items that have waited longer than `shed_after`.
+    # Their Futures are failed by the caller, outside the lock.
+    def _shed_locked(self) -> list[_QueuedWorkItem]:
+        if self._shed_after <= 0:
+            return []
+        cutoff = time.monotonic() - self._shed_after
+        stale = [
+            item
+            for item in self._pending.values()
+            if item.priority == _BACKGROUND_RANK and not item.started and item.enqueued_at <= cutoff
+        ]
+        for item in stale:
+            self._drop_pending_locked(item)
+            item.superseded = True
+        return stale
+
+    # Seconds until an item of class `rank` would likely start: the queued
+    # items ahead of it spread over the workers.
+    def _retry_after_locked(self, rank: int) -> int:
+        ahead = sum(self._counts[: rank + 1])
+        estimate = ahead / len(self._threads) * self._avg_run
+        return max(1, min(60, math.ceil(estimate)))
+
+    # Moves a still-queued item up to `priority` (never down) and relaxes its
+    # deadline for a new waiter (None means the new waiter has no deadline).
+    # The item is stamped again in the new class, on its client's account.
+    def promote(self, fut: Future[Any], priority: Priority, *, deadline: float | None = None) -> bool:
+        rank = _PRIORITY_RANK[priority]
+        with self._cond:
+            item = self._pending.get(fut)
+            if item is None:
+                return False
+            if item.deadline is not None:
+                item.deadline = None if deadline is None else max(item.deadline, deadline)
+            if rank >= item.priority:
+                return False
+            item.superseded = True
+            moved = _QueuedWorkItem(
+                rank,
+                item.seq,
+                item.future,
+                item.fn,
+                enqueued_at=item.enqueued_at,
+                deadline=item.deadline,
+                started=item.started,
+                preemptions=item.preemptions,
+                client=item.client,
+                cost=item.cost,
+                preemptible=item.preemptible,
+                trace=item.trace,
+            )
+            self._stamp_locked(moved)
+            self._drop_pending_locked(item)
+            self._add_pending_locked(moved)
+            if rank == 0:
+                self._maybe_preempt_locked()
+            self._cond.notify()
+        return True
+
+    # Number of queued (not running) items per priority.
+    def depth(self) -> dict[Priority, int]:
+        with self._cond:
+            return {_RANK_NAMES[rank]: n for rank, n in enumerate(self._counts)}
+
+    # Queued items per client in each class, largest flows first.
+    def flows(self, limit: int = 20) -> dict[Priority, dict[str, int]]:
+        with self._cond:
+            return {
+                _RANK_NAMES[rank]: dict(sorted(flows.items(), key=lambda kv: -kv[1])[:limit])
+                for rank, flows in enumerate(self._flows)
+            }
+
+    # Effective rank after aging: one class up per `aging_seconds` waited.
+    def _effective_rank(self, item: _QueuedWorkItem, now: float) -> int:
+        if self._aging_seconds <= 0:
+            return item.priority
+        return max(0, item.priority - int((now - item.enqueued_at) / self._aging_seconds))
+
+    # Pops the next item to run. Expired items are removed and returned
+    # separately so their futures can be failed outside the lock.
+    def _pop_locked(self, expired: list[_QueuedWorkItem]) -> _QueuedWorkItem | None:
+        now = time.monotonic()
+        while True:
+            best: tuple[int, int, int] | None = None
+            for rank, heap in enumerate(self._heaps):
+                while heap and (heap[0][2].superseded or heap[0][2].future.done()):
+                    stale = heapq.heappop(heap)[2]
+                    if not stale.superseded:
+                        self._drop_pending_locked(stale)
+                if not heap:
+                    continue
+                head = heap[0][2]
+                candidate = (self._effective_rank(head, now), head.seq, rank)
+                if best is None or candidate < best:
+                    best = candidate
+            if best is None:
+                return None
+
+            item = heapq.heappop(self._heaps[best[2]])[2]
+            self._drop_pending_locked(item)
+            self._vtime[item.priority] = max(self._vtime[item.priority], item.start_tag)
+            if item.deadline is not None and item.deadline <= now:
+                expired.append(item)
+                continue
+            return item
+
+    # Asks one running background item to yield if no worker is idle.
+    # The most recently started one is chosen, as it has done the least work.
+    def _maybe_preempt_locked(self) -> None:
+        if not self._preempt or len(self._running) < len(self._threads):
+            return
+        victims = [
+            item
+            for item in self._running.values()
+            if item.priority == _BACKGROUND_RANK
+            and item.preemptible
+            and item.preemptions < self._max_preemptions
+            and not item.abort.is_set()
+        ]
+        if victims:
+            victims.sort(key=lambda it: it.seq)
+            victims[-1].abort.set()
+
+    def _requeue_locked(self, item: _QueuedWorkItem) -> None:
+        item.preemptions += 1
+        item.abort = threading.Event()
+        self._add_pending_locked(item)
+        self._cond.notify()
+
+    def _worker_loop(self) -> None:
+        ident = threading.get_ident()
+        while not self._stop.is_set():
+            expired: list[_QueuedWorkItem] = []
+            with self._cond:
+                item = self._pop_locked(expired)
+                if item is None and not expired:
+                    self._cond.wait(timeout=0.25)
+                    continue
+                if item is not None:
+                    self._running[ident] = item
+
+            for dropped in expired:
+                if dropped.started or dropped.future.set_running_or_notify_cancel():
+                    QUEUE_EXPIRED.labels(_RANK_NAMES[dropped.priority]).inc()
+                    dropped.future.set_exception(DeadlineExceeded("deadline passed while queued"))
+            if item is None:
+                continue
+
+            try:
+                if not item.started:
+                    if not item.future.set_running_or_notify_cancel():
+                        continue
+                    item.started = True
+                    waited = time.monotonic() - item.enqueued_at
+                    QUEUE_WAIT.labels(_RANK_NAMES[item.priority]).observe(waited)
+                    add_span("queue_wait", item.enqueued_at, waited, trace=item.trace, priority=_RANK_NAMES[item.priority])
+
+                preemptible = self._preempt and item.priority == _BACKGROUND_RANK and item.preemptible
+                _local.abort = item.abort if preemptible else None
+                started_at = time.monotonic()
+                try:
+                    with activate(item.trace):
+                        result = item.fn()
+                except Preempted:
+                    QUEUE_PREEMPTED.inc()
+                    with self._cond:
+                        self._requeue_locked(item)
+                    continue
+                except Exception as e:
+                    item.future.set_exception(e)
+                else:
+                    self._avg_run = 0.8 * self._avg_run + 0.2 * (time.monotonic() - started_at)
+                    item.future.set_result(result)
+            finally:
+                _local.abort = None
+                with self._cond:
+                    self._running.pop(ident, None)
@@ -0,0 +1,51 @@
+"""
+Test setup for apps/llm: the service modules are imported flat, as uvicorn
+does when started from apps/llm. No llama-server is needed; tests replace
+the calls they exercise.
+"""
+import os
+import sys
+from concurrent.futures import Future
+from pathlib import Path
+
+import pytest
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+# Read at import time by server.py and its siblings: nothing listens on
+# port 9, the MT router stays off and health probes do not run.
+os.environ.setdefault("LLAMA_BACKENDS", "http://127.0.0.1:9")
+os.environ.setdefault("LLAMA_HEALTH_INTERVAL_SECONDS", "0")
+os.environ.setdefault("LLM_ROUTER_MODE", "llm")
+os.environ.setdefault("TRACING", "0")
+
+sys.path.insert(0, str(APP_DIR))
+# tracing.py, as main.py sets it up (tests import server.py directly).
+sys.path.insert(0, str(APP_DIR.parent / "common"))
+
+
+# Runs the "LLM" inline, on a fresh cache without translation memory and
+# with language detection on, and records the (text, src, tgt) it was asked to translate.
+@pytest.fixture
+def llm(monkeypatch):
+    import server
+    from langid import _LanguageIdentifier
+    from memory_cache import _TranslationCache
+
+    calls = []
+
+    def translate(text, src, tgt):
+        calls.append((text, src, tgt))
+        return f"T({text})"
+
+    def submit(priority, fn, **kwargs):
+        fut = Future()
+        fut.set_result(fn())
+        return fut
+
+    monkeypatch.setattr(server, "_LANGID", _LanguageIdentifier())
+    monkeypatch.setattr(server, "_TRANSLATION_CACHE", _TranslationCache(max_bytes=1 << 20, ttl_seconds=60))
+    monkeypatch.setattr(server, "_MEMORY", None)
+    monkeypatch.setattr(server, "_translate_with_llm_direct", translate)
+    monkeypatch.setattr(server._TRANSLATION_QUEUE, "submit", submit)
+    return calls
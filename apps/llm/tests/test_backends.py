@@ -0,0 +1,27 @@
+import pytest
+
+from backends import _Backend, _BackendPool, _parse_pins
+from llama_client import _LlamaClient
+
+
+def test_parse_pins():
+    assert _parse_pins(" en->it = gpu0 , *->DE=http://10.0.0.5:7001/ ") == {
+        ("en", "it"): "gpu0",
+        ("*", "de"): "http://10.0.0.5:7001",
+    }
+
+
+@pytest.mark.parametrize("entry", ["en-it=gpu0", "en->=gpu0", "->it=gpu0", "en->it=", "en->it"])
+def test_malformed_pins_are_skipped(capsys, entry):
+    assert _parse_pins(f"{entry},fr->de=gpu1") == {("fr", "de"): "gpu1"}
+    assert "WARNING: ignoring backend pin" in capsys.readouterr().out
+
+
+def test_pins_match_the_primary_subtag():
+    assert _parse_pins("en-US->it=gpu0") == {("en", "it"): "gpu0"}
+    backends = [_Backend(name, _LlamaClient(f"http://{name}.invalid"), limit=1) for name in ("gpu0", "gpu1")]
+    pool = _BackendPool(backends, pins=_parse_pins("en->it=gpu1"), health_interval=0)
+
+    assert pool._pinned(("en-US", "it-CH")) is backends[1]
+    assert pool._pinned(("EN", "it")) is backends[1]
+    assert pool._pinned(("fr", "it")) is None
@@ -0,0 +1,149 @@
+import json
+import re
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import server
+from memory_cache import _TranslationCache
+
+CONTENT_HASH_TS = Path(__file__).resolve().parents[2] / "web" / "src" / "auto-translator" / "contentHash.ts"
+
+# Strings whose hashes must agree between content_hash() and the web
+# client's contentHash(), including the edge whitespace where Python's
+# str.strip() and JavaScript's trim() differ.
+PARITY_TEXTS = [
+    "Save changes",
+    "",
+    "  Save changes\n",
+    "Salva — le modifiche",
+    "range 1–2, minus −3, bar ―",
+    "line one\r\nline two\rline three",
+    "﻿Save changes",
+    "\x1cSave changes\x1f",
+    "\x85Save changes\x85",
+    "\xa0　Save changes  ",
+    "emoji 🙂 and 汉字",
+]
+
+
+@pytest.fixture
+def cache():
+    return _TranslationCache(max_bytes=1 << 20, ttl_seconds=60)
+
+
+def _digest(text: str) -> str:
+    return server.content_hash(text)
+
+
+def test_get_by_hash_requires_the_cached_source_language(cache):
+    cache.set(("de", "en", "Gift"), "Poison")
+
+    assert cache.get_by_hash("de", "en", _digest("Gift")) == "Poison"
+    assert cache.get_by_hash("sv", "en", _digest("Gift")) is None
+    assert cache.get_by_hash("de", "fr", _digest("Gift")) is None
+
+
+def test_same_text_under_two_sources_keeps_both_translations(cache):
+    cache.set(("de", "en", "Gift"), "Poison")
+    cache.set(("en", "it", "Gift"), "Regalo")
+    cache.set(("sv", "en", "Gift"), "Married")
+
+    assert cache.get_by_hash("de", "en", _digest("Gift")) == "Poison"
+    assert cache.get_by_hash("sv", "en", _digest("Gift")) == "Married"
+    assert cache.get_by_hash("en", "it", _digest("Gift")) == "Regalo"
+
+
+def test_auto_only_matches_auto_entries(cache):
+    cache.set(("de", "en", "Gift"), "Poison")
+    assert cache.get_by_hash("auto", "en", _digest("Gift")) is None
+
+    cache.set(("auto", "en", "Gift"), "Gift")
+    assert cache.get_by_hash("auto", "en", _digest("Gift")) == "Gift"
+    assert cache.get_by_hash("de", "en", _digest("Gift")) == "Poison"
+
+
+def test_auto_resolves_the_source_language_like_a_request(cache):
+    cache.set(("de", "en", "Gift"), "Poison")
+    cache.set(("sv", "en", "Gift"), "Married")
+
+    assert cache.get_by_hash("auto", "en", _digest("Gift"), detect=lambda text: "sv") == "Married"
+    assert cache.get_by_hash("auto", "en", _digest("Gift"), detect=lambda text: None) is None
+    cache.set(("auto", "en", "Gift"), "Gift")
+    assert cache.get_by_hash("auto", "en", _digest("Gift"), detect=lambda text: None) == "Gift"
+    assert cache.get_by_hash("de", "en", _digest("Gift"), detect=lambda text: "sv") == "Poison"
+
+
+def test_eviction_removes_only_its_own_index_entry(cache):
+    cache.set(("de", "en", "Gift"), "Poison")
+    cache.set(("sv", "en", "Gift"), "Married")
+    cache._unindex(("de", "en", "Gift"), _digest("Gift"))
+
+    assert cache.get_by_hash("de", "en", _digest("Gift")) is None
+    assert cache.get_by_hash("sv", "en", _digest("Gift")) == "Married"
+
+
+def test_lookup_translations_splits_hits_and_misses(monkeypatch, cache):
+    monkeypatch.setattr(server, "_TRANSLATION_CACHE", cache)
+    cache.set(("de", "en", "Gift"), "Poison")
+    hit, miss = _digest("  Gift\n"), _digest("Haus")
+
+    found, missing = server.lookup_translations(" DE ", "en", [hit.upper(), miss, hit])
+
+    assert found == {hit: "Poison"}
+    assert missing == [miss]
+    found, missing = server.lookup_translations(None, "en", [hit])
+    assert found == {} and missing == [hit]
+
+
+# The web client always looks up with "auto", while /translate stores
+# confidently detected strings under their language.
+def test_auto_lookup_finds_what_auto_requests_stored(llm):
+    detected = "Nous vous avons envoyé un lien pour réinitialiser le mot de passe"
+    uncertain = "Download options"
+    for text in (detected, uncertain):
+        assert server.submit_translation_with_llm(text, "auto", "it").result(timeout=5) == f"T({text})"
+    assert server._TRANSLATION_CACHE.get(("fr", "it", detected)) == f"T({detected})"
+    hashes = [_digest(detected), _digest(uncertain), _digest("Never translated")]
+
+    found, missing = server.lookup_translations("auto", "it", hashes)
+
+    assert found == {hashes[0]: f"T({detected})", hashes[1]: f"T({uncertain})"}
+    assert missing == [hashes[2]]
+    found, missing = server.lookup_translations("fr", "it", hashes[:2])
+    assert found == {hashes[0]: f"T({detected})"}
+
+
+def test_normalization_trims_like_javascript():
+    assert server._normalize_for_cache("﻿ Save 　") == "Save"
+    assert server._normalize_for_cache("\x1cSave\x85") == "\x1cSave\x85"
+    assert server._normalize_for_cache("a\r\nb\rc — d") == "a\nb\nc  -  d"
+
+
+# Runs contentHash() from the web client under node. The file only uses
+# `: string` parameter annotations, so stripping those makes it plain ES.
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_content_hash_matches_web_client(tmp_path):
+    source = re.sub(r":\s*string\b", "", CONTENT_HASH_TS.read_text(encoding="utf-8"))
+    module = tmp_path / "contentHash.mjs"
+    module.write_text(source, encoding="utf-8")
+    script = (
+        f"import {{ contentHash }} from {json.dumps(module.as_uri())};\n"
+        "let input = '';\n"
+        "process.stdin.on('data', (d) => (input += d));\n"
+        "process.stdin.on('end', () => {\n"
+        "  process.stdout.write(JSON.stringify(JSON.parse(input).map(contentHash)));\n"
+        "});\n"
+    )
+    out = subprocess.run(
+        ["node", "--input-type=module", "-e", script],
+        input=json.dumps(PARITY_TEXTS),
+        capture_output=True,
+        text=True,
+        timeout=30,
+        check=True,
+    )
+
+    assert json.loads(out.stdout) == [server.content_hash(t) for t in PARITY_TEXTS]
@@ -0,0 +1,166 @@
+import asyncio
+import itertools
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+import main
+import server
+from scheduler import _PriorityWorkQueue
+
+_texts = itertools.count()
+
+
+# A fresh string per call, so neither the cache, the translation memory
+# (which templates digits out) nor the in-flight registry of an earlier
+# test interferes.
+def _text(prefix: str = "Open the settings page") -> str:
+    n = next(_texts)
+    suffix = ""
+    while True:
+        n, digit = divmod(n, 26)
+        suffix += chr(ord("a") + digit)
+        if not n:
+            return f"{prefix} {suffix}"
+
+
+# Runs translations on a private one-worker queue whose worker is kept busy
+# until `release` is set, so submitted items stay queued.
+@pytest.fixture
+def queue(monkeypatch):
+    q = _PriorityWorkQueue(workers=1)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        assert release.wait(5)
+
+    q.submit(priority="critical", fn=block)
+    assert started.wait(5)
+    monkeypatch.setattr(server, "_TRANSLATION_QUEUE", q)
+    monkeypatch.setattr(server, "_translate_with_llm_direct", lambda text, src, tgt: f"T({text})")
+    monkeypatch.setattr(server, "_translate_packed_direct", lambda texts, src, tgt: [f"P({t})" for t in texts])
+    yield q, release
+    release.set()
+    q._stop.set()
+
+
+def _submit(text, *, hold):
+    return server.submit_translation_with_llm(text, "en", "it", hold=hold, client="test")
+
+
+def test_last_waiter_leaving_withdraws_queued_work(queue):
+    q, release = queue
+    fut = _submit(_text(), hold=True)
+    assert q.queued(fut)
+    server.release_translations([fut])
+    assert fut.cancelled()
+    assert not q.queued(fut)
+
+
+def test_work_stays_queued_while_another_request_waits(queue):
+    q, release = queue
+    text = _text()
+    first = _submit(text, hold=True)
+    second = _submit(text, hold=True)
+    assert second is first
+    server.release_translations([first])
+    assert q.queued(first)
+    server.release_translations([second])
+    assert first.cancelled()
+
+
+def test_job_joining_a_held_item_keeps_it_alive(queue):
+    q, release = queue
+    text = _text()
+    browser = _submit(text, hold=True)
+    job = _submit(text, hold=False)
+    assert job is browser
+    server.release_translations([browser])
+    assert q.queued(browser)
+    release.set()
+    assert job.result(timeout=5) == f"T({text})"
+
+
+def test_request_leaving_an_item_a_job_queued_does_not_cancel_it(queue):
+    q, release = queue
+    text = _text()
+    job = _submit(text, hold=False)
+    browser = _submit(text, hold=True)
+    server.release_translations([browser])
+    assert q.queued(job)
+    release.set()
+    assert job.result(timeout=5) == f"T({text})"
+
+
+def test_release_without_cancel_keeps_work(queue):
+    q, release = queue
+    fut = _submit(_text(), hold=True)
+    server.release_translations([fut], cancel=False)
+    assert q.queued(fut)
+
+
+def test_withdrawn_work_is_not_joined_again(queue):
+    q, release = queue
+    text = _text()
+    first = _submit(text, hold=True)
+    server.release_translations([first])
+    again = _submit(text, hold=True)
+    assert again is not first
+    assert q.queued(again)
+    release.set()
+    assert again.result(timeout=5) == f"T({text})"
+
+
+def test_packed_group_is_withdrawn_when_its_batch_leaves(queue):
+    q, release = queue
+    items = [(_text("Save"), "en", "it", "normal", None) for _ in range(3)]
+    futures = server.submit_translation_batch_with_llm(items, hold=True, client="test")
+    assert len({server._HANDLE_OF[f] for f in futures}) == 1
+    server.release_translations(futures)
+    for f in futures:
+        with pytest.raises(CancelledError):
+            f.result(timeout=1)
+
+
+def test_packed_group_survives_when_a_job_shares_one_segment(queue):
+    q, release = queue
+    items = [(_text("Save"), "en", "it", "normal", None) for _ in range(3)]
+    futures = server.submit_translation_batch_with_llm(items, hold=True, client="test")
+    job = server.submit_translation_batch_with_llm([items[1]], hold=False, client="job:1")[0]
+    assert job is futures[1]
+    server.release_translations(futures)
+    release.set()
+    assert job.result(timeout=5) == f"P({items[1][0]})"
+
+
+def test_await_or_none_maps_withdrawn_work_to_none(queue):
+    q, release = queue
+    fut = _submit(_text(), hold=True)
+
+    async def wait_then_withdraw():
+        waiter = asyncio.ensure_future(main._await_or_none(fut))
+        await asyncio.sleep(0.01)
+        server.release_translations([fut])
+        return await waiter
+
+    assert asyncio.run(wait_then_withdraw()) is None
+    assert main._done_result(fut) is None
+
+
+def test_await_or_none_propagates_its_own_cancellation(queue):
+    q, release = queue
+    fut = _submit(_text(), hold=True)
+
+    async def cancel_waiter():
+        waiter = asyncio.ensure_future(main._await_or_none(fut))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await waiter
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(cancel_waiter())
+    assert q.queued(fut)
+    server.release_translations([fut])
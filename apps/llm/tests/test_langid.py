@@ -0,0 +1,86 @@
+import pytest
+
+import server
+from langid import _LanguageIdentifier
+
+# Short English UI strings full of Latinate or Italian-looking words.
+ENGLISH_UI = [
+    "Translation options",
+    "Transaction details",
+    "Reservation confirmation",
+    "Restaurant reservations",
+    "Connection status: online",
+    "Pizza and pasta menu",
+    "Notification preferences",
+    "Installation complete",
+    "Collection details",
+    "General conditions",
+    "Portable version",
+    "Configuration error",
+    "Presentation mode",
+    "Promotion code",
+    "Pizza delivery",
+]
+
+
+@pytest.fixture(scope="module")
+def identifier():
+    return _LanguageIdentifier()
+
+
+@pytest.mark.parametrize("text", ENGLISH_UI)
+def test_english_ui_strings_are_not_taken_for_french_or_italian(identifier, text):
+    assert identifier.detect(text) in (None, "en")
+
+
+@pytest.mark.parametrize(
+    "lang, text",
+    [
+        ("en", "We sent you an email with a link to reset your password"),
+        ("fr", "Nous vous avons envoyé un e-mail avec un lien pour réinitialiser votre mot de passe"),
+        ("it", "Ti abbiamo inviato una email con un link per reimpostare la password"),
+        ("de", "Wir haben Ihnen eine E-Mail mit einem Link zum Zurücksetzen geschickt"),
+        ("es", "Te hemos enviado un correo con un enlace para restablecer tu contraseña"),
+        ("pt", "Enviamos um e-mail com um link para redefinir sua senha"),
+        ("nl", "We hebben je een e-mail gestuurd met een link om je wachtwoord te herstellen"),
+        ("ko", "설정을 저장했습니다"),
+        ("el", "Οι αλλαγές αποθηκεύτηκαν"),
+    ],
+)
+def test_sentences_are_detected(identifier, lang, text):
+    assert identifier.detect(text) == lang
+
+
+def test_short_strings_need_more_confidence(identifier):
+    lenient = _LanguageIdentifier(short_min_confidence=0.99, min_margin=0.0)
+    assert lenient.detect("Il file non è salvato") == "it"
+    strict = _LanguageIdentifier(short_min_confidence=1.0)
+    assert strict.detect("Il file non è salvato") is None
+    assert strict.detect("Il file non è stato salvato perché il disco è pieno") == "it"
+
+
+def test_close_runner_up_stays_auto():
+    identifier = _LanguageIdentifier(min_confidence=0.5, short_min_confidence=0.5, min_margin=10.0)
+    assert identifier.detect("Ti abbiamo inviato una email con un link") is None
+
+
+def test_detected_language_never_skips_the_model(llm):
+    fut = server.submit_translation_with_llm("Translation options", "auto", "fr")
+    assert fut.result(timeout=5) == "T(Translation options)"
+
+    text = "Ti abbiamo inviato una email con un link per reimpostare la password"
+    fut = server.submit_translation_with_llm(text, "auto", "it")
+    assert fut.result(timeout=5) == f"T({text})"
+    assert llm[-1] == (text, "auto", "it")
+
+
+def test_detected_language_goes_into_the_prompt(llm):
+    text = "Nous vous avons envoyé un lien pour réinitialiser le mot de passe"
+    server.submit_translation_with_llm(text, "auto", "de").result(timeout=5)
+    assert llm[-1] == (text, "fr", "de")
+
+
+def test_explicit_same_language_takes_the_fast_path(llm):
+    fut = server.submit_translation_with_llm("Paramètres du compte", "fr", "fr-CA")
+    assert fut.result(timeout=5) == "Paramètres du compte"
+    assert llm == []
@@ -0,0 +1,92 @@
+import pytest
+
+import server
+from scheduler import Preempted
+from server import _Completion, _parse_packed_output
+
+
+def test_parse_packed_output_orders_by_marker():
+    raw = "[2] Annulla\n[1] Salva\n[3] Chiudi"
+    assert _parse_packed_output(raw, 3) == ["Salva", "Annulla", "Chiudi"]
+
+
+def test_parse_packed_output_ignores_delimiters_and_blank_lines():
+    raw = "<<TEXT_TO_TRANSLATE>>\n\n[1] Salva\n\n  [2]Annulla  \n<<END_TEXT>>"
+    assert _parse_packed_output(raw, 2) == ["Salva", "Annulla"]
+
+
+def test_parse_packed_output_cleans_each_segment():
+    raw = "[1] Salva however this means save\n[2] Annulla"
+    assert _parse_packed_output(raw, 2) == ["Salva", "Annulla"]
+
+
+@pytest.mark.parametrize(
+    "raw",
+    [
+        "[1] Salva",  # missing segment
+        "[1] Salva\n[1] Salva\n[2] Annulla",  # duplicate marker
+        "[1] Salva\n[3] Annulla",  # out of range
+        "[0] Salva\n[1] Annulla",  # markers start at 1
+        "[1] Salva\nHere is the translation\n[2] Annulla",  # unnumbered line
+        "",
+    ],
+)
+def test_parse_packed_output_rejects_ambiguous_output(raw):
+    assert _parse_packed_output(raw, 2) is None
+
+
+# Replaces the packed llama.cpp call with `raw` (or an exception) and each
+# single-segment retry with a marked translation, recording the retries.
+@pytest.fixture
+def packed(monkeypatch):
+    calls = {"single": []}
+
+    def use(raw):
+        def fake_generate(messages, **kwargs):
+            calls["prompt"] = messages[-1]["content"]
+            if isinstance(raw, BaseException):
+                raise raw
+            return _Completion(raw, "stop", 10)
+
+        def fake_single(text, src_lang, tgt_lang):
+            calls["single"].append(text)
+            return f"single:{text}"
+
+        monkeypatch.setattr(server, "_generate", fake_generate)
+        monkeypatch.setattr(server, "_translate_with_llm_direct", fake_single)
+        return calls
+
+    return use
+
+
+def test_packed_prompt_numbers_segments(packed):
+    calls = packed("[1] Salva\n[2] Annulla")
+    assert server._translate_packed_direct([" Save ", "Cancel"], "en", "it") == ["Salva", "Annulla"]
+    assert "[1] Save\n[2] Cancel" in calls["prompt"]
+    assert calls["single"] == []
+
+
+def test_packed_falls_back_per_segment_when_output_is_ambiguous(packed):
+    calls = packed("Salva, Annulla")
+    out = server._translate_packed_direct(["Save", "Cancel"], "en", "it")
+    assert out == ["single:Save", "single:Cancel"]
+    assert calls["single"] == ["Save", "Cancel"]
+
+
+def test_packed_retries_only_empty_segments(packed):
+    calls = packed("[1] Salva\n[2]")
+    assert server._translate_packed_direct(["Save", "Cancel"], "en", "it") == ["Salva", "single:Cancel"]
+    assert calls["single"] == ["Cancel"]
+
+
+def test_packed_falls_back_when_the_call_fails(packed):
+    calls = packed(RuntimeError("backend down"))
+    assert server._translate_packed_direct(["Save", "Cancel"], "en", "it") == ["single:Save", "single:Cancel"]
+    assert calls["single"] == ["Save", "Cancel"]
+
+
+def test_packed_propagates_preemption(packed):
+    calls = packed(Preempted())
+    with pytest.raises(Preempted):
+        server._translate_packed_direct(["Save", "Cancel"], "en", "it")
+    assert calls["single"] == []
@@ -0,0 +1,51 @@
+import gzip
+import json
+
+from prewarm import read_corpus
+
+
+def _write(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def test_nested_locale_file_is_flattened(tmp_path, capsys):
+    locale = {
+        "common": {"save": "Save", "cancel": "Cancel"},
+        "settings": {"title": "Settings", "tabs": ["General", "Privacy"], "account": {"delete": "Delete account"}},
+        "version": 3,
+        "beta": None,
+    }
+    path = _write(tmp_path, "en.json", json.dumps(locale, indent=2))
+
+    assert [text for _, text in read_corpus(path)] == [
+        "Save",
+        "Cancel",
+        "Settings",
+        "General",
+        "Privacy",
+        "Delete account",
+    ]
+    assert "skipped 2 non-string value(s)" in capsys.readouterr().out
+
+
+def test_json_list_and_plain_text(tmp_path, capsys):
+    assert read_corpus(_write(tmp_path, "list.json", '["Save", ["Cancel"], {"a": "Close"}]')) == [
+        (None, "Save"),
+        (None, "Cancel"),
+        (None, "Close"),
+    ]
+    assert read_corpus(_write(tmp_path, "strings.txt", "Save\n\nCancel\n")) == [(None, "Save"), (None, "Cancel")]
+    assert capsys.readouterr().out == ""
+
+
+def test_cache_export_keeps_source_languages(tmp_path):
+    lines = [
+        {"src": "en", "tgt": "it", "text": "Save", "translation": "Salva", "ts": 1.0},
+        {"src": "de", "tgt": "it", "text": "Speichern", "translation": "Salva", "ts": 1.0},
+    ]
+    path = tmp_path / "export.ndjson.gz"
+    path.write_bytes(gzip.compress("\n".join(json.dumps(x) for x in lines).encode()))
+
+    assert read_corpus(str(path)) == [("en", "Save"), ("de", "Speichern")]
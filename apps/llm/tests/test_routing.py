@@ -0,0 +1,71 @@
+import threading
+
+import pytest
+
+import server
+from router import _HybridRouter
+
+
+class _FakeMt:
+    base_url = "http://mt.invalid"
+
+    def __init__(self, fail: bool):
+        self.fail = fail
+        # Answers only once the submission has returned, as a real call would.
+        self.go = threading.Event()
+
+    def pairs(self):
+        return {("en", "it")}
+
+    def translate(self, text, src, tgt):
+        assert self.go.wait(5)
+        if self.fail:
+            raise RuntimeError("mt down")
+        return f"MT({text})"
+
+    def close(self):
+        pass
+
+
+# Sends every item along route "both" (MT now, LLM refinement later).
+@pytest.fixture
+def route_both(monkeypatch, llm):
+    def make(*, fail: bool) -> _HybridRouter:
+        router = _HybridRouter(mode="cost", mt=_FakeMt(fail), queue=server._TRANSLATION_QUEUE, workers=1)
+        monkeypatch.setattr(router, "route", lambda text, pair, priority: "both")
+        monkeypatch.setattr(server, "_ROUTER", router)
+        return router
+
+    return make
+
+
+def _translate(router: _HybridRouter, text: str) -> str:
+    fut = server.submit_translation_with_llm(text, "en", "it")
+    router._mt.go.set()
+    result = fut.result(timeout=5)
+    # Done callbacks may still be running on the MT thread.
+    router._mt_pool.shutdown(wait=True)
+    return result
+
+
+def test_mt_result_is_refined_by_the_llm(route_both, llm):
+    router = route_both(fail=False)
+    text = "Reset the connection settings"
+
+    assert _translate(router, text) == f"MT({text})"
+
+    assert llm == [(text, "en", "it")]
+    assert router.stats()["refinements"] == 1
+    assert server._TRANSLATION_CACHE.get(("en", "it", text)) == f"T({text})"
+
+
+def test_failed_mt_falls_back_without_a_refinement(route_both, llm):
+    router = route_both(fail=True)
+    text = "Reset the connection settings"
+
+    assert _translate(router, text) == f"T({text})"
+
+    assert llm == [(text, "en", "it")]
+    stats = router.stats()
+    assert stats["mt_failures"] == 1
+    assert stats["refinements"] == 0
@@ -0,0 +1,224 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import DeadlineExceeded, Preempted, QueueFull, _PriorityWorkQueue, current_abort_event
+
+
+@pytest.fixture
+def make_queue():
+    queues = []
+
+    def make(**kwargs):
+        kwargs.setdefault("workers", 1)
+        q = _PriorityWorkQueue(**kwargs)
+        queues.append(q)
+        return q
+
+    yield make
+    for q in queues:
+        q._stop.set()
+
+
+# Occupies the (single) worker until released, so the items submitted in
+# the meantime are ordered by the scheduler rather than by arrival.
+class _Blocker:
+    def __init__(self, q, priority="critical"):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+        def run():
+            self.started.set()
+            assert self.release.wait(5)
+            return "blocker"
+
+        self.future = q.submit(priority=priority, fn=run, client="blocker")
+        assert self.started.wait(5)
+
+
+def _recorder(order, name):
+    def run():
+        order.append(name)
+        return name
+
+    return run
+
+
+def _results(futures):
+    return [f.result(timeout=5) for f in futures]
+
+
+def test_classes_run_in_priority_order(make_queue):
+    q = make_queue(aging_seconds=0)
+    blocker = _Blocker(q)
+    order = []
+    futures = [
+        q.submit(priority="background", fn=_recorder(order, "background")),
+        q.submit(priority="normal", fn=_recorder(order, "normal")),
+        q.submit(priority="critical", fn=_recorder(order, "critical")),
+    ]
+    blocker.release.set()
+    _results(futures)
+    assert order == ["critical", "normal", "background"]
+
+
+def test_one_client_stays_fifo(make_queue):
+    q = make_queue()
+    blocker = _Blocker(q)
+    order = []
+    futures = [q.submit(priority="normal", fn=_recorder(order, i), client="tab", cost=10 - i) for i in range(5)]
+    blocker.release.set()
+    _results(futures)
+    assert order == [0, 1, 2, 3, 4]
+
+
+def test_fair_queuing_interleaves_clients(make_queue):
+    q = make_queue()
+    blocker = _Blocker(q, priority="normal")
+    order = []
+    futures = [q.submit(priority="normal", fn=_recorder(order, f"a{i}"), client="a", cost=10) for i in range(4)]
+    futures += [q.submit(priority="normal", fn=_recorder(order, f"b{i}"), client="b", cost=10) for i in range(2)]
+    blocker.release.set()
+    _results(futures)
+    assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+def test_fair_queuing_honours_kind_weights(make_queue):
+    q = make_queue(weights={"job": 0.5})
+    blocker = _Blocker(q, priority="normal")
+    order = []
+    futures = [q.submit(priority="normal", fn=_recorder(order, f"job{i}"), client="job:7", cost=10) for i in range(2)]
+    futures += [q.submit(priority="normal", fn=_recorder(order, f"ui{i}"), client="ui", cost=10) for i in range(3)]
+    blocker.release.set()
+    _results(futures)
+    # The job advances 20 virtual units per item, the UI client 10.
+    assert order == ["ui0", "job0", "ui1", "ui2", "job1"]
+
+
+def test_expired_deadline_is_rejected_at_submit(make_queue):
+    q = make_queue()
+    fut = q.submit(priority="normal", fn=lambda: "never", deadline=time.monotonic() - 1)
+    with pytest.raises(DeadlineExceeded):
+        fut.result(timeout=1)
+
+
+def test_item_expiring_while_queued_is_dropped(make_queue):
+    q = make_queue()
+    blocker = _Blocker(q)
+    ran = []
+    fut = q.submit(priority="normal", fn=lambda: ran.append(1), deadline=time.monotonic() + 0.05)
+    time.sleep(0.1)
+    blocker.release.set()
+    with pytest.raises(DeadlineExceeded):
+        fut.result(timeout=5)
+    assert ran == []
+
+
+def test_promote_relaxes_the_deadline(make_queue):
+    q = make_queue()
+    blocker = _Blocker(q)
+    fut = q.submit(priority="background", fn=lambda: "done", deadline=time.monotonic() + 0.05)
+    assert q.promote(fut, "normal", deadline=None)
+    time.sleep(0.1)
+    blocker.release.set()
+    assert fut.result(timeout=5) == "done"
+
+
+def test_aging_lifts_long_waiting_background_work(make_queue):
+    q = make_queue(aging_seconds=0.05)
+    blocker = _Blocker(q)
+    order = []
+    futures = [q.submit(priority="background", fn=_recorder(order, "background"))]
+    time.sleep(0.15)
+    futures.append(q.submit(priority="normal", fn=_recorder(order, "normal")))
+    blocker.release.set()
+    _results(futures)
+    assert order == ["background", "normal"]
+
+
+# A background item that polls its abort flag like the llama.cpp stream does.
+def _preemptible(runs, started, finish):
+    def run():
+        runs.append(time.monotonic())
+        started.set()
+        while not finish.is_set():
+            abort = current_abort_event()
+            if abort is not None and abort.is_set():
+                raise Preempted()
+            time.sleep(0.005)
+        return "background"
+
+    return run
+
+
+def test_critical_work_preempts_running_background_item(make_queue):
+    q = make_queue(preempt=True)
+    runs, started, finish = [], threading.Event(), threading.Event()
+    background = q.submit(priority="background", fn=_preemptible(runs, started, finish))
+    assert started.wait(5)
+    started.clear()
+
+    critical = q.submit(priority="critical", fn=lambda: "critical")
+    assert critical.result(timeout=5) == "critical"
+    # Re-queued and restarted after the critical item, not failed.
+    assert started.wait(5)
+    finish.set()
+    assert background.result(timeout=5) == "background"
+    assert len(runs) == 2
+
+
+def test_preemption_stops_after_max_preemptions(make_queue):
+    q = make_queue(preempt=True, max_preemptions=0)
+    runs, started, finish = [], threading.Event(), threading.Event()
+    background = q.submit(priority="background", fn=_preemptible(runs, started, finish))
+    assert started.wait(5)
+    critical = q.submit(priority="critical", fn=lambda: "critical")
+    time.sleep(0.05)
+    assert not critical.done()
+    finish.set()
+    assert background.result(timeout=5) == "background"
+    assert critical.result(timeout=5) == "critical"
+    assert len(runs) == 1
+
+
+def test_non_preemptible_items_are_not_aborted(make_queue):
+    q = make_queue(preempt=True)
+    runs, started, finish = [], threading.Event(), threading.Event()
+    background = q.submit(priority="background", fn=_preemptible(runs, started, finish), preemptible=False)
+    assert started.wait(5)
+    critical = q.submit(priority="critical", fn=lambda: "critical")
+    time.sleep(0.05)
+    finish.set()
+    assert background.result(timeout=5) == "background"
+    assert critical.result(timeout=5) == "critical"
+    assert len(runs) == 1
+
+
+def test_full_class_rejects_the_heaviest_clients_newest_item(make_queue):
+    q = make_queue(capacity={"normal": 3}, shed_after=0)
+    blocker = _Blocker(q)
+    flood = [q.submit(priority="normal", fn=lambda: "flood", client="flood") for _ in range(3)]
+    other = q.submit(priority="normal", fn=lambda: "other", client="other")
+    with pytest.raises(QueueFull):
+        flood[-1].result(timeout=1)
+    # Now the flooding client holds 2 of 3 slots and may not push "other" out.
+    again = q.submit(priority="normal", fn=lambda: "again", client="flood")
+    with pytest.raises(QueueFull):
+        again.result(timeout=1)
+    blocker.release.set()
+    assert _results(flood[:2] + [other]) == ["flood", "flood", "other"]
+
+
+def test_cancel_withdraws_queued_items_only(make_queue):
+    q = make_queue()
+    blocker = _Blocker(q)
+    ran = []
+    fut = q.submit(priority="normal", fn=lambda: ran.append(1))
+    assert q.queued(fut)
+    assert q.cancel(fut)
+    assert fut.cancelled()
+    assert not q.cancel(blocker.future)
+    blocker.release.set()
+    assert blocker.future.result(timeout=5) == "blocker"
+    assert ran == []
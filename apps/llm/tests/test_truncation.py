@@ -0,0 +1,70 @@
+from concurrent.futures import Future
+
+import pytest
+
+import server
+from lengths import _OutputLengthModel
+from memory_cache import _TranslationCache
+from server import _Completion
+
+
+# Serves llama.cpp completions from `replies` (text, finish_reason) in
+# order and runs the queue inline, on a fresh cache and length model.
+@pytest.fixture
+def llama(monkeypatch):
+    replies = []
+    calls = []
+
+    def completion(messages, *, max_tokens, **kwargs):
+        calls.append(max_tokens)
+        text, reason = replies.pop(0)
+        return _Completion(text, reason, max_tokens)
+
+    def submit(priority, fn, **kwargs):
+        fut = Future()
+        fut.set_result(fn())
+        return fut
+
+    monkeypatch.setattr(server, "call_llama_completion", completion)
+    monkeypatch.setattr(server._TRANSLATION_QUEUE, "submit", submit)
+    monkeypatch.setattr(server, "_TRANSLATION_CACHE", _TranslationCache(max_bytes=1 << 20, ttl_seconds=60))
+    monkeypatch.setattr(server, "_LENGTHS", _OutputLengthModel())
+    monkeypatch.setattr(server, "_MEMORY", None)
+    monkeypatch.setattr(server, "_LANGID", None)
+    return replies, calls
+
+
+TEXT = "Your subscription renews automatically unless you cancel it"
+
+
+def test_output_still_truncated_after_the_retry_is_not_cached(llama):
+    replies, calls = llama
+    replies += [("Il tuo abbonamento si", "length"), ("Il tuo abbonamento si rinnova", "length")]
+
+    result = server.submit_translation_with_llm(TEXT, "en", "it").result(timeout=5)
+
+    assert result == "Il tuo abbonamento si rinnova"
+    assert len(calls) == 2 and calls[1] > calls[0]
+    assert server._TRANSLATION_CACHE.get(("en", "it", TEXT)) is None
+
+    replies.append(("Il tuo abbonamento si rinnova automaticamente", "stop"))
+    result = server.submit_translation_with_llm(TEXT, "en", "it").result(timeout=5)
+    assert result == "Il tuo abbonamento si rinnova automaticamente"
+    assert server._TRANSLATION_CACHE.get(("en", "it", TEXT)) == result
+
+
+def test_output_completed_by_the_retry_is_cached(llama):
+    replies, calls = llama
+    replies += [("Il tuo abbonamento si", "length"), ("Il tuo abbonamento si rinnova da solo", "stop")]
+
+    server.submit_translation_with_llm(TEXT, "en", "it").result(timeout=5)
+
+    assert server._TRANSLATION_CACHE.get(("en", "it", TEXT)) == "Il tuo abbonamento si rinnova da solo"
+
+
+def test_truncated_packed_output_retranslates_the_last_segment(llama):
+    replies, calls = llama
+    replies += [("[1] Salva\n[2] Annul", "length"), ("[1] Salva\n[2] Annul", "length"), ("Annulla", "stop")]
+
+    assert server._translate_packed_direct(["Save", "Cancel"], "en", "it") == ["Salva", "Annulla"]
+    assert replies == []
@@ -0,0 +1,256 @@
+"""
+Translation memory: reuse of translations for near-duplicate UI strings.
+
+The translation cache only hits on identical (normalized) text, so
+"Delete 3 files" and "Delete 4 files", or "Save changes" and
+"Save changes.", each cost a full generation. The memory stores every
+finished translation as a template:
+
+- numbers and placeholders (`{name}`, `{{count}}`, `%s`, `%(user)s`) become
+  numbered slots, provided each of them appears verbatim in the
+  translation; on reuse the slots are filled with the new request's tokens;
+- a trailing ".", ":" or "..." is split off and replaced by the request's
+  own (only when the translation ended with the same punctuation);
+- runs of whitespace are collapsed.
+
+Only identical templates are reused as translations, found with a dict
+lookup: the strings then differ in nothing but numbers, placeholders,
+whitespace or that punctuation. Similar strings are not interchangeable
+("can be changed" / "cannot be changed"), so a near match is only offered
+to the LLM as an example translation (`example`). Near matches are found by
+the Jaccard similarity of character trigrams through an inverted index;
+candidates only come from the rarest trigrams of the query (prefix
+filtering), so a lookup touches a few short posting lists instead of the
+whole memory.
+
+The memory is an LRU bounded by entry count; evicted entries are removed
+from the index.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from math import ceil
+from typing import Dict, List, Optional, Set, Tuple
+
+Pair = Tuple[str, str]
+_Key = Tuple[str, str, str]
+
+# Numbers and the placeholder syntaxes used by UI string catalogs.
+_SLOT_RE = re.compile(r"\{\{\s*[\w.]+\s*\}\}|\{[\w.]*\}|%(?:\([\w.]+\))?[sdif]|\d+(?:[.,:]\d+)*")
+_TRAILING_RE = re.compile(r"(\.\.\.|…|[.:])\s*$")
+_SLOT = "\x00{}\x00"
+_SLOT_FILL_RE = re.compile(r"\x00(\d+)\x00")
+
+
+# Replaces numbers and placeholders with numbered slots.
+def _template(text: str) -> Tuple[str, List[str]]:
+    tokens: List[str] = []
+
+    def _slot(m: re.Match) -> str:
+        tokens.append(m.group(0))
+        return _SLOT.format(len(tokens) - 1)
+
+    return _SLOT_RE.sub(_slot, text), tokens
+
+
+# Splits a trailing ".", ":" or ellipsis off `text`.
+def _split_trailing(text: str) -> Tuple[str, str]:
+    m = _TRAILING_RE.search(text)
+    if m is None:
+        return text, ""
+    return text[: m.start()], m.group(1)
+
+
+def _collapse_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+
+# Rewrites `target` so each source token becomes its slot. Returns None if
+# a token was translated, dropped or duplicated.
+def _template_target(target: str, tokens: List[str]) -> Optional[str]:
+    unused: Dict[str, List[int]] = {}
+    for i, tok in enumerate(tokens):
+        unused.setdefault(tok, []).append(i)
+    failed = False
+
+    def _slot(m: re.Match) -> str:
+        nonlocal failed
+        free = unused.get(m.group(0))
+        if not free:
+            failed = True
+            return m.group(0)
+        return _SLOT.format(free.pop(0))
+
+    out = _SLOT_RE.sub(_slot, target)
+    if failed or any(unused.values()):
+        return None
+    return out
+
+
+def _grams(text: str) -> Set[str]:
+    padded = f" {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _fill(template: str, tokens: List[str]) -> str:
+    return _SLOT_FILL_RE.sub(lambda m: tokens[int(m.group(1))], template)
+
+
+@dataclass
+class _Entry:
+    grams: Set[str]
+    slots: int
+    punct: str
+    target: str
+    # Translation without its trailing punctuation, if it had the source's.
+    target_core: Optional[str]
+    # The stored source and translation, offered as a prompt example.
+    example: Tuple[str, str]
+
+
+class _TranslationMemory:
+    def __init__(self, *, max_entries: int, min_similarity: float, max_chars: int = 500):
+        self.max_entries = max(1, int(max_entries))
+        self.min_similarity = min(1.0, max(0.0, float(min_similarity)))
+        self.max_chars = int(max_chars)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[_Key, _Entry]" = OrderedDict()
+        self._postings: Dict[Tuple[str, str, str], Set[_Key]] = {}
+        self.exact_hits = 0
+        self.examples = 0
+        self.misses = 0
+
+    def add(self, pair: Pair, source: str, target: str) -> None:
+        if not source or not target or len(source) > self.max_chars:
+            return
+        src_tmpl, tokens = _template(source)
+        tgt_tmpl = _template_target(target, tokens)
+        if tgt_tmpl is None:
+            return
+        core, punct = _split_trailing(src_tmpl)
+        core = _collapse_whitespace(core)
+        if not core:
+            return
+        target_core = None
+        if punct:
+            stripped, tgt_punct = _split_trailing(tgt_tmpl)
+            if tgt_punct == punct:
+                target_core = stripped.rstrip()
+        else:
+            target_core = tgt_tmpl
+        entry = _Entry(_grams(core), len(tokens), punct, tgt_tmpl, target_core, (source, target))
+
+        key = (pair[0], pair[1], core)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._unindex(key, old)
+            self._entries[key] = entry
+            for g in entry.grams:
+                self._postings.setdefault((pair[0], pair[1], g), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._unindex(evicted_key, evicted)
+
+    def _unindex(self, key: _Key, entry: _Entry) -> None:
+        for g in entry.grams:
+            posting_key = (key[0], key[1], g)
+            posting = self._postings.get(posting_key)
+            if posting is not None:
+                posting.discard(key)
+                if not posting:
+                    del self._postings[posting_key]
+
+    # Returns the reusable translation of `source` (same template), or None.
+    def lookup(self, pair: Pair, source: str) -> Optional[str]:
+        if not source or len(source) > self.max_chars:
+            return None
+        src_tmpl, tokens = _template(source)
+        core, punct = _split_trailing(src_tmpl)
+        key = (pair[0], pair[1], _collapse_whitespace(core))
+        with self._lock:
+            entry = self._entries.get(key)
+            result = self._render(entry, tokens, punct) if entry is not None else None
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return result
+            self.misses += 1
+            return None
+
+    # The (source, translation) of the most similar stored string, as an
+    # example for the prompt, or None.
+    def example(self, pair: Pair, source: str) -> Optional[Tuple[str, str]]:
+        if self.min_similarity >= 1.0 or not source or len(source) > self.max_chars:
+            return None
+        core = _collapse_whitespace(_split_trailing(_template(source)[0])[0])
+        with self._lock:
+            for match in self._similar(pair, _grams(core)):
+                if match[2] == core:
+                    continue
+                self._entries.move_to_end(match)
+                self.examples += 1
+                return self._entries[match].example
+            return None
+
+    # Keys of entries with similarity >= min_similarity, best first.
+    def _similar(self, pair: Pair, grams: Set[str]) -> List[_Key]:
+        if not grams:
+            return []
+        t = self.min_similarity
+        # Any entry with Jaccard >= t shares at least ceil(t * |grams|)
+        # trigrams with the query, hence at least one of its rarest
+        # len(grams) - that + 1 trigrams.
+        postings = [self._postings.get((pair[0], pair[1], g), set()) for g in grams]
+        postings.sort(key=len)
+        prefix = len(grams) - ceil(t * len(grams)) + 1
+        candidates: Set[_Key] = set()
+        for posting in postings[:prefix]:
+            candidates.update(posting)
+
+        scored = []
+        for key in candidates:
+            other = self._entries[key].grams
+            # Sets whose sizes differ by more than a factor t cannot match.
+            if len(other) * t > len(grams) or len(grams) * t > len(other):
+                continue
+            shared = len(grams & other)
+            score = shared / (len(grams) + len(other) - shared)
+            if score >= t:
+                scored.append((score, key))
+        scored.sort(key=lambda s: s[0], reverse=True)
+        return [key for _, key in scored]
+
+    @staticmethod
+    def _render(entry: _Entry, tokens: List[str], punct: str) -> Optional[str]:
+        if entry.slots != len(tokens):
+            return None
+        if punct == entry.punct:
+            return _fill(entry.target, tokens)
+        if entry.target_core is None:
+            return None
+        return _fill(entry.target_core, tokens) + punct
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "min_similarity": self.min_similarity,
+                "exact_hits": self.exact_hits,
+                "examples": self.examples,
+                "misses": self.misses,
+            }
+
+
+# None when TRANSLATION_MEMORY is disabled.
+def memory_from_env() -> Optional[_TranslationMemory]:
+    if os.environ.get("TRANSLATION_MEMORY", "1").strip() in ("", "0", "false"):
+        return None
+    return _TranslationMemory(
+        max_entries=int(os.environ.get("TRANSLATION_MEMORY_MAX_ENTRIES", "20000") or 1),
+        min_similarity=float(os.environ.get("TRANSLATION_MEMORY_MIN_SIMILARITY", "0.8") or 1.0),
+        max_chars=int(os.environ.get("TRANSLATION_MEMORY_MAX_CHARS", "500") or 0),
+    )
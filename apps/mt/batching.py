@@ -0,0 +1,133 @@
+"""
+Dynamic micro-batching for CTranslate2.
+
+`translate_batch` is much cheaper per sentence when it gets many sentences
+at once, but every HTTP request only carries one. A `_MicroBatcher` collects
+concurrent requests for the same model for up to `max_wait_ms` (or until
+`max_batch_size` requests are waiting), splits them by decoding options,
+sorts each group by token length to limit padding, runs one
+`translate_batch` call per group and hands each result back to its caller.
+There is one batcher per model, so the number of batching threads does not
+depend on the options clients send.
+
+Configuration:
+
+    MT_MAX_BATCH_SIZE=32   # sentences per translate_batch call
+    MT_MAX_WAIT_MS=10      # how long the first request waits for company
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List
+
+from tracing import add_span, current_trace
+
+Pieces = List[str]
+# Runs one batch of requests sharing the given decoding options.
+RunBatch = Callable[[List[Pieces], Hashable], List[Pieces]]
+_Entry = tuple[Pieces, Hashable, Future, float, object]
+
+
+# Collects requests for one model and runs them in batches on `workers`
+# dedicated threads (one batch per thread at a time).
+class _MicroBatcher:
+    def __init__(
+        self,
+        run_batch: RunBatch,
+        *,
+        max_batch_size: int,
+        max_wait_ms: float,
+        workers: int = 1,
+        name: str = "mt-batch",
+    ):
+        self._run_batch = run_batch
+        self._max_batch_size = max(1, int(max_batch_size))
+        self._max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        # (pieces, decoding options, future, submit time, trace of the
+        # submitting request)
+        self._pending: queue.SimpleQueue[_Entry] = queue.SimpleQueue()
+        self._workers = []
+        for i in range(max(1, int(workers))):
+            t = threading.Thread(target=self._worker_loop, name=f"{name}-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+
+    def submit(self, pieces: Pieces, options: Hashable) -> Future:
+        fut: Future = Future()
+        self._pending.put((pieces, options, fut, time.monotonic(), current_trace()))
+        return fut
+
+    def _collect(self) -> list[_Entry]:
+        batch = [self._pending.get()]
+        window_end = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            remaining = window_end - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._pending.get_nowait())
+                else:
+                    batch.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker_loop(self) -> None:
+        while True:
+            groups: Dict[Hashable, List[_Entry]] = {}
+            for entry in self._collect():
+                if entry[2].set_running_or_notify_cancel():
+                    groups.setdefault(entry[1], []).append(entry)
+            for options, batch in groups.items():
+                self._run(batch, options)
+
+    def _run(self, batch: List[_Entry], options: Hashable) -> None:
+        # Similar lengths next to each other: less padding per batch.
+        batch.sort(key=lambda entry: len(entry[0]))
+        started = time.monotonic()
+        try:
+            outputs = self._run_batch([entry[0] for entry in batch], options)
+        except Exception as e:
+            for _, _, fut, _, _ in batch:
+                fut.set_exception(e)
+            return
+        finally:
+            # Each request sees its wait for the batch and the batch run.
+            elapsed = time.monotonic() - started
+            for _, _, _, submitted, trace in batch:
+                if trace is not None:
+                    add_span("batch_wait", submitted, started - submitted, trace=trace)
+                    add_span("ct2.translate_batch", started, elapsed, trace=trace, batch_size=len(batch))
+        for (_, _, fut, _, _), out in zip(batch, outputs):
+            fut.set_result(out)
+
+
+# One `_MicroBatcher` per model key, created on first use.
+class _BatchingEngine:
+    def __init__(self, *, max_batch_size: int = 32, max_wait_ms: float = 10.0):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._lock = threading.Lock()
+        self._batchers: Dict[Hashable, _MicroBatcher] = {}
+
+    def submit(self, key: Hashable, pieces: Pieces, options: Hashable, run_batch: RunBatch, *, workers: int = 1) -> Future:
+        with self._lock:
+            batcher = self._batchers.get(key)
+            if batcher is None:
+                batcher = _MicroBatcher(
+                    run_batch,
+                    max_batch_size=self.max_batch_size,
+                    max_wait_ms=self.max_wait_ms,
+                    workers=workers,
+                    name=f"mt-batch-{len(self._batchers)}",
+                )
+                self._batchers[key] = batcher
+        return batcher.submit(pieces, options)
+
+
+def engine_from_env() -> _BatchingEngine:
+    return _BatchingEngine(
+        max_batch_size=int(os.environ.get("MT_MAX_BATCH_SIZE", "32") or 32),
+        max_wait_ms=float(os.environ.get("MT_MAX_WAIT_MS", "10") or 10),
+    )
@@ -1,17 +1,91 @@
+"""
+Builds the CTranslate2 models listed in pairs.tsv and writes registry.tsv.
+
+For each pair (`src->tgt <TAB> Hugging Face repo`):
+
+1. the model snapshot is downloaded into raw_models/ and converted with
+   `ct2-transformers-converter --quantization int8`. Pairs are downloaded
+   and converted in parallel (`--jobs`);
+2. the converted model is benchmarked with every candidate compute type on
+   the bundled sample sentences in samples/<src>.txt: sentences per second
+   for batched translation, median latency of a single sentence, and the
+   RAM the loaded model adds. Benchmarks run one after another, each in a
+   fresh process, so they do not compete for cores or share memory;
+3. the fastest compute type is written to registry.tsv together with the
+   measurements; models.py loads the pair with it.
+
+Rebuilds are incremental: a pair whose snapshot (Hugging Face commit),
+candidate list and converted model are unchanged keeps its registry line.
+
+Usage:
+
+    python convert.py [--pairs pairs.tsv] [--jobs N] [--compute-types int8,int8_float32,int16] [--force]
+
+Registry columns (tab separated):
+
+    pair  ct2_dir  spm_src  spm_tgt  raw_dir  compute_type=…  snapshot=…  candidates=…  bench_<type>=<sent/s>/<p50 ms>/<MB>
+
+MT_INTRA_THREADS is used for the benchmarks as it is by the service.
+"""
 from huggingface_hub import snapshot_download
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
-import subprocess, sys, os
-
-PAIRS = [
-    ("it","en","Helsinki-NLP/opus-mt-it-en"),
-    ("en","it","Helsinki-NLP/opus-mt-en-it"),
-]
+from typing import Dict, List, Optional
+import argparse, json, os, statistics, subprocess, sys, time
 
 BASE = Path(__file__).parent.resolve()
 RAW_DIR = BASE / "raw_models"
 CT2_DIR = BASE / "ct2_models"
-RAW_DIR.mkdir(parents=True, exist_ok=True)
-CT2_DIR.mkdir(parents=True, exist_ok=True)
+SAMPLES_DIR = BASE / "samples"
+PAIRS_FILE = BASE / "pairs.tsv"
+REGISTRY = BASE / "registry.tsv"
+
+DEFAULT_COMPUTE_TYPES = "int8,int8_float32,int16"
+_BENCH_ROUNDS = 3
+_BENCH_BATCH = 16
+
+@dataclass
+class _Pair:
+    src: str
+    tgt: str
+    repo: str
+
+    @property
+    def name(self) -> str:
+        return f"{self.src}->{self.tgt}"
+
+# Result of downloading and converting one pair.
+@dataclass
+class _Build:
+    pair: _Pair
+    raw_dir: Path
+    out_dir: Path
+    snapshot: str
+
+def read_pairs(path: Path) -> List[_Pair]:
+    pairs = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        spec, repo = line.split("\t", 1)
+        src, tgt = (p.strip() for p in spec.split("->", 1))
+        pairs.append(_Pair(src, tgt, repo.strip()))
+    return pairs
+
+# Previous registry lines by pair, with their key=value columns.
+def _read_registry(path: Path) -> Dict[str, Dict[str, str]]:
+    out: Dict[str, Dict[str, str]] = {}
+    if not path.exists():
+        return out
+    for line in path.read_text(encoding="utf-8").splitlines():
+        parts = line.split("\t")
+        if len(parts) < 4 or line.startswith("#"):
+            continue
+        keys = dict(p.split("=", 1) for p in parts[4:] if "=" in p)
+        keys["_line"] = line
+        out[parts[0]] = keys
+    return out
 
 def run(cmd: list[str]):
     print(">>", " ".join(cmd))
@@ -22,34 +96,183 @@ def ct2_converter_path() -> str:
     # use the venv Scripts folder (sibling of python.exe)
     return str(Path(sys.executable).with_name(exe))
 
-def main():
+def _convert(pair: _Pair, converter: str, previous: Dict[str, str], candidates: str, force: bool) -> Optional[_Build]:
+    print(f"=== {pair.name} :: {pair.repo}")
+    local = Path(snapshot_download(repo_id=pair.repo, cache_dir=str(RAW_DIR)))
+    spm_src = local / "source.spm"
+    spm_tgt = local / "target.spm"
+    if not spm_src.exists() or not spm_tgt.exists():
+        raise FileNotFoundError(f"Missing SentencePiece files in {local}")
+
+    out_dir = CT2_DIR / f"{pair.src}-{pair.tgt}-int8"
+    if (
+        not force
+        and previous.get("snapshot") == local.name
+        and previous.get("candidates") == candidates
+        and (out_dir / "model.bin").exists()
+    ):
+        print(f"=== {pair.name}: snapshot {local.name[:12]} unchanged, skipped")
+        return None
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    run([
+        converter,
+        "--model", str(local),
+        "--output_dir", str(out_dir),
+        "--quantization", "int8",
+        "--copy_files", "source.spm", "target.spm",
+        "--force",
+    ])
+    return _Build(pair, local, out_dir, local.name)
+
+# Peak RSS of this process in MB, or None where `resource` is unavailable.
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2**20 if sys.platform == "darwin" else 2**10)
+
+# Runs in a child process (`--bench-worker`): loads the model with
+# `compute_type` and measures it on the sample sentences.
+def _bench_worker(ct2_dir: str, spm_src: str, samples: str, compute_type: str) -> dict:
+    import ctranslate2 as ct2
+    import sentencepiece as spm
+
+    sp = spm.SentencePieceProcessor(model_file=spm_src)
+    sentences = [s for s in Path(samples).read_text(encoding="utf-8").splitlines() if s.strip()]
+    batch = [sp.encode(s, out_type=str) + ["</s>"] for s in sentences]
+    # same output budget as the service (main._decoding_length)
+    max_len = 2 * max(len(p) for p in batch) + 10
+    before = _peak_rss_mb()
+
+    translator = ct2.Translator(
+        ct2_dir,
+        device="cpu",
+        compute_type=compute_type,
+        inter_threads=1,
+        intra_threads=int(os.environ.get("MT_INTRA_THREADS", "0") or 0),
+    )
+    translator.translate_batch(batch[:4], beam_size=4, max_decoding_length=max_len)  # warm-up
+
+    start = time.perf_counter()
+    for _ in range(_BENCH_ROUNDS):
+        translator.translate_batch(batch, beam_size=4, max_decoding_length=max_len, max_batch_size=_BENCH_BATCH)
+    throughput = _BENCH_ROUNDS * len(batch) / (time.perf_counter() - start)
+
+    latencies = []
+    for pieces in batch:
+        t = time.perf_counter()
+        translator.translate_batch([pieces], beam_size=4, max_decoding_length=2 * len(pieces) + 10)
+        latencies.append((time.perf_counter() - t) * 1000)
+
+    after = _peak_rss_mb()
+    return {
+        "compute_type": compute_type,
+        "sents_per_sec": round(throughput, 1),
+        "p50_ms": round(statistics.median(latencies), 1),
+        "ram_mb": round(after - before, 1) if before is not None and after is not None else None,
+    }
+
+# Benchmarks every candidate in a fresh process; failures (e.g. a compute
+# type this CPU does not support) are reported and skipped.
+def _benchmark(build: _Build, candidates: List[str]) -> List[dict]:
+    samples = SAMPLES_DIR / f"{build.pair.src}.txt"
+    if not samples.exists():
+        print(f"WARNING: no samples for {build.pair.src} ({samples}); {build.pair.name} not benchmarked")
+        return []
+    results = []
+    for compute_type in candidates:
+        proc = subprocess.run(
+            [sys.executable, __file__, "--bench-worker",
+             str(build.out_dir), str(build.raw_dir / "source.spm"), str(samples), compute_type],
+            capture_output=True,
+            text=True,
+        )
+        lines = proc.stdout.strip().splitlines()
+        if proc.returncode != 0 or not lines:
+            err = (proc.stderr.strip().splitlines() or ["failed"])[-1]
+            print(f"WARNING: {build.pair.name} {compute_type}: {err}")
+            continue
+        result = json.loads(lines[-1])
+        print(
+            f"--- {build.pair.name} {compute_type}: {result['sents_per_sec']} sent/s, "
+            f"p50 {result['p50_ms']} ms, {result['ram_mb']} MB"
+        )
+        results.append(result)
+    return results
+
+def _registry_line(build: _Build, candidates: str, results: List[dict]) -> str:
+    if results:
+        winner = max(results, key=lambda r: r["sents_per_sec"])["compute_type"]
+    else:
+        winner = "default"
+    columns = [
+        build.pair.name,
+        str(build.out_dir),
+        str(build.raw_dir / "source.spm"),
+        str(build.raw_dir / "target.spm"),
+        str(build.raw_dir),
+        f"compute_type={winner}",
+        f"snapshot={build.snapshot}",
+        f"candidates={candidates}",
+    ]
+    for r in results:
+        ram = "" if r["ram_mb"] is None else r["ram_mb"]
+        columns.append(f"bench_{r['compute_type']}={r['sents_per_sec']}/{r['p50_ms']}/{ram}")
+    print(f"=== {build.pair.name}: compute_type={winner}")
+    return "\t".join(columns)
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pairs", type=Path, default=PAIRS_FILE)
+    parser.add_argument("--jobs", type=int, default=0, help="parallel conversions (default: one per pair, up to the CPU count)")
+    parser.add_argument("--compute-types", default=DEFAULT_COMPUTE_TYPES)
+    parser.add_argument("--force", action="store_true", help="rebuild pairs whose snapshot is unchanged")
+    args = parser.parse_args(argv)
+
+    pairs = read_pairs(args.pairs)
+    candidates = ",".join(c.strip() for c in args.compute_types.split(",") if c.strip())
+    previous = _read_registry(REGISTRY)
+    RAW_DIR.mkdir(parents=True, exist_ok=True)
+    CT2_DIR.mkdir(parents=True, exist_ok=True)
+
     converter = ct2_converter_path()
+    jobs = args.jobs or min(len(pairs), os.cpu_count() or 1)
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [
+            pool.submit(_convert, p, converter, previous.get(p.name, {}), candidates, args.force)
+            for p in pairs
+        ]
+        builds = []
+        for pair, fut in zip(pairs, futures):
+            try:
+                builds.append(fut.result())
+            except Exception as e:
+                print(f"WARNING: {pair.name} failed: {e}")
+                failed.append(pair.name)
+                builds.append(None)
+
     registry_lines = []
-    for src, tgt, repo in PAIRS:
-        print(f"=== {src}->{tgt} :: {repo}")
-        local = Path(snapshot_download(repo_id=repo, cache_dir=str(RAW_DIR)))
-
-        spm_src = local / "source.spm"
-        spm_tgt = local / "target.spm"
-        if not spm_src.exists() or not spm_tgt.exists():
-            raise FileNotFoundError(f"Missing SentencePiece files in {local}")
-
-        out_dir = CT2_DIR / f"{src}-{tgt}-int8"
-        out_dir.mkdir(parents=True, exist_ok=True)
-
-        run([
-            converter,
-            "--model", str(local),
-            "--output_dir", str(out_dir),
-            "--quantization", "int8",
-            "--copy_files", "source.spm", "target.spm",
-            "--force",
-        ])
-
-        registry_lines.append(f"{src}->{tgt}\t{out_dir}\t{spm_src}\t{spm_tgt}\t{local}")
-
-    (BASE / "registry.tsv").write_text("\n".join(registry_lines), encoding="utf-8")
+    for pair, build in zip(pairs, builds):
+        if build is not None:
+            results = _benchmark(build, candidates.split(","))
+            registry_lines.append(_registry_line(build, candidates, results))
+        elif pair.name in previous:
+            # unchanged, or failed this time: keep the last good build
+            registry_lines.append(previous[pair.name]["_line"])
+
+    header = "# pair\tct2_dir\tspm_src\tspm_tgt\traw_dir\tkey=value... (written by convert.py)"
+    REGISTRY.write_text("\n".join([header] + registry_lines) + "\n", encoding="utf-8")
     print("Wrote registry.tsv")
+    if failed:
+        sys.exit(f"Failed pairs: {', '.join(failed)}")
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) == 6 and sys.argv[1] == "--bench-worker":
+        print(json.dumps(_bench_worker(*sys.argv[2:])))
+    else:
+        main()
@@ -1,84 +1,226 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
 from pathlib import Path
-from typing import Dict, Tuple
-import ctranslate2 as ct2
-import sentencepiece as spm
+from typing import Callable, List, Tuple
+from concurrent.futures import Future
+import hmac
+import os
+import sys
+
+# tracing.py and profiler.py are shared with apps/llm.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "common"))
+
+from batching import engine_from_env
+from metrics import BATCH_SECONDS, BATCH_SIZE, REQUESTS, register_state
+from models import UnsupportedPair, manager_from_env
+from profiler import ProfilerBusy, profile_max_seconds, profiler_enabled, sample_stacks
+from segment import sentence_cache_from_env, split_sentences
+from tracing import activate, span, tracer_from_env
 
 BASE = Path(__file__).parent.resolve()
 REGISTRY = BASE / "registry.tsv"
 
 app = FastAPI(title="MT (CTranslate2 + Marian/OPUS-MT)")
 
+# Per-request traces (tracing.py). The LLM service's router passes its
+# X-Request-Id, so MT spans can be matched with the originating request.
+_tracer = tracer_from_env(slow_ms=1000)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    if _tracer is None or not _tracer.traced(request.url.path):
+        return await call_next(request)
+    request_id = request.headers.get("x-request-id", "").strip()[:64] or None
+    trace = _tracer.start(f"{request.method} {request.url.path}", request_id)
+    with activate(trace):
+        response = await call_next(request)
+    response.headers["X-Request-Id"] = trace.request_id
+    body = response.body_iterator
+
+    async def traced_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            _tracer.finish(trace, status=response.status_code)
+
+    response.body_iterator = traced_body()
+    return response
+
+# /admin endpoints require X-Admin-Token to match ADMIN_TOKEN, and are
+# refused while no token is configured.
+def _check_admin(request: Request) -> None:
+    token = os.environ.get("ADMIN_TOKEN", "")
+    if not token:
+        raise HTTPException(status_code=403, detail="admin_disabled")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", "").encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="forbidden")
+
+# Time-boxed sampling profile of the service as collapsed stacks
+# (flamegraph.pl / speedscope input), see profiler.py.
+@app.get("/admin/profile")
+def admin_profile(request: Request, seconds: float = 10.0, interval_ms: float = 5.0, idle: bool = False):
+    _check_admin(request)
+    if not profiler_enabled():
+        raise HTTPException(status_code=404, detail="profiler_disabled")
+    seconds = min(max(0.1, seconds), profile_max_seconds())
+    try:
+        stacks = sample_stacks(seconds, interval=max(1.0, interval_ms) / 1000, idle=idle)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="profile_running")
+    return Response(stacks, media_type="text/plain")
+
+# Recent slow requests with their full span breakdown.
+@app.get("/admin/traces/slow")
+def admin_slow_traces(request: Request):
+    _check_admin(request)
+    if _tracer is None:
+        raise HTTPException(status_code=404, detail="tracing_disabled")
+    return {"stats": _tracer.stats(), "traces": _tracer.slow_traces()}
+
 class Req(BaseModel):
     text: str
     src_lang: str
     tgt_lang: str
     options: dict | None = None
 
-# Load registry lines:
-# pair \t ct2_dir \t spm_src \t spm_tgt \t tok_dir(optional)
-_pairs: Dict[Tuple[str, str], dict] = {}
-if REGISTRY.exists():
-    for line in REGISTRY.read_text(encoding="utf-8").splitlines():
-        if not line.strip():
-            continue
-        parts = line.split("\t")
-        # tolerate both 4- and 5-column registries
-        if len(parts) >= 4:
-            pair, ct2_dir, spm_src, spm_tgt = parts[:4]
-            src, tgt = pair.split("->")
-            _pairs[(src, tgt)] = dict(ct2_dir=ct2_dir, spm_src=spm_src, spm_tgt=spm_tgt)
-else:
-    print("WARNING: registry.tsv not found. Run convert.py first.")
-
-_translators: Dict[Tuple[str, str], ct2.Translator] = {}
-_src_tok: Dict[str, spm.SentencePieceProcessor] = {}
-_tgt_tok: Dict[str, spm.SentencePieceProcessor] = {}
+class BatchReq(BaseModel):
+    items: List[Req]
+
+# Translators and tokenizers are owned by the model manager (models.py):
+# loaded once, kept in LRU order under MT_MEMORY_BUDGET_MB.
+_models = manager_from_env(REGISTRY)
+_pairs = _models.pairs
 
 def get_pair(src: str, tgt: str):
-    key = (src, tgt)
-    cfg = _pairs.get(key)
-    if not cfg:
+    try:
+        cfg = _models.config((src, tgt))
+    except UnsupportedPair:
         raise HTTPException(status_code=400, detail=f"unsupported_pair {src}->{tgt}")
-    if key not in _translators:
-        _translators[key] = ct2.Translator(cfg["ct2_dir"], device="cpu")
-    if cfg["spm_src"] not in _src_tok:
-        _src_tok[cfg["spm_src"]] = spm.SentencePieceProcessor(model_file=cfg["spm_src"])
-    if cfg["spm_tgt"] not in _tgt_tok:
-        _tgt_tok[cfg["spm_tgt"]] = spm.SentencePieceProcessor(model_file=cfg["spm_tgt"])
-    return _translators[key], _src_tok[cfg["spm_src"]], _tgt_tok[cfg["spm_tgt"]]
+    sp_src, sp_tgt = _models.tokenizers((src, tgt))
+    return cfg, sp_src, sp_tgt
 
 @app.get("/health")
 def health():
-    return {"status": "ok", "pairs": [f"{s}->{t}" for (s, t) in _pairs.keys()], "device": "cpu"}
+    return {"status": "ok", "pairs": [f"{s}->{t}" for (s, t) in _pairs.keys()], "device": "cpu", "models": _models.status(), "sentence_cache": _sentences.stats()}
+
+# 503 until the pairs in MT_PRELOAD_PAIRS are loaded.
+@app.get("/ready")
+def ready():
+    status = _models.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content={"status": "loading", **status})
+    return {"status": "ready", **status}
+
+_batching = engine_from_env()
+_sentences = sentence_cache_from_env()
+register_state(models=_models.status, sentences=_sentences.stats)
+
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+# Bounds for the client's decoding options.
+_MAX_BEAM_SIZE = 8
+_MAX_NEW_TOKENS = 1024
+
+def _decode_options(opts: dict | None) -> Tuple[int, int]:
+    opts = opts or {}
+    try:
+        beam_size = int(opts.get("beam_size", 4))
+        max_new_tokens = int(opts.get("max_new_tokens", 200))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=422, detail="invalid_options")
+    if not 1 <= beam_size <= _MAX_BEAM_SIZE:
+        raise HTTPException(status_code=422, detail=f"beam_size must be between 1 and {_MAX_BEAM_SIZE}")
+    if not 1 <= max_new_tokens <= _MAX_NEW_TOKENS:
+        raise HTTPException(status_code=422, detail=f"max_new_tokens must be between 1 and {_MAX_NEW_TOKENS}")
+    return beam_size, max_new_tokens
+
+# Output budget for one batch: proportional to its longest input, capped
+# by `max_new_tokens`, instead of a flat limit for every sentence.
+def _decoding_length(batch: List[List[str]], cap: int) -> int:
+    longest = max((len(p) for p in batch), default=0)
+    return max(1, min(cap, 2 * longest + 10))
+
+# Requests for the same model are batched together, one translate_batch
+# call per set of decoding options (see batching.py); the returned future
+# resolves to the target pieces.
+def _submit_sentence(pair: Tuple[str, str], pieces_in: List[str], beam_size: int, max_len: int, workers: int) -> Future:
+    # The translator is leased per batch, so an idle pair can be unloaded.
+    label = f"{pair[0]}->{pair[1]}"
+
+    def run_batch(batch: List[List[str]], options: Tuple[int, int]) -> List[List[str]]:
+        beam_size, max_len = options
+        BATCH_SIZE.labels(label).observe(len(batch))
+        with _models.lease(pair) as translator, BATCH_SECONDS.labels(label).time():
+            results = translator.translate_batch(
+                batch,
+                beam_size=beam_size,
+                max_decoding_length=_decoding_length(batch, max_len),
+                max_batch_size=_batching.max_batch_size,
+                end_token="</s>",
+            )
+        out = []
+        for res in results:
+            best = res.hypotheses[0] if res.hypotheses else []
+            out.append([t for t in best if t != "</s>"])
+        return out
+
+    return _batching.submit(pair, pieces_in, (beam_size, max_len), run_batch, workers=workers)
+
+# Splits the text into sentences and submits the ones not in the sentence
+# cache. Returns a function that waits for them and reassembles the text
+# with the original whitespace.
+def submit_translation(r: Req) -> Callable[[], str]:
+    cfg, sp_src, sp_tgt = get_pair(r.src_lang, r.tgt_lang)
+    pair = (r.src_lang, r.tgt_lang)
+    beam_size, max_len = _decode_options(r.options)
+    with span("segment") as attrs:
+        prefix, segments = split_sentences(r.text)
+        attrs["sentences"] = len(segments)
+
+    parts: List[str | Future] = []
+    keys = []
+    with span("sentence_cache") as attrs:
+        for sentence, _ in segments:
+            key = (pair, beam_size, max_len, sentence)
+            cached = _sentences.get(key)
+            if cached is not None:
+                parts.append(cached)
+            else:
+                pieces_in = sp_src.encode(sentence, out_type=str) + ["</s>"]
+                parts.append(_submit_sentence(pair, pieces_in, beam_size, max_len, cfg.inter_threads))
+            keys.append(key)
+        attrs["hits"] = sum(1 for p in parts if not isinstance(p, Future))
+
+    def result() -> str:
+        out = [prefix]
+        for part, key, (_, sep) in zip(parts, keys, segments):
+            if isinstance(part, Future):
+                pieces = part.result()
+                with span("decode"):
+                    part = sp_tgt.decode_pieces(pieces)
+                _sentences.set(key, part)
+            out.append(part + sep)
+        return "".join(out)
+
+    return result
 
 @app.post("/translate")
 def translate(r: Req):
+    REQUESTS.labels("translate").inc()
     if r.src_lang == r.tgt_lang:
         return {"translation": r.text}
 
-    translator, sp_src, sp_tgt = get_pair(r.src_lang, r.tgt_lang)
-
-    pieces = sp_src.encode(r.text, out_type=str)
-
-    pieces_in = pieces + ["</s>"]
-
-    opts = r.options or {}
-    beam_size = int(opts.get("beam_size", 4))
-    max_len = int(opts.get("max_new_tokens", 200))
-
-    results = translator.translate_batch(
-        [pieces_in],
-        beam_size=beam_size,
-        max_decoding_length=max_len,
-        end_token="</s>",
-    )
-
-    best = results[0].hypotheses[0] if results and results[0].hypotheses else []
-
-    best = [t for t in best if t != "</s>"]
-
-    text_out = sp_tgt.decode_pieces(best)
+    return {"translation": submit_translation(r)()}
 
-    return {"translation": text_out}
+# All items are submitted before waiting, so one call fills whole batches.
+@app.post("/translate_batch")
+def translate_batch(b: BatchReq):
+    REQUESTS.labels("translate_batch").inc()
+    pending = [None if r.src_lang == r.tgt_lang else submit_translation(r) for r in b.items]
+    translations = [r.text if wait is None else wait() for r, wait in zip(b.items, pending)]
+    return {"translations": translations}
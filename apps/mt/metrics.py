@@ -0,0 +1,62 @@
+"""
+Prometheus metrics for the MT service (`GET /metrics`).
+
+Batches and model loads are recorded as they happen; model residency and
+the sentence cache are read from their owners at scrape time.
+"""
+from typing import Callable
+
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+REQUESTS = Counter(
+    "mt_requests_total",
+    "Requests to the translation endpoints.",
+    ["endpoint"],
+)
+BATCH_SIZE = Histogram(
+    "mt_batch_size",
+    "Sentences per CTranslate2 batch.",
+    ["pair"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+BATCH_SECONDS = Histogram(
+    "mt_batch_duration_seconds",
+    "Duration of one `translate_batch` call.",
+    ["pair"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+MODEL_LOAD_SECONDS = Histogram(
+    "mt_model_load_seconds",
+    "Time to load a CTranslate2 model.",
+    ["pair"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+# Exposes the model manager and sentence cache state at scrape time.
+class _StateCollector:
+    def __init__(self, *, models: Callable[[], dict], sentences: Callable[[], dict]):
+        self._models = models
+        self._sentences = sentences
+
+    def collect(self):
+        status = self._models()
+        yield GaugeMetricFamily("mt_ready", "Whether the preloaded pairs are loaded.", value=1 if status["ready"] else 0)
+        loaded = GaugeMetricFamily("mt_model_in_use", "Batches running on each loaded model.", labels=["pair"])
+        for m in status["loaded"]:
+            loaded.add_metric([m["pair"]], m["in_use"])
+        yield loaded
+        yield GaugeMetricFamily("mt_model_memory_bytes", "Estimated memory of loaded models.", value=status["used_mb"] * 2**20)
+        yield CounterMetricFamily("mt_model_evictions", "Models unloaded to respect the memory budget.", value=status["evictions"])
+
+        cache = self._sentences()
+        yield GaugeMetricFamily("mt_sentence_cache_entries", "Entries in the sentence cache.", value=cache["size"])
+        lookups = CounterMetricFamily("mt_sentence_cache_lookups", "Sentence cache lookups.", labels=["result"])
+        lookups.add_metric(["hit"], cache["hits"])
+        lookups.add_metric(["miss"], cache["misses"])
+        yield lookups
+
+
+def register_state(*, models: Callable[[], dict], sentences: Callable[[], dict]) -> None:
+    REGISTRY.register(_StateCollector(models=models, sentences=sentences))
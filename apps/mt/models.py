@@ -0,0 +1,294 @@
+"""
+Model manager for the CTranslate2 service.
+
+Translators are loaded lazily, exactly once per pair even when several
+requests ask for a cold pair at the same time, and kept in LRU order. When a
+memory budget is configured, least-recently-used translators that are not
+currently translating are unloaded to make room for new ones.
+
+Registry lines (written by convert.py):
+
+    pair \\t ct2_dir \\t spm_src \\t spm_tgt [\\t tok_dir] [\\t key=value ...]
+
+Supported keys: `inter_threads`, `intra_threads`, `compute_type`, `device`.
+Missing keys fall back to MT_INTER_THREADS / MT_INTRA_THREADS /
+MT_COMPUTE_TYPE. convert.py sets `compute_type` to the fastest candidate of
+its benchmark; its other keys (`snapshot`, `candidates`, `bench_<type>`) are
+kept as build information and reported by `/health`.
+
+Configuration:
+
+    MT_MEMORY_BUDGET_MB=0          # 0 = never unload
+    MT_PRELOAD_PAIRS="it->en,en->it"  # or "*" for every registered pair
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import ctranslate2 as ct2
+import sentencepiece as spm
+
+from metrics import MODEL_LOAD_SECONDS
+
+Pair = Tuple[str, str]
+
+
+@dataclass
+class _PairConfig:
+    ct2_dir: str
+    spm_src: str
+    spm_tgt: str
+    tok_dir: Optional[str] = None
+    device: str = "cpu"
+    compute_type: str = "default"
+    inter_threads: int = 1
+    intra_threads: int = 0
+    # Other registry keys, e.g. convert.py's benchmark results.
+    build: Dict[str, str] = field(default_factory=dict)
+
+
+# A loaded translator with its estimated footprint and active users.
+@dataclass
+class _LoadedModel:
+    translator: ct2.Translator
+    size_bytes: int
+    loaded_at: float
+    in_use: int = 0
+
+
+# Raised for pairs that are not in the registry.
+class UnsupportedPair(KeyError):
+    pass
+
+
+def _split_pair(spec: str) -> Pair:
+    src, tgt = spec.strip().split("->", 1)
+    return src.strip(), tgt.strip()
+
+
+def load_registry(path: Path) -> Dict[Pair, _PairConfig]:
+    defaults = dict(
+        compute_type=os.environ.get("MT_COMPUTE_TYPE", "default") or "default",
+        inter_threads=int(os.environ.get("MT_INTER_THREADS", "1") or 1),
+        intra_threads=int(os.environ.get("MT_INTRA_THREADS", "0") or 0),
+    )
+    pairs: Dict[Pair, _PairConfig] = {}
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        parts = line.split("\t")
+        # tolerate 4- and 5-column registries; extra columns are key=value
+        if len(parts) < 4:
+            continue
+        pair, ct2_dir, spm_src, spm_tgt = parts[:4]
+        cfg = _PairConfig(ct2_dir=ct2_dir, spm_src=spm_src, spm_tgt=spm_tgt, **defaults)
+        for extra in parts[4:]:
+            extra = extra.strip()
+            if "=" not in extra:
+                cfg.tok_dir = extra or None
+                continue
+            key, value = (p.strip() for p in extra.split("=", 1))
+            if key in ("inter_threads", "intra_threads"):
+                setattr(cfg, key, int(value))
+            elif key in ("compute_type", "device"):
+                setattr(cfg, key, value)
+            else:
+                cfg.build[key] = value
+        pairs[_split_pair(pair)] = cfg
+    return pairs
+
+
+# Size of the converted model on disk, used as an estimate of its RAM use.
+def _model_size(ct2_dir: str) -> int:
+    root = Path(ct2_dir)
+    if not root.is_dir():
+        return 0
+    return sum(f.stat().st_size for f in root.iterdir() if f.is_file())
+
+
+class _ModelManager:
+    def __init__(self, pairs: Dict[Pair, _PairConfig], *, budget_bytes: int = 0):
+        self.pairs = pairs
+        self.budget_bytes = max(0, int(budget_bytes))
+        self._lock = threading.Lock()
+        self._models: "OrderedDict[Pair, _LoadedModel]" = OrderedDict()
+        self._loading: Dict[Pair, threading.Event] = {}
+        # Estimated size of models being loaded, so parallel loads of
+        # different pairs do not overshoot the budget together.
+        self._reserved: Dict[Pair, int] = {}
+        self._tokenizers: Dict[str, spm.SentencePieceProcessor] = {}
+        self._tok_lock = threading.Lock()
+        self._evictions = 0
+        self._preload: List[Pair] = []
+        self._ready = threading.Event()
+        self._ready.set()
+
+    def config(self, pair: Pair) -> _PairConfig:
+        cfg = self.pairs.get(pair)
+        if cfg is None:
+            raise UnsupportedPair(pair)
+        return cfg
+
+    def _tokenizer(self, model_file: str) -> spm.SentencePieceProcessor:
+        with self._tok_lock:
+            sp = self._tokenizers.get(model_file)
+            if sp is None:
+                sp = spm.SentencePieceProcessor(model_file=model_file)
+                self._tokenizers[model_file] = sp
+            return sp
+
+    # SentencePiece models are small and stay loaded.
+    def tokenizers(self, pair: Pair) -> Tuple[spm.SentencePieceProcessor, spm.SentencePieceProcessor]:
+        cfg = self.config(pair)
+        return self._tokenizer(cfg.spm_src), self._tokenizer(cfg.spm_tgt)
+
+    def _used_bytes_locked(self) -> int:
+        return sum(m.size_bytes for m in self._models.values()) + sum(self._reserved.values())
+
+    # Unloads idle LRU models until `incoming` more bytes fit in the budget.
+    def _evict_locked(self, incoming: int) -> None:
+        if not self.budget_bytes:
+            return
+        for pair in list(self._models):
+            if self._used_bytes_locked() + incoming <= self.budget_bytes:
+                return
+            if self._models[pair].in_use:
+                continue
+            del self._models[pair]
+            self._evictions += 1
+
+    # Loads `pair` if needed; concurrent callers wait for the first loader.
+    def _ensure_loaded(self, pair: Pair) -> None:
+        cfg = self.config(pair)
+        while True:
+            with self._lock:
+                if pair in self._models:
+                    return
+                loading = self._loading.get(pair)
+                if loading is None:
+                    loading = threading.Event()
+                    self._loading[pair] = loading
+                    size = _model_size(cfg.ct2_dir)
+                    self._evict_locked(size)
+                    self._reserved[pair] = size
+                    break
+            loading.wait()
+
+        try:
+            start = time.monotonic()
+            translator = ct2.Translator(
+                cfg.ct2_dir,
+                device=cfg.device,
+                compute_type=cfg.compute_type,
+                inter_threads=cfg.inter_threads,
+                intra_threads=cfg.intra_threads,
+            )
+            MODEL_LOAD_SECONDS.labels(f"{pair[0]}->{pair[1]}").observe(time.monotonic() - start)
+            with self._lock:
+                self._models[pair] = _LoadedModel(translator, size, time.time())
+        finally:
+            with self._lock:
+                self._loading.pop(pair, None)
+                self._reserved.pop(pair, None)
+            loading.set()
+
+    # Hands out a translator that will not be unloaded until the block exits.
+    @contextmanager
+    def lease(self, pair: Pair) -> Iterator[ct2.Translator]:
+        while True:
+            self._ensure_loaded(pair)
+            with self._lock:
+                model = self._models.get(pair)
+                if model is None:
+                    continue  # evicted between load and lease; load again
+                model.in_use += 1
+                self._models.move_to_end(pair)
+                break
+        try:
+            yield model.translator
+        finally:
+            with self._lock:
+                model.in_use -= 1
+
+    def preload(self, pairs: List[Pair]) -> None:
+        for pair in pairs:
+            try:
+                self._ensure_loaded(pair)
+                self.tokenizers(pair)
+            except Exception as e:
+                print(f"WARNING: failed to preload {pair[0]}->{pair[1]}: {e}")
+
+    # Loads `pairs` in a background thread; `ready` stays False until done.
+    def start_preload(self, pairs: List[Pair]) -> None:
+        if not pairs:
+            return
+        self._preload = list(pairs)
+        self._ready.clear()
+
+        def run() -> None:
+            try:
+                self.preload(pairs)
+            finally:
+                self._ready.set()
+
+        threading.Thread(target=run, name="mt-preload", daemon=True).start()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def status(self) -> dict:
+        with self._lock:
+            loaded = [
+                {
+                    "pair": f"{s}->{t}",
+                    "size_mb": round(m.size_bytes / 2**20, 1),
+                    "in_use": m.in_use,
+                    "compute_type": self.pairs[(s, t)].compute_type,
+                }
+                for (s, t), m in self._models.items()
+            ]
+            used = self._used_bytes_locked()
+            loading = [f"{s}->{t}" for (s, t) in self._loading]
+        return {
+            "ready": self.ready,
+            "preload": [f"{s}->{t}" for (s, t) in self._preload],
+            "loaded": loaded,
+            "loading": loading,
+            "used_mb": round(used / 2**20, 1),
+            "budget_mb": round(self.budget_bytes / 2**20, 1) if self.budget_bytes else None,
+            "evictions": self._evictions,
+            "builds": {f"{s}->{t}": {"compute_type": cfg.compute_type, **cfg.build} for (s, t), cfg in self.pairs.items()},
+        }
+
+
+def _preload_pairs(spec: str, pairs: Dict[Pair, _PairConfig]) -> List[Pair]:
+    spec = spec.strip()
+    if spec == "*":
+        return list(pairs)
+    out = []
+    for entry in spec.split(","):
+        if entry.strip():
+            pair = _split_pair(entry)
+            if pair in pairs:
+                out.append(pair)
+            else:
+                print(f"WARNING: MT_PRELOAD_PAIRS: unknown pair {entry.strip()}")
+    return out
+
+
+def manager_from_env(registry: Path) -> _ModelManager:
+    pairs: Dict[Pair, _PairConfig] = {}
+    if registry.exists():
+        pairs = load_registry(registry)
+    else:
+        print("WARNING: registry.tsv not found. Run convert.py first.")
+    budget_mb = float(os.environ.get("MT_MEMORY_BUDGET_MB", "0") or 0)
+    manager = _ModelManager(pairs, budget_bytes=int(budget_mb * 2**20))
+    manager.start_preload(_preload_pairs(os.environ.get("MT_PRELOAD_PAIRS", ""), pairs))
+    return manager
@@ -0,0 +1,100 @@
+"""
+Sentence segmentation and per-sentence caching for the MT service.
+
+Marian models are trained on single sentences: long inputs translate worse,
+decode slower and hit `max_decoding_length`. Texts are therefore split into
+sentences, translated as one batch and joined back with the original
+whitespace and line breaks, so
+
+    "".join(prefix + s + sep for s, sep in segments) == text
+
+holds for the segmentation returned by `split_sentences`.
+
+Configuration:
+
+    MT_SENTENCE_CACHE_SIZE=10000   # 0 disables the per-sentence cache
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Hashable, List, Optional, Tuple
+
+# End punctuation (plus closing quotes/brackets) followed by whitespace, or
+# a line break with the whitespace around it.
+_BOUNDARY_RE = re.compile(r"([.!?…。！？]+[\"'”’»)\]]*)(\s+)|(\s*\n\s*)")
+
+
+# Returns `(prefix, [(sentence, separator), ...])` where `prefix` is the
+# leading whitespace of `text` and every separator is kept verbatim.
+def split_sentences(text: str) -> Tuple[str, List[Tuple[str, str]]]:
+    body = text.lstrip()
+    prefix = text[: len(text) - len(body)]
+    segments: List[Tuple[str, str]] = []
+    start = 0
+    for m in _BOUNDARY_RE.finditer(body):
+        if m.group(3) is not None:
+            end, sep_start = m.start(), m.start()
+        else:
+            # "e.g. something": a lowercase continuation on the same line is
+            # not a new sentence.
+            nxt = body[m.end() : m.end() + 1]
+            if nxt and nxt.islower() and "\n" not in m.group(2):
+                continue
+            end, sep_start = m.end(1), m.start(2)
+        if m.end() >= len(body) and m.group(3) is None:
+            break
+        sentence = body[start:end]
+        if sentence:
+            segments.append((sentence, body[sep_start : m.end()]))
+        elif segments:
+            s, sep = segments[-1]
+            segments[-1] = (s, sep + body[sep_start : m.end()])
+        else:
+            prefix += body[sep_start : m.end()]
+        start = m.end()
+    rest = body[start:]
+    if rest:
+        stripped = rest.rstrip()
+        segments.append((stripped, rest[len(stripped) :]))
+    return prefix, segments
+
+
+# Thread-safe bounded LRU of translated sentences.
+class _SentenceCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max(0, int(max_entries))
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        if not self.max_entries:
+            return None
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: str) -> None:
+        if not self.max_entries:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._data)
+        return {"size": size, "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+def sentence_cache_from_env() -> _SentenceCache:
+    return _SentenceCache(int(os.environ.get("MT_SENTENCE_CACHE_SIZE", "10000") or 0))
@@ -1,6 +1,9 @@
 import { useEffect, useState } from "react";
 import { Outlet, NavLink, useLocation } from "react-router-dom";
-import { translateBatch } from "./auto-translator/translationClient";
+import {
+  translateBatch,
+  translateBatchStream,
+} from "./auto-translator/translationClient";
 import { installAutoTranslator } from "./auto-translator/installAutoTranslator";
 import { useLlmActivity } from "./llmActivity";
 import { LlmLoadingPill } from "./components/LlmLoadingPill/LlmLoadingPill";
@@ -22,6 +25,8 @@ export default function App() {
       srcLang: "auto",
       tgtLang: targetLang,
       translateBatch: (items, opts) => llm.run(() => translateBatch(items, opts)),
+      translateBatchStream: (items, onResult, opts) =>
+        llm.run(() => translateBatchStream(items, onResult, opts)),
       flushDelayMs: 120,
     });
     return cleanup;
@@ -0,0 +1,33 @@
+/**
+ * FNV-1a string hashing shared by DOM fingerprinting and the hash-first
+ * batch protocol.
+ */
+
+// 32-bit FNV-1a over UTF-16 code units, as 8 hex digits. `basis` is the
+// offset basis; the default is the standard one.
+export function fnv1a32Hex(s: string, basis = 0x811c9dc5) {
+  let hash = basis;
+  for (let i = 0; i < s.length; i++) {
+    hash ^= s.charCodeAt(i);
+    hash = Math.imul(hash, 0x01000193);
+  }
+  return (hash >>> 0).toString(16).padStart(8, "0");
+}
+
+// Mirrors the backend's cache-key normalization (_normalize_for_cache in
+// apps/llm/server.py), so equal keys give equal hashes. The backend trims
+// exactly the characters String.prototype.trim() removes (_TRIM_CHARS).
+function normalizeForCache(s: string) {
+  return s
+    .replace(/[\u2014\u2013\u2015\u2212]/g, " - ")
+    .replace(/\r\n?/g, "\n")
+    .trim();
+}
+
+// Content hash used by /translate_lookup: two 32-bit FNV-1a hashes with
+// different offset bases (64 bits, so collisions across a large cache stay
+// negligible). Must match content_hash() in apps/llm/server.py.
+export function contentHash(text: string) {
+  const s = normalizeForCache(text);
+  return fnv1a32Hex(s) + fnv1a32Hex(s, 0x050c5d1f);
+}
@@ -14,6 +14,7 @@ import {
   resetTranslatedState,
 } from "./domTextObserver";
 import { extractPlainText } from "./llmOutput";
+import { fnv1a32Hex } from "./contentHash";
 
 type TranslatorItem = {
   text: string;
@@ -27,11 +28,21 @@ type TranslateBatchFn = (
   opts?: { signal?: AbortSignal },
 ) => Promise<{ translations: string[] }>;
 
+// Streaming batch function: reports `{ index, translation }` per item as
+// soon as the backend has it (see translateBatchStream).
+type TranslateBatchStreamFn = (
+  items: TranslatorItem[],
+  onResult: (r: { index: number; translation: string | null }) => void,
+  opts?: { signal?: AbortSignal },
+) => Promise<void>;
+
 // Configuration options provided by the host application at install time.
 export type InstallAutoTranslatorOptions = {
   srcLang: string;
   tgtLang: string;
   translateBatch: TranslateBatchFn;
+  // When provided, batches are streamed and applied item by item.
+  translateBatchStream?: TranslateBatchStreamFn;
   flushDelayMs?: number;
 };
 
@@ -42,15 +53,6 @@ function normalizeForFingerprint(s: string) {
   return s.replace(/\s+/g, " ").trim();
 }
 
-function fnv1a32Hex(s: string) {
-  let hash = 0x811c9dc5;
-  for (let i = 0; i < s.length; i++) {
-    hash ^= s.charCodeAt(i);
-    hash = Math.imul(hash, 0x01000193);
-  }
-  return (hash >>> 0).toString(16).padStart(8, "0");
-}
-
 function fingerprintText(s: string) {
   return fnv1a32Hex(normalizeForFingerprint(s));
 }
@@ -97,6 +99,7 @@ export function installAutoTranslator({
   srcLang,
   tgtLang,
   translateBatch,
+  translateBatchStream,
   flushDelayMs = 300,
 }: InstallAutoTranslatorOptions) {
   let observer: ReturnType<typeof startDomTextObserver> | null = null;
@@ -325,6 +328,66 @@ export function installAutoTranslator({
     return takeSmallestN(queues[priority], batchSize);
   }
 
+  // Applies one translated batch entry to every DOM node waiting for it.
+  // Missing or unusable output falls back to the original text.
+  function applyBatchResult(b: PendingKey, translatedRaw: string) {
+    const extracted = extractPlainText(translatedRaw);
+    const translatedText =
+      extracted.kind === "ok"
+        ? sanitizeUiTranslation(b.key, extracted.text)
+        : b.key;
+
+    translationCache.set(b.key, translatedText);
+
+    const waitingNow = waitingNodesByKey.get(b.key) ?? [];
+    for (const { node, expectedFingerprint } of waitingNow) {
+      applyToNode(node, translatedText, expectedFingerprint);
+    }
+
+    waitingNodesByKey.delete(b.key);
+    pendingByKey.delete(b.key);
+  }
+
+  function applyWithObserverPaused(fn: () => void) {
+    observer?.pause();
+    try {
+      fn();
+    } finally {
+      observer?.resume();
+    }
+  }
+
+  // Streams one batch, applying each translation as soon as it arrives.
+  // Entries the stream never delivered are finalized afterwards.
+  async function runStreamedBatch(
+    batch: PendingKey[],
+    streamFn: TranslateBatchStreamFn,
+  ) {
+    const applied = new Set<number>();
+    try {
+      await streamFn(
+        batch.map((b) => b.item),
+        ({ index, translation }) => {
+          if (stopped || applied.has(index) || !batch[index]) return;
+          applied.add(index);
+          applyWithObserverPaused(() =>
+            applyBatchResult(batch[index], translation ?? ""),
+          );
+        },
+        { signal: abortController.signal },
+      );
+    } catch {
+      // Fall through: anything not delivered is finalized below.
+    }
+
+    if (stopped) return;
+    applyWithObserverPaused(() => {
+      batch.forEach((b, idx) => {
+        if (!applied.has(idx)) applyBatchResult(b, "");
+      });
+    });
+  }
+
   // Processes queued translation requests by priority, sending batched
   // requests to the backend and applying results incrementally.
   async function processQueue() {
@@ -337,6 +400,11 @@ export function installAutoTranslator({
         const batch = getNextBatch();
         if (!batch || batch.length === 0) break;
 
+        if (translateBatchStream) {
+          await runStreamedBatch(batch, translateBatchStream);
+          continue;
+        }
+
         let res: { translations: string[] } | null = null;
         try {
           res = await translateBatch(
@@ -351,29 +419,11 @@ export function installAutoTranslator({
 
         if (stopped) break;
 
-        observer?.pause();
-        try {
+        applyWithObserverPaused(() => {
           batch.forEach((b, idx) => {
-            const translatedRaw = res?.translations?.[idx] ?? "";
-            const extracted = extractPlainText(translatedRaw);
-            const translatedText =
-              extracted.kind === "ok"
-                ? sanitizeUiTranslation(b.key, extracted.text)
-                : b.key;
-
-            translationCache.set(b.key, translatedText);
-
-            const waitingNow = waitingNodesByKey.get(b.key) ?? [];
-            for (const { node, expectedFingerprint } of waitingNow) {
-              applyToNode(node, translatedText, expectedFingerprint);
-            }
-
-            waitingNodesByKey.delete(b.key);
-            pendingByKey.delete(b.key);
+            applyBatchResult(b, res?.translations?.[idx] ?? "");
           });
-        } finally {
-          observer?.resume();
-        }
+        });
       }
     } finally {
       running = false;
@@ -3,6 +3,8 @@
  * to the backend translation API.
  */
 
+import { contentHash } from "./contentHash";
+
 type BatchItem = {
   text: string;
   src_lang: string;
@@ -10,8 +12,133 @@ type BatchItem = {
   priority?: "critical" | "normal" | "background";
 };
 
+// Identifies this tab to the backend's fair scheduler, so one busy tab cannot
+// monopolize the shared model. Kept per tab (sessionStorage).
+export const CLIENT_ID = (() => {
+  const key = "translator-client-id";
+  try {
+    let id = window.sessionStorage.getItem(key);
+    if (!id) {
+      id = Math.random().toString(36).slice(2, 12);
+      window.sessionStorage.setItem(key, id);
+    }
+    return id;
+  } catch {
+    return Math.random().toString(36).slice(2, 12);
+  }
+})();
+
+// Waits `ms`, or rejects as soon as `signal` aborts.
+function sleep(ms: number, signal: AbortSignal) {
+  return new Promise<void>((resolve, reject) => {
+    const id = window.setTimeout(resolve, ms);
+    signal.addEventListener(
+      "abort",
+      () => {
+        window.clearTimeout(id);
+        reject(new DOMException("Aborted", "AbortError"));
+      },
+      { once: true },
+    );
+  });
+}
+
+// POSTs `items` and, while the backend answers 429 (its queue is full),
+// retries after the advertised Retry-After, a few times at most.
+async function postItems(url: string, items: BatchItem[], signal: AbortSignal) {
+  for (let attempt = 0; ; attempt++) {
+    const res = await fetch(url, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-Client-Id": CLIENT_ID,
+      },
+      body: JSON.stringify({ items }),
+      signal,
+    });
+    if (res.status !== 429 || attempt >= 3) return res;
+    const seconds = Number(res.headers.get("Retry-After")) || 1;
+    await sleep(seconds * 1000, signal);
+  }
+}
+
+// Cleared after the backend answers 404 (it predates /translate_lookup), so
+// later batches skip the extra round trip.
+let hashLookup = true;
+
+// Phase one of the hash-first protocol: sends only content hashes, one
+// request per language pair, and returns the translations the backend
+// already caches by item index. Items without one are then sent in full.
+// A failed lookup just means every item is sent.
+async function lookupCached(items: BatchItem[], signal: AbortSignal) {
+  const found = new Map<number, string>();
+  if (!hashLookup) return found;
+
+  const groups = new Map<
+    string,
+    { src_lang: string; tgt_lang: string; indices: Map<string, number[]> }
+  >();
+  items.forEach((it, i) => {
+    const pair = `${it.src_lang}\u0000${it.tgt_lang}`;
+    let group = groups.get(pair);
+    if (!group) {
+      group = {
+        src_lang: it.src_lang,
+        tgt_lang: it.tgt_lang,
+        indices: new Map(),
+      };
+      groups.set(pair, group);
+    }
+    const hash = contentHash(it.text);
+    const indices = group.indices.get(hash);
+    if (indices) indices.push(i);
+    else group.indices.set(hash, [i]);
+  });
+
+  await Promise.all(
+    [...groups.values()].map(async (group) => {
+      try {
+        const res = await fetch("/api/translate_lookup", {
+          method: "POST",
+          headers: {
+            "Content-Type": "application/json",
+            "X-Client-Id": CLIENT_ID,
+          },
+          body: JSON.stringify({
+            src_lang: group.src_lang,
+            tgt_lang: group.tgt_lang,
+            hashes: [...group.indices.keys()],
+          }),
+          signal,
+        });
+        if (res.status === 404) hashLookup = false;
+        if (!res.ok) return;
+        const data = (await res.json()) as {
+          translations: Record<string, string>;
+        };
+        for (const [hash, translation] of Object.entries(data.translations)) {
+          for (const i of group.indices.get(hash) ?? []) {
+            found.set(i, translation);
+          }
+        }
+      } catch (e) {
+        if (signal.aborted) throw e;
+      }
+    }),
+  );
+  return found;
+}
+
+// Indices of the items the lookup did not answer.
+function missingIndices(items: BatchItem[], found: Map<number, string>) {
+  const missing: number[] = [];
+  for (let i = 0; i < items.length; i++) if (!found.has(i)) missing.push(i);
+  return missing;
+}
+
 // Sends a batch translation request with timeout and abort support
-// to prevent stalled or overlapping requests.
+// to prevent stalled or overlapping requests. Strings the backend already
+// caches are resolved by hash first and not uploaded.
 export async function translateBatch(
   items: BatchItem[],
   opts?: { signal?: AbortSignal },
@@ -26,20 +153,96 @@ export async function translateBatch(
   }
 
   try {
-    const res = await fetch("/api/translate_batch", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify({ items }),
-      signal: controller.signal,
-    });
+    const found = await lookupCached(items, controller.signal);
+    const translations = items.map((_, i) => found.get(i) ?? null) as string[];
+    const missing = missingIndices(items, found);
+    if (missing.length === 0) return { translations };
+
+    const res = await postItems(
+      "/api/translate_batch",
+      missing.map((i) => items[i]),
+      controller.signal,
+    );
 
     if (!res.ok) {
       throw new Error(`Translation failed: ${res.status}`);
     }
 
-    return res.json() as Promise<{ translations: string[] }>;
+    const data = (await res.json()) as { translations: string[] };
+    missing.forEach((i, j) => {
+      translations[i] = data.translations[j];
+    });
+    return { translations };
+  } finally {
+    if (opts?.signal) opts.signal.removeEventListener("abort", onAbort);
+    window.clearTimeout(timeoutId);
+  }
+}
+
+export type BatchStreamResult = {
+  index: number;
+  translation: string | null;
+  error?: string;
+};
+
+// Streaming variant of translateBatch: reads the NDJSON response of
+// /translate_batch_stream and reports each item as soon as it arrives,
+// so finished strings can be applied before the slowest one completes.
+export async function translateBatchStream(
+  items: BatchItem[],
+  onResult: (r: BatchStreamResult) => void,
+  opts?: { signal?: AbortSignal },
+) {
+  const controller = new AbortController();
+  const timeoutId = window.setTimeout(() => controller.abort(), 60_000);
+
+  const onAbort = () => controller.abort();
+  if (opts?.signal) {
+    if (opts.signal.aborted) controller.abort();
+    else opts.signal.addEventListener("abort", onAbort, { once: true });
+  }
+
+  try {
+    // Known strings are reported right away; only the rest is streamed,
+    // with indices mapped back to `items`.
+    const found = await lookupCached(items, controller.signal);
+    found.forEach((translation, index) => onResult({ index, translation }));
+    const missing = missingIndices(items, found);
+    if (missing.length === 0) return;
+
+    const res = await postItems(
+      "/api/translate_batch_stream",
+      missing.map((i) => items[i]),
+      controller.signal,
+    );
+
+    if (!res.ok || !res.body) {
+      throw new Error(`Translation failed: ${res.status}`);
+    }
+
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = "";
+
+    const emitLine = (line: string) => {
+      if (!line.trim()) return;
+      const r = JSON.parse(line) as BatchStreamResult;
+      onResult({ ...r, index: missing[r.index] });
+    };
+
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffered += decoder.decode(value, { stream: true });
+
+      let nl = buffered.indexOf("\n");
+      while (nl !== -1) {
+        emitLine(buffered.slice(0, nl));
+        buffered = buffered.slice(nl + 1);
+        nl = buffered.indexOf("\n");
+      }
+    }
+    emitLine(buffered + decoder.decode());
   } finally {
     if (opts?.signal) opts.signal.removeEventListener("abort", onAbort);
     window.clearTimeout(timeoutId);
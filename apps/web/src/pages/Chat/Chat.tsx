@@ -1,4 +1,5 @@
 import { useEffect, useMemo, useRef, useState } from "react";
+import { CLIENT_ID } from "../../auto-translator/translationClient";
 import { useLlmActivity } from "../../llmActivity";
 import styles from "./Chat.module.css";
 
@@ -35,7 +36,7 @@ async function postSse(
 ) {
   const res = await fetch(url, {
     method: "POST",
-    headers: { "content-type": "application/json" },
+    headers: { "content-type": "application/json", "X-Client-Id": CLIENT_ID },
     body: JSON.stringify(body),
     signal,
   });